@@ -175,10 +175,16 @@ class AccountInvoice(models.Model):
 
         tax_grouped = {}
         round_curr = self.currency_id.round
-        for line in self.invoice_line_ids:
-            if not line.account_id or line.display_type:
-                continue
+        lines = self.invoice_line_ids.filtered(
+            lambda line: line.account_id and not line.display_type)
 
+        # Compute the fiscal taxes of all invoice lines at once, with the
+        # same arguments as account.tax compute_all
+        fiscal_taxes_results = self.env[
+            'l10n_br_fiscal.tax'].compute_taxes_batch(
+                lines, kwargs_method='_prepare_compute_all_taxes_kwargs')
+
+        for line in lines:
             taxes = line.invoice_line_tax_ids.compute_all(
                 price_unit=line.price_unit,
                 currency=line.invoice_id.currency_id,
@@ -197,7 +203,9 @@ class AccountInvoice(models.Model):
                 fiscal_price=line.fiscal_price,
                 fiscal_quantity=line.fiscal_quantity,
                 uot=line.uot_id,
-                icmssn_range=line.icmssn_range_id)['taxes']
+                icmssn_range=line.icmssn_range_id,
+                fiscal_taxes_results=fiscal_taxes_results.get(
+                    line.id))['taxes']
 
             for tax in taxes:
                 if tax.get('amount', 0.0) != 0.0:
@@ -106,6 +106,31 @@ class AccountInvoiceLine(models.Model):
         sign = self.invoice_id.type in ['in_refund', 'out_refund'] and -1 or 1
         self.price_subtotal_signed = price_subtotal_signed * sign
 
+    def _prepare_compute_all_taxes_kwargs(self):
+        """Arguments given by account.tax compute_all to compute_taxes
+        for this line, with its fallbacks to the product values."""
+        product = self.product_id
+        return {
+            'company': self.env.user.company_id,
+            'partner': self.invoice_id.partner_id,
+            'product': product,
+            'price_unit': self.price_unit,
+            'quantity': self.quantity,
+            'uom_id': product.uom_id,
+            'fiscal_price': self.fiscal_price or self.price_unit,
+            'fiscal_quantity': self.fiscal_quantity or self.quantity,
+            'uot_id': self.uot_id or product.uot_id,
+            'ncm': self.ncm_id or product.ncm_id,
+            'nbm': self.nbm_id or product.nbm_id,
+            'cest': self.cest_id or product.cest_id,
+            'discount_value': self.discount_value,
+            'insurance_value': self.insurance_value,
+            'other_costs_value': self.other_costs_value,
+            'freight_value': self.freight_value,
+            'operation_line': self.fiscal_operation_line_id,
+            'icmssn_range': self.icmssn_range_id,
+        }
+
     @api.depends('price_total')
     def _get_price_tax(self):
         for l in self:
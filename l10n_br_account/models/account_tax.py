@@ -35,7 +35,8 @@ class AccountTax(models.Model):
         fiscal_price=None,
         fiscal_quantity=None,
         uot=None,
-        icmssn_range=None
+        icmssn_range=None,
+        fiscal_taxes_results=None
     ):
         """ Returns all information required to apply taxes
             (in self + their children in case of a tax goup).
@@ -64,26 +65,28 @@ class AccountTax(models.Model):
         if not fiscal_taxes:
             fiscal_taxes = self.env['l10n_br_fiscal.tax']
 
-        # FIXME Should get company from document?
-        fiscal_taxes_results = fiscal_taxes.compute_taxes(
-            company=self.env.user.company_id,
-            partner=partner,
-            product=product,
-            price_unit=price_unit,
-            quantity=quantity,
-            uom_id=product.uom_id,
-            fiscal_price=fiscal_price or price_unit,
-            fiscal_quantity=fiscal_quantity or quantity,
-            uot_id=uot or product.uot_id,
-            ncm=ncm or product.ncm_id,
-            nbm=nbm or product.nbm_id,
-            cest=cest or product.cest_id,
-            discount_value=discount_value,
-            insurance_value=insurance_value,
-            other_costs_value=other_costs_value,
-            freight_value=freight_value,
-            operation_line=operation_line,
-            icmssn_range=icmssn_range)
+        # Fiscal taxes already computed by compute_taxes_batch
+        if fiscal_taxes_results is None:
+            # FIXME Should get company from document?
+            fiscal_taxes_results = fiscal_taxes.compute_taxes(
+                company=self.env.user.company_id,
+                partner=partner,
+                product=product,
+                price_unit=price_unit,
+                quantity=quantity,
+                uom_id=product.uom_id,
+                fiscal_price=fiscal_price or price_unit,
+                fiscal_quantity=fiscal_quantity or quantity,
+                uot_id=uot or product.uot_id,
+                ncm=ncm or product.ncm_id,
+                nbm=nbm or product.nbm_id,
+                cest=cest or product.cest_id,
+                discount_value=discount_value,
+                insurance_value=insurance_value,
+                other_costs_value=other_costs_value,
+                freight_value=freight_value,
+                operation_line=operation_line,
+                icmssn_range=icmssn_range)
 
         account_taxes_by_domain = {}
         for tax in self:
@@ -236,3 +236,15 @@ class TestCustomerInvoice(TransactionCase):
                 line.document_id.id,
                 self.invoice_3.fiscal_document_id.id,
                 "line.document_id should be equal account.fiscal_document_id")
+
+    def test_compute_all_taxes_kwargs(self):
+        line = self.invoice_1.invoice_line_ids[0]
+        line.write({'fiscal_price': 0.0, 'fiscal_quantity': 0.0})
+        kwargs = line._prepare_compute_all_taxes_kwargs()
+        self.assertEquals(
+            kwargs['fiscal_price'], 450.0,
+            "fiscal_price should fall back to the line price_unit")
+        self.assertEquals(
+            kwargs['fiscal_quantity'], 10.0,
+            "fiscal_quantity should fall back to the line quantity")
+        self.assertEquals(kwargs['company'], self.env.user.company_id)
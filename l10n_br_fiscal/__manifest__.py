@@ -99,6 +99,8 @@
         "wizards/wizard_document_correction_view.xml",
         "wizards/wizard_document_invalidate_view.xml",
         "wizards/wizard_document_status_view.xml",
+        "wizards/wizard_release_import_view.xml",
+        "wizards/wizard_tax_estimate_import_view.xml",
 
         # Actions
         "views/l10n_br_fiscal_action.xml",
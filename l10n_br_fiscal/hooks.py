@@ -2,11 +2,110 @@
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from odoo import _, tools
+from odoo import _, api, tools, SUPERUSER_ID
+
+from .tools import copy_loader
 
 _logger = logging.getLogger(__name__)
 
+# Models whose CSV files must be loaded before the CSV files of a model,
+# the NBMs and CESTs NCM lists are searched when they are created
+CSV_MODEL_DEPENDENCIES = {
+    "l10n_br_fiscal.nbm": ("l10n_br_fiscal.ncm",),
+    "l10n_br_fiscal.cest": ("l10n_br_fiscal.ncm",),
+}
+
+
+def _load_file(cr, file, kind):
+    start = time.time()
+
+    # NCM, NBM, NBS and CEST files can be loaded with COPY, much faster
+    # than creating their records one by one, if the fast_load_codes
+    # option is set in the config file
+    if not (tools.config.get("fast_load_codes")
+            and copy_loader.load_csv(cr, "l10n_br_fiscal", file)):
+        tools.convert_file(
+            cr,
+            "l10n_br_fiscal",
+            file,
+            None,
+            mode="init",
+            noupdate=True,
+            kind=kind,
+            report=None,
+        )
+    _logger.info("File %s loaded in %.2fs", file, time.time() - start)
+
+
+def _load_file_cursor(registry, file, kind):
+    with api.Environment.manage(), registry.cursor() as cr:
+        _load_file(cr, file, kind)
+
+
+def _csv_model(file):
+    basename, ext = os.path.splitext(os.path.basename(file))
+    return ext == ".csv" and basename.split("-")[0]
+
+
+def _file_levels(files):
+    """Split the files in levels of files which can be loaded at the
+    same time, each level only depends on the previous ones.
+
+    XML files may reference any record and depend on all previous files.
+    CSV files depend on the previous XML files, on the previous CSV files
+    of the same model and of the models in CSV_MODEL_DEPENDENCIES.
+    """
+    levels = {}
+    for index, file in enumerate(files):
+        model = _csv_model(file)
+        level = 0
+        for previous in files[:index]:
+            previous_model = _csv_model(previous)
+            if (not model or not previous_model
+                    or previous_model == model
+                    or previous_model in CSV_MODEL_DEPENDENCIES.get(
+                        model, ())):
+                level = max(level, levels[previous] + 1)
+        levels[file] = level
+
+    result = []
+    for file in files:
+        while len(result) <= levels[file]:
+            result.append([])
+        result[levels[file]].append(file)
+    return result
+
+
+def _load_files(cr, registry, files, kind):
+    """Load the files in order, or with the load_workers option of the
+    config file, load the independent files of each level in parallel
+    with their own cursors.
+
+    With load_workers the install is not atomic anymore: the files
+    loaded before each parallel level are committed, and stay in the
+    database if the module install fails afterwards. It is ignored when
+    the tests are enabled.
+    """
+    workers = int(tools.config.get("load_workers") or 1)
+    if (tools.config.get("test_enable")
+            or getattr(threading.currentThread(), "testing", False)):
+        workers = 1
+    for level in _file_levels(files):
+        if workers > 1 and len(level) > 1:
+            # The files loaded in parallel must see the previous ones
+            cr.commit()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(
+                    lambda f: _load_file_cursor(registry, f, kind), level))
+        else:
+            for file in level:
+                _load_file(cr, file, kind)
+
 
 def post_init_hook(cr, registry):
     """Import XML data to change core data"""
@@ -29,17 +128,7 @@ def post_init_hook(cr, registry):
     _logger.info(
         _("Loading l10n_br_fiscal fiscal files. It may take a minute..."))
 
-    for file in files:
-        tools.convert_file(
-            cr,
-            "l10n_br_fiscal",
-            file,
-            None,
-            mode="init",
-            noupdate=True,
-            kind="init",
-            report=None,
-        )
+    _load_files(cr, registry, files, "init")
 
     if not tools.config["without_demo"]:
         demofiles = [
@@ -75,17 +164,7 @@ def post_init_hook(cr, registry):
 
         _logger.info(_("Loading l10n_br_fiscal demo files."))
 
-        for f in demofiles:
-            tools.convert_file(
-                cr,
-                "l10n_br_fiscal",
-                f,
-                None,
-                mode="init",
-                noupdate=True,
-                kind="demo",
-                report=None,
-            )
+        _load_files(cr, registry, demofiles, "demo")
 
     elif tools.config["without_demo"]:
         prodfiles = []
@@ -108,17 +187,11 @@ def post_init_hook(cr, registry):
             " 3 minutes...")
         )
 
-        for f in prodfiles:
-            tools.convert_file(
-                cr,
-                "l10n_br_fiscal",
-                f,
-                None,
-                mode="init",
-                noupdate=True,
-                kind="init",
-                report=None,
-            )
+        _load_files(cr, registry, prodfiles, "init")
+
+    # Match the loaded NCMs with the NCM lists in a single pass
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env["l10n_br_fiscal.ncm"]._update_pending_memberships()
 
     # Load post files
     posloadfiles = [
@@ -129,14 +202,16 @@ def post_init_hook(cr, registry):
         _("Loading l10n_br_fiscal post init files. It may take a minute...")
     )
 
-    for file in posloadfiles:
-        tools.convert_file(
-            cr,
-            "l10n_br_fiscal",
-            file,
-            None,
-            mode="init",
-            noupdate=True,
-            kind="init",
-            report=None,
-        )
+    _load_files(cr, registry, posloadfiles, "init")
+
+    # Expand the NCM, CEST and NBM lists of the loaded tax definitions
+    # in a single batch
+    tax_definitions = env["l10n_br_fiscal.tax.definition"].search([
+        "|", "|", "|", "|",
+        ("ncms", "!=", False),
+        ("not_in_ncms", "!=", False),
+        ("ncm_exception", "!=", False),
+        ("cests", "!=", False),
+        ("nbms", "!=", False),
+    ])
+    tax_definitions.with_context(do_not_write=True)._search_codes()
@@ -0,0 +1,70 @@
+# Copyright (C) 2020  Renato Lima - Akretion <renato.lima@akretion.com.br>
+# License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
+
+import uuid
+
+from odoo import _, api, fields, models, tools
+
+# Caches of fiscal values renewed together:
+# tax: tax snapshots, compute order and compute taxes results
+# tax_definition: tax definitions indexes, applicability and DIFAL percents
+# operation_line: fiscal operations lines decision tables
+CACHE_GENERATIONS = ('tax', 'tax_definition', 'operation_line')
+
+
+def generation_key(name):
+    """Return the ormcache key expression of the generation of the
+    caches name, to add to the keys of the cached methods"""
+    return "self.env['l10n_br_fiscal.cache.generation']._get_generation" \
+           "('{}')".format(name)
+
+
+class CacheGeneration(models.Model):
+    """Generation tokens of the fiscal caches
+
+    The cached methods have the generation of their caches in their keys,
+    renewing it only invalidates these caches, in every worker, instead
+    of clearing all the registry caches.
+    """
+    _name = 'l10n_br_fiscal.cache.generation'
+    _description = 'Fiscal Cache Generation'
+
+    name = fields.Char(
+        string='Cache',
+        required=True,
+        readonly=True)
+
+    generation = fields.Char(
+        string='Generation',
+        readonly=True)
+
+    _sql_constraints = [(
+        'fiscal_cache_generation_name_uniq', 'unique (name)',
+        _('Cache generation already exists with this name !'))]
+
+    @api.model_cr
+    def init(self):
+        for name in CACHE_GENERATIONS:
+            self.env.cr.execute(
+                "INSERT INTO {} (name, generation) VALUES (%s, %s) "
+                "ON CONFLICT (name) DO NOTHING".format(self._table),
+                (name, uuid.uuid4().hex))
+
+    @api.model
+    @tools.ormcache('name')
+    def _get_generation_id(self, name):
+        return self.sudo().search([('name', '=', name)]).id
+
+    @api.model
+    def _get_generation(self, name):
+        """Return the current generation of the caches name, read once by
+        transaction"""
+        return self.sudo().browse(self._get_generation_id(name)).generation
+
+    @api.model
+    def _renew_generation(self, *names):
+        """Invalidate the caches names, a new token is used instead of a
+        counter so a rolled back generation is never reused"""
+        self.sudo().browse(
+            [self._get_generation_id(name) for name in names]).write(
+                {'generation': uuid.uuid4().hex})
@@ -46,11 +46,14 @@ class Cest(models.Model):
         readonly=True,
         string='NCMs')
 
-    @api.model
-    def create(self, values):
-        create_super = super(Cest, self).create(values)
-        if 'ncms' in values.keys():
-            create_super.with_context(do_not_write=True).action_search_ncms()
+    active = fields.Boolean(
+        string='Active',
+        default=True)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        create_super = super(Cest, self).create(vals_list)
+        create_super.with_context(do_not_write=True).action_search_ncms()
         return create_super
 
     @api.multi
@@ -63,8 +66,10 @@ class Cest(models.Model):
 
     @api.multi
     def action_search_ncms(self):
-        ncm = self.env['l10n_br_fiscal.ncm']
+        ncms = None
         for r in self:
             if r.ncms:
-                domain = misc.domain_field_codes(field_codes=r.ncms)
-                r.ncm_ids = ncm.search(domain)
+                if ncms is None:
+                    ncms = self.env['l10n_br_fiscal.ncm']._get_codes()
+                matcher = misc.CodeMatcher(field_codes=r.ncms)
+                r.ncm_ids = [(6, 0, matcher.filter(ncms))]
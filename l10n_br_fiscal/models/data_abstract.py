@@ -1,10 +1,15 @@
 # Copyright (C) 2019  Renato Lima - Akretion <renato.lima@akretion.com.br>
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
+import logging
+from collections import defaultdict
+
 from erpbrasil.base import misc
 from odoo import api, fields, models
 from odoo.osv import expression
 
+_logger = logging.getLogger(__name__)
+
 
 class DataAbstract(models.AbstractModel):
     _name = 'l10n_br_fiscal.data.abstract'
@@ -33,6 +38,91 @@ class DataAbstract(models.AbstractModel):
             # TODO mask code and unmasck
             r.code_unmasked = misc.punctuation_rm(r.code)
 
+    @api.model
+    def _get_codes(self):
+        """Return the (id, unmasked code, exception) of all records, to
+        match them in memory with tools.misc.CodeMatcher."""
+        fields_list = ['code_unmasked']
+        if 'exception' in self._fields:
+            fields_list.append('exception')
+        return [(r['id'], r['code_unmasked'], r.get('exception'))
+                for r in self.search_read([], fields_list)]
+
+    @api.model
+    def _get_release_key(self, values):
+        """Key matching a row of an official table release to a record"""
+        code = misc.punctuation_rm(values.get('code') or '')
+        if 'exception' in self._fields:
+            return code, values.get('exception') or False
+        return code
+
+    @api.model
+    def import_release(self, rows, archive_missing=True, domain=None):
+        """Upsert the rows of a new release of the official table.
+
+        The rows are dicts of field values matched to the records by code,
+        only the changed ones are written: the new codes are created, the
+        changed records updated (and unarchived) and, with archive_missing,
+        the records of domain missing from the release are archived.
+        Return a dict with the created, updated and archived records.
+        """
+        has_active = 'active' in self._fields
+        fields_list = sorted({f for row in rows for f in row} | {'code'})
+        read_fields = fields_list + (['active'] if has_active else [])
+
+        existing = {}
+        for record in self.with_context(active_test=False).search_read(
+                domain or [], read_fields):
+            existing[self._get_release_key(record)] = record
+
+        release = {}
+        for row in rows:
+            release[self._get_release_key(row)] = row
+
+        to_create = []
+        to_write = defaultdict(list)
+        for key, row in release.items():
+            record = existing.get(key)
+            if not record:
+                to_create.append(row)
+                continue
+
+            values = {}
+            for name, value in row.items():
+                current = record[name]
+                if self._fields[name].type == 'many2one' and current:
+                    current = current[0]
+                if (value or False) != (current or False):
+                    values[name] = value
+            if has_active and not record['active']:
+                values['active'] = True
+            if values:
+                to_write[tuple(sorted(values.items()))].append(record['id'])
+
+        created = self.create(to_create)
+
+        updated = self.browse()
+        for values, record_ids in to_write.items():
+            records = self.browse(record_ids)
+            records.write(dict(values))
+            updated |= records
+
+        archived = self.browse()
+        if archive_missing and has_active:
+            archived = self.browse([
+                r['id'] for key, r in existing.items()
+                if key not in release and r['active']])
+            archived.write({'active': False})
+
+        _logger.info(
+            "%s release imported: %s created, %s updated, %s archived",
+            self._name, len(created), len(updated), len(archived))
+        return {
+            'created': created,
+            'updated': updated,
+            'archived': archived,
+        }
+
     @api.model
     def _name_search(self, name, args=None, operator='ilike',
                      limit=100, name_get_uid=None):
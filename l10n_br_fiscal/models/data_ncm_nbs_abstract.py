@@ -2,15 +2,16 @@
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
 import logging
+import threading
 from datetime import timedelta
 from lxml import etree
 from erpbrasil.base import misc
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.addons import decimal_precision as dp
 from odoo.osv import orm
 
-from .ibpt.taxes import DeOlhoNoImposto
+from .ibpt.taxes import DeOlhoNoImposto, IbptFetcher
 
 _logger = logging.getLogger(__name__)
 
@@ -24,6 +25,9 @@ OBJECT_FIELDS = {
     'l10n_br_fiscal.nbs': 'nbs_id'
 }
 
+# Records updated between the commits of the scheduled update
+IBPT_UPDATE_CHUNK_SIZE = 200
+
 
 class DataNcmNbsAbstract(models.AbstractModel):
     _name = 'l10n_br_fiscal.data.ncm.nbs.abstract'
@@ -49,29 +53,49 @@ class DataNcmNbsAbstract(models.AbstractModel):
         digits=dp.get_precision('Fiscal Tax Percent'),
         compute='_compute_amount')
 
+    @api.multi
+    def _get_last_estimates(self):
+        """Return the (national, imported) estimate tax percents of the
+        last tax estimate of the user company of each record, by record
+        id, in one query for the whole recordset"""
+        object_field = OBJECT_FIELDS.get(self._name)
+        record_ids = tuple(r.id for r in self if isinstance(r.id, int))
+        if not object_field or not record_ids:
+            return {}
+
+        self.env.cr.execute("""
+            SELECT DISTINCT ON ({0})
+                {0},
+                federal_taxes_national + state_taxes + municipal_taxes,
+                federal_taxes_import + state_taxes + municipal_taxes
+            FROM l10n_br_fiscal_tax_estimate
+            WHERE {0} IN %s AND company_id = %s
+            ORDER BY {0}, create_date DESC, id DESC
+            """.format(object_field),
+            (record_ids, self.env.user.company_id.id))
+        return {r[0]: r[1:] for r in self.env.cr.fetchall()}
+
     @api.depends('tax_estimate_ids')
     def _compute_amount(self):
+        last_estimates = self._get_last_estimates()
         for record in self:
-            last_estimated = record.env['l10n_br_fiscal.tax.estimate'].search(
-                [('ncm_id', '=', record.id),
-                 ('company_id', '=', record.env.user.company_id.id)],
-                order='create_date DESC',
-                limit=1)
-
-            if last_estimated:
-                record.estimate_tax_imported = (
-                    last_estimated.federal_taxes_import
-                    + last_estimated.state_taxes
-                    + last_estimated.municipal_taxes)
-
-                record.estimate_tax_national = (
-                    last_estimated.federal_taxes_national
-                    + last_estimated.state_taxes
-                    + last_estimated.municipal_taxes)
-
-    def _get_ibpt(self, config, code_unmasked):
+            national, imported = last_estimates.get(record.id, (0.0, 0.0))
+            record.estimate_tax_national = national
+            record.estimate_tax_imported = imported
+
+    def _get_ibpt(self, config, code_unmasked, **kwargs):
         return False
 
+    @api.model
+    def _get_ibpt_fetcher(self):
+        """Return the IbptFetcher of the IBPT inquiries, its concurrent
+        requests and requests per second can be set with the
+        fiscal_ibpt_workers and fiscal_ibpt_rate options of the config
+        file."""
+        return IbptFetcher(
+            workers=int(tools.config.get('fiscal_ibpt_workers') or 4),
+            rate=float(tools.config.get('fiscal_ibpt_rate') or 0))
+
     @api.multi
     def action_ibpt_inquiry(self):
         if not self.env.user.company_id.ibpt_api:
@@ -80,18 +104,29 @@ class DataNcmNbsAbstract(models.AbstractModel):
         object_name = OBJECT_NAMES.get(self._name)
         object_field = OBJECT_FIELDS.get(self._name)
 
-        for record in self:
-            try:
-                company = self.env.user.company_id
+        company = self.env.user.company_id
 
-                config = DeOlhoNoImposto(
-                    company.ibpt_token,
-                    misc.punctuation_rm(company.cnpj_cpf),
-                    company.state_id.code)
+        config = DeOlhoNoImposto(
+            company.ibpt_token,
+            misc.punctuation_rm(company.cnpj_cpf),
+            company.state_id.code)
 
-                result = self._get_ibpt(config, record.code_unmasked)
+        # Only the HTTP requests are made by the fetcher threads, the
+        # results are written afterwards in batch by this cursor
+        with self._get_ibpt_fetcher() as fetcher:
+            results = fetcher.fetch(
+                self._get_ibpt, config, self.mapped('code_unmasked'))
 
-                values = {
+        estimate_values = []
+        updated = self.browse()
+        failures = []
+        for record in self:
+            try:
+                result = results.get(record.code_unmasked)
+                if isinstance(result, Exception):
+                    raise result
+
+                estimate_values.append({
                     object_field: record.id,
                     'key': result.chave,
                     'origin': result.fonte,
@@ -99,21 +134,57 @@ class DataNcmNbsAbstract(models.AbstractModel):
                     'state_taxes': result.estadual,
                     'federal_taxes_national': result.nacional,
                     'federal_taxes_import': result.importado,
-                }
-
-                self.env['l10n_br_fiscal.tax.estimate'].create(values)
-
-                record.message_post(
-                    body=_("{} Tax Estimate Updated").format(object_name),
-                    subject=_("{} Tax Estimate Updated").format(object_name))
+                })
+                updated |= record
 
             except Exception as e:
                 _logger.warning(
                     _("{0} Tax Estimate Failure: {1}").format(object_name, e))
-                record.message_post(
-                    body=str(e),
-                    subject=_("{} Tax Estimate Failure").format(object_name))
-                continue
+                failures.append((record, str(e)))
+
+        self.env['l10n_br_fiscal.tax.estimate'].create(estimate_values)
+
+        for record in updated:
+            record.message_post(
+                body=_("{} Tax Estimate Updated").format(object_name),
+                subject=_("{} Tax Estimate Updated").format(object_name))
+
+        for record, error in failures:
+            record.message_post(
+                body=error,
+                subject=_("{} Tax Estimate Failure").format(object_name))
+
+    @api.model
+    def _get_ibpt_update_ids(self, data_max):
+        """Return the ids of the records used by products without tax
+        estimate of the user company since data_max"""
+        object_field = OBJECT_FIELDS.get(self._name)
+        product_field = self._fields['product_tmpl_ids']
+        product_table = self.env[product_field.comodel_name]._table
+
+        self.env.cr.execute("""
+            SELECT r.id
+            FROM {table} r
+            WHERE EXISTS (
+                SELECT 1
+                FROM {product_table} p
+                WHERE p.{product_column} = r.id AND p.active)
+            AND NOT EXISTS (
+                SELECT 1
+                FROM l10n_br_fiscal_tax_estimate e
+                WHERE e.{object_field} = r.id
+                AND e.company_id = %(company_id)s
+                AND e.create_date >= %(create_date)s)
+            ORDER BY r.id
+            """.format(
+                table=self._table,
+                product_table=product_table,
+                product_column=product_field.inverse_name,
+                object_field=object_field), {
+                'company_id': self.env.user.company_id.id,
+                'create_date': data_max.strftime('%Y-%m-%d'),
+            })
+        return [r[0] for r in self.env.cr.fetchall()]
 
     @api.model
     def _scheduled_update(self):
@@ -127,38 +198,17 @@ class DataNcmNbsAbstract(models.AbstractModel):
         today = fields.date.today()
         data_max = today - timedelta(days=config_date)
 
-        all_records = self.env[self._name].search([])
-
-        not_estimated = all_records.filtered(
-            lambda r: r.product_tmpl_qty > 0 and not r.tax_estimate_ids)
-
-        query = """
-            WITH {0}_max_date AS (
-               SELECT
-                   {0}_id,
-                   max(create_date)
-               FROM
-                   l10n_br_fiscal_tax_estimate
-               GROUP BY {0}_id)
-               SELECT {0}_id
-               FROM {0}_max_date
-            WHERE max < %(create_date)s
-            """.format(object_name.lower())
-
-        query_params = {'create_date': data_max.strftime('%Y-%m-%d')}
-
-        self.env.cr.execute(self.env.cr.mogrify(query, query_params))
-        past_estimated = self.env.cr.fetchall()
-
-        ids = [estimate[0] for estimate in past_estimated]
-
-        record_past_estimated = self.env[self._name].browse(ids)
-
-        for record in not_estimated + record_past_estimated:
-            try:
-                record.action_ibpt_inquiry()
-            except Exception:
-                continue
+        record_ids = self._get_ibpt_update_ids(data_max)
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+
+        for i in range(0, len(record_ids), IBPT_UPDATE_CHUNK_SIZE):
+            records = self.browse(
+                record_ids[i:i + IBPT_UPDATE_CHUNK_SIZE])
+            records.action_ibpt_inquiry()
+            if auto_commit:
+                self.env.cr.commit()
+            # Keep the memory of the cron flat
+            self.invalidate_cache()
 
         _logger.info(
             _("Scheduled {} estimate taxes update complete.").format(
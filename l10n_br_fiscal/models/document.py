@@ -2,10 +2,12 @@
 # Copyright (C) 2019  KMEE
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
+import logging
 from ast import literal_eval
 
 from odoo import _, api, fields, models
 from odoo.exceptions import ValidationError
+from odoo.tools.sql import index_exists
 
 from ..constants.fiscal import (
     TAX_FRAMEWORK,
@@ -16,6 +18,24 @@ from ..constants.fiscal import (
     NFE_IND_IE_DEST,
 )
 
+_logger = logging.getLogger(__name__)
+
+# Expressions of the unique key of the active document numbers, the
+# partner is part of the key only for the documents issued by partners
+NUMBER_KEY = (
+    "COALESCE({0}company_id, 0)",
+    "{0}issuer",
+    "{0}document_type_id",
+    "COALESCE({0}document_serie, '')",
+    "{0}number",
+    "COALESCE(CASE WHEN {0}issuer = '%s' THEN {0}partner_id END, 0)"
+    % DOCUMENT_ISSUER_PARTNER,
+)
+
+# Deferred to the commit, so the _check_number errors are raised first
+# and the constraint only catches the numbers issued concurrently
+NUMBER_CONSTRAINT = "l10n_br_fiscal_document_number_uniq"
+
 
 class Document(models.Model):
     """ Implementação base dos documentos fiscais
@@ -43,79 +63,86 @@ class Document(models.Model):
         'l10n_br_fiscal.document.electronic']
     _description = 'Fiscal Document'
 
-    @api.depends('line_ids')
+    @api.model
+    def _get_amount_fields(self):
+        """Return the {document amount field: line field} totals computed
+        by _compute_amount, extend it to total new line fields"""
+        return {
+            'amount_untaxed': 'amount_untaxed',
+            'amount_icms_base': 'icms_base',
+            'amount_icms_value': 'icms_value',
+            'amount_ipi_base': 'ipi_base',
+            'amount_ipi_value': 'ipi_value',
+            'amount_pis_base': 'pis_base',
+            'amount_pis_value': 'pis_value',
+            'amount_pis_ret_base': 'pis_wh_base',
+            'amount_pis_ret_value': 'pis_wh_value',
+            'amount_cofins_base': 'cofins_base',
+            'amount_cofins_value': 'cofins_value',
+            'amount_cofins_ret_base': 'cofins_wh_base',
+            'amount_cofins_ret_value': 'cofins_wh_value',
+            'amount_csll_base': 'csll_base',
+            'amount_csll_value': 'csll_value',
+            'amount_csll_ret_base': 'csll_wh_base',
+            'amount_csll_ret_value': 'csll_wh_value',
+            'amount_issqn_base': 'issqn_base',
+            'amount_issqn_value': 'issqn_value',
+            'amount_issqn_ret_base': 'issqn_wh_base',
+            'amount_issqn_ret_value': 'issqn_wh_value',
+            'amount_irpj_base': 'irpj_base',
+            'amount_irpj_value': 'irpj_value',
+            'amount_irpj_ret_base': 'irpj_wh_base',
+            'amount_irpj_ret_value': 'irpj_wh_value',
+            'amount_inss_base': 'inss_base',
+            'amount_inss_value': 'inss_value',
+            'amount_inss_wh_base': 'inss_wh_base',
+            'amount_inss_wh_value': 'inss_wh_value',
+            'amount_tax': 'amount_tax',
+            'amount_discount': 'discount_value',
+            'amount_insurance_value': 'insurance_value',
+            'amount_other_costs_value': 'other_costs_value',
+            'amount_freight_value': 'freight_value',
+            'amount_total': 'amount_total',
+        }
+
+    @api.depends(lambda self: ['line_ids'] + [
+        'line_ids.' + line_field
+        for line_field in self._get_amount_fields().values()])
     def _compute_amount(self):
+        amount_fields = list(self._get_amount_fields().items())
         for record in self:
-            record.amount_untaxed = sum(
-                line.amount_untaxed for line in record.line_ids)
-            record.amount_icms_base = sum(
-                line.icms_base for line in record.line_ids)
-            record.amount_icms_value = sum(
-                line.icms_value for line in record.line_ids)
-            record.amount_ipi_base = sum(
-                line.ipi_base for line in record.line_ids)
-            record.amount_ipi_value = sum(
-                line.ipi_value for line in record.line_ids)
-            record.amount_pis_base = sum(
-                line.pis_base for line in record.line_ids)
-            record.amount_pis_value = sum(
-                line.pis_value for line in record.line_ids)
-            record.amount_pis_ret_base = sum(
-                line.pis_wh_base for line in record.line_ids)
-            record.amount_pis_ret_value = sum(
-                line.pis_wh_value for line in record.line_ids)
-            record.amount_cofins_base = sum(
-                line.cofins_base for line in record.line_ids)
-            record.amount_cofins_value = sum(
-                line.cofins_value for line in record.line_ids)
-            record.amount_cofins_ret_base = sum(
-                line.cofins_wh_base for line in record.line_ids)
-            record.amount_cofins_ret_value = sum(
-                line.cofins_wh_value for line in record.line_ids)
-            record.amount_csll_base = sum(
-                line.csll_base for line in record.line_ids)
-            record.amount_csll_value = sum(
-                line.csll_value for line in record.line_ids)
-            record.amount_csll_ret_base = sum(
-                line.csll_wh_base for line in record.line_ids)
-            record.amount_csll_ret_value = sum(
-                line.csll_wh_value for line in record.line_ids)
-            record.amount_issqn_base = sum(
-                line.issqn_base for line in record.line_ids)
-            record.amount_issqn_value = sum(
-                line.issqn_value for line in record.line_ids)
-            record.amount_issqn_ret_base = sum(
-                line.issqn_wh_base for line in record.line_ids)
-            record.amount_issqn_ret_value = sum(
-                line.issqn_wh_value for line in record.line_ids)
-            record.amount_irpj_base = sum(
-                line.irpj_base for line in record.line_ids)
-            record.amount_irpj_value = sum(
-                line.irpj_value for line in record.line_ids)
-            record.amount_irpj_ret_base = sum(
-                line.irpj_wh_base for line in record.line_ids)
-            record.amount_irpj_ret_value = sum(
-                line.irpj_wh_value for line in record.line_ids)
-            record.amount_inss_base = sum(
-                line.inss_base for line in record.line_ids)
-            record.amount_inss_value = sum(
-                line.inss_value for line in record.line_ids)
-            record.amount_inss_wh_base = sum(
-                line.inss_wh_base for line in record.line_ids)
-            record.amount_inss_wh_value = sum(
-                line.inss_wh_value for line in record.line_ids)
-            record.amount_tax = sum(
-                line.amount_tax for line in record.line_ids)
-            record.amount_discount = sum(
-                line.discount_value for line in record.line_ids)
-            record.amount_insurance_value = sum(
-                line.insurance_value for line in record.line_ids)
-            record.amount_other_costs_value = sum(
-                line.other_costs_value for line in record.line_ids)
-            record.amount_freight_value = sum(
-                line.freight_value for line in record.line_ids)
-            record.amount_total = sum(
-                line.amount_total for line in record.line_ids)
+            totals = dict.fromkeys(dict(amount_fields), 0.00)
+            # One pass over the lines for all the totals
+            for line in record.line_ids:
+                for field_name, line_field in amount_fields:
+                    totals[field_name] += line[line_field]
+            record.update(totals)
+
+    @api.multi
+    def _add_amounts(self, amounts):
+        """Add the {document id: {amount field: delta}} line deltas to the
+        stored totals, without summing again all the document lines"""
+        for document in self.browse(list(amounts)):
+            round_curr = document.currency_id.round
+            values = {
+                field_name: round_curr(document[field_name] + delta)
+                for field_name, delta in amounts[document.id].items()
+                if round_curr(delta)}
+            if values:
+                # _write marks the fields depending on the totals to
+                # recompute
+                document._write(values)
+
+        self.invalidate_cache(
+            list(self._get_amount_fields()), list(amounts))
+
+    @api.multi
+    def _reconcile_amount(self):
+        """Recompute from all the lines the totals kept up to date by the
+        line deltas, a safety net run when the document is confirmed"""
+        for field_name in self._get_amount_fields():
+            self.env.add_todo(self._fields[field_name], self)
+        self.recompute()
 
     # used mostly to enable _inherits of account.invoice on
     # fiscal_document when existing invoices have no fiscal document.
@@ -429,179 +456,214 @@ class Document(models.Model):
     amount_untaxed = fields.Monetary(
         string='Amount Untaxed',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_icms_base = fields.Monetary(
         string='ICMS Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_icms_value = fields.Monetary(
         string='ICMS Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_ipi_base = fields.Monetary(
         string='IPI Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_ipi_value = fields.Monetary(
         string='IPI Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_pis_base = fields.Monetary(
         string='PIS Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_pis_value = fields.Monetary(
         string='PIS Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_pis_ret_base = fields.Monetary(
         string='PIS Ret Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_pis_ret_value = fields.Monetary(
         string='PIS Ret Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_cofins_base = fields.Monetary(
         string='COFINS Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_cofins_value = fields.Monetary(
         string='COFINS Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_cofins_ret_base = fields.Monetary(
         string='COFINS Ret Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_cofins_ret_value = fields.Monetary(
         string='COFINS Ret Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_issqn_base = fields.Monetary(
         string='ISSQN Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_issqn_value = fields.Monetary(
         string='ISSQN Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_issqn_ret_base = fields.Monetary(
         string='ISSQN Ret Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_issqn_ret_value = fields.Monetary(
         string='ISSQN Ret Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_csll_base = fields.Monetary(
         string='CSLL Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_csll_value = fields.Monetary(
         string='CSLL Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_csll_ret_base = fields.Monetary(
         string='CSLL Ret Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_csll_ret_value = fields.Monetary(
         string='CSLL Ret Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_irpj_base = fields.Monetary(
         string='IRPJ Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_irpj_value = fields.Monetary(
         string='IRPJ Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_irpj_ret_base = fields.Monetary(
         string='IRPJ Ret Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_irpj_ret_value = fields.Monetary(
         string='IRPJ Ret Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_inss_base = fields.Monetary(
         string='INSS Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_inss_value = fields.Monetary(
         string='INSS Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_inss_wh_base = fields.Monetary(
         string='INSS Ret Base',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_inss_wh_value = fields.Monetary(
         string='INSS Ret Value',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_tax = fields.Monetary(
         string='Amount Tax',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_total = fields.Monetary(
         string='Amount Total',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_discount = fields.Monetary(
         string='Amount Discount',
         compute='_compute_amount',
+        store=True,
     )
 
     amount_insurance_value = fields.Monetary(
         string='Insurance Value',
         default=0.00,
         compute='_compute_amount',
+        store=True,
     )
 
     amount_other_costs_value = fields.Monetary(
         string='Other Costs',
         default=0.00,
         compute='_compute_amount',
+        store=True,
     )
 
     amount_freight_value = fields.Monetary(
         string='Freight Value',
         default=0.00,
         compute='_compute_amount',
+        store=True,
     )
 
     line_ids = fields.One2many(
@@ -678,29 +740,59 @@ class Document(models.Model):
         default=False,
     )
 
+    @api.model_cr
+    def init(self):
+        if index_exists(self.env.cr, NUMBER_CONSTRAINT):
+            return
+
+        self.env.cr.execute("""
+            SELECT count(*) FROM (
+                SELECT 1 FROM {table}
+                WHERE active AND COALESCE(number, '') != ''
+                GROUP BY {key} HAVING count(*) > 1) AS duplicated
+        """.format(table=self._table, key=", ".join(
+            k.format("") for k in NUMBER_KEY)))
+        duplicated = self.env.cr.fetchone()[0]
+        if duplicated:
+            _logger.warning(
+                "Constraint %s not created, %s document numbers are "
+                "duplicated.", NUMBER_CONSTRAINT, duplicated)
+            return
+
+        # A partial unique index that can be deferred
+        self.env.cr.execute("""
+            ALTER TABLE {table} ADD CONSTRAINT {name}
+            EXCLUDE ({key})
+            WHERE (active AND COALESCE(number, '') != '')
+            DEFERRABLE INITIALLY DEFERRED
+        """.format(table=self._table, name=NUMBER_CONSTRAINT, key=", ".join(
+            "({}) WITH =".format(k.format("")) for k in NUMBER_KEY)))
+
     @api.multi
-    @api.constrains('number')
+    @api.constrains('number', 'company_id', 'issuer', 'document_type_id',
+                    'document_serie', 'partner_id', 'active')
     def _check_number(self):
-        for record in self:
-            if not record.number:
-                return
-            domain = [
-                ('id', '!=', record.id),
-                ('active', '=', True),
-                ('company_id', '=', record.company_id.id),
-                ('issuer', '=', record.issuer),
-                ('document_type_id', '=', record.document_type_id.id),
-                ('document_serie', '=', record.document_serie),
-                ('number', '=', record.number)]
-
-            if record.issuer == DOCUMENT_ISSUER_PARTNER:
-                domain.append(('partner_id', '=', record.partner_id.id))
-
-            if record.env["l10n_br_fiscal.document"].search(domain):
-                raise ValidationError(_(
-                    "There is already a fiscal document with this "
-                    "Serie: {0}, Number: {1} !".format(
-                        record.document_serie, record.number)))
+        if not self.ids:
+            return
+
+        self.env.cr.execute("""
+            SELECT d.id, o.id FROM {table} d
+            JOIN {table} o ON o.id != d.id
+                AND o.active AND COALESCE(o.number, '') != ''
+                AND {key}
+            WHERE d.id IN %s AND COALESCE(d.number, '') != ''
+        """.format(table=self._table, key=" AND ".join(
+            "{} = {}".format(k.format("o."), k.format("d."))
+            for k in NUMBER_KEY)), (tuple(self.ids),))
+
+        duplicated = dict(self.env.cr.fetchall())
+        if duplicated:
+            raise ValidationError("\n".join(
+                _("There is already a fiscal document with this "
+                  "Serie: %s, Number: %s ! (%s)") % (
+                    record.document_serie, record.number,
+                    self.browse(duplicated[record.id]).display_name)
+                for record in self.browse(list(duplicated))))
 
     @api.multi
     def name_get(self):
@@ -713,7 +805,39 @@ class Document(models.Model):
     def create(self, values):
         if not values.get('date'):
             values['date'] = self._date_server_format()
-        return super().create(values)
+        document = super().create(values)
+        if (self.env.context.get('fiscal_defer_compute')
+                and values.get('line_ids')):
+            document.action_recompute_fiscal()
+        return document
+
+    @api.multi
+    def write(self, values):
+        if not (self.env.context.get('fiscal_defer_compute')
+                and values.get('line_ids')):
+            return super().write(values)
+
+        old_lines = self.mapped('line_ids')
+        result = super().write(values)
+
+        # Recompute the created, updated and linked lines
+        lines = self.mapped('line_ids')
+        touched_lines = lines - old_lines
+        for command in values['line_ids']:
+            if command[0] in (1, 4):
+                touched_lines |= lines.browse(command[1])
+        (touched_lines & lines)._recompute_fiscal()
+        self._reconcile_amount()
+        return result
+
+    @api.multi
+    def action_recompute_fiscal(self):
+        """Map and compute the taxes of all the document lines and the
+        document totals in one pass, used after creating the lines with
+        the fiscal_defer_compute context"""
+        self.mapped('line_ids')._recompute_fiscal()
+        self._reconcile_amount()
+        return True
 
     @api.onchange('company_id')
     def _onchange_company_id(self):
@@ -773,7 +897,8 @@ class Document(models.Model):
                         "Operation defined".format(l.fiscal_operation_id)))
                 l.fiscal_operation_id = fsc_op_line
                 l._onchange_fiscal_operation_id()
-                l._onchange_fiscal_operation_line_id()
+
+            new_doc.line_ids._map_fiscal_operation_line_taxes()
 
             return_docs |= new_doc
         return return_docs
@@ -814,6 +939,11 @@ class Document(models.Model):
         super()._exec_after_SITUACAO_EDOC_A_ENVIAR(old_state, new_state)
         self.document_comment()
 
+    def _document_confirm(self):
+        # Safety net of the totals kept up to date by the line deltas
+        self._reconcile_amount()
+        super()._document_confirm()
+
     @api.onchange('fiscal_operation_id')
     def _onchange_fiscal_operation_id(self):
         super()._onchange_fiscal_operation_id()
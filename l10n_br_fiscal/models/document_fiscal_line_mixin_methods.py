@@ -59,6 +59,31 @@ FISCAL_TAX_ID_FIELDS = [
     'pisst_tax_id',
 ]
 
+# Prefix of the line fields of each tax domain, e.g. ipi for ipi_tax_id
+# and the values returned by _prepare_fields_ipi
+TAX_DOMAIN_FIELDS = {
+    TAX_DOMAIN_IPI: 'ipi',
+    TAX_DOMAIN_II: 'ii',
+    TAX_DOMAIN_PIS: 'pis',
+    TAX_DOMAIN_PIS_ST: 'pisst',
+    TAX_DOMAIN_COFINS: 'cofins',
+    TAX_DOMAIN_COFINS_ST: 'cofinsst',
+    TAX_DOMAIN_ICMS: 'icms',
+    TAX_DOMAIN_ICMS_SN: 'icmssn',
+    TAX_DOMAIN_ICMS_ST: 'icmsst',
+    TAX_DOMAIN_ICMS_FCP: 'icmsfcp',
+    TAX_DOMAIN_ISSQN: 'issqn',
+    TAX_DOMAIN_CSLL: 'csll',
+    TAX_DOMAIN_IRPJ: 'irpj',
+    TAX_DOMAIN_INSS: 'inss',
+    TAX_DOMAIN_ISSQN_WH: 'issqn_wh',
+    TAX_DOMAIN_PIS_WH: 'pis_wh',
+    TAX_DOMAIN_COFINS_WH: 'cofins_wh',
+    TAX_DOMAIN_CSLL_WH: 'csll_wh',
+    TAX_DOMAIN_IRPJ_WH: 'irpj_wh',
+    TAX_DOMAIN_INSS_WH: 'inss_wh',
+}
+
 FISCAL_CST_ID_FIELDS = [
     'icms_cst_id',
     'ipi_cst_id',
@@ -114,26 +139,33 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
 
         return model_view
 
+    def _prepare_compute_taxes_kwargs(self):
+        """Arguments given to l10n_br_fiscal.tax compute_taxes for
+        this line, override it to change the values used to compute the
+        line taxes."""
+        return {
+            'company': self.company_id,
+            'partner': self.partner_id,
+            'product': self.product_id,
+            'price_unit': self.price_unit,
+            'quantity': self.quantity,
+            'uom_id': self.uom_id,
+            'fiscal_price': self.fiscal_price,
+            'fiscal_quantity': self.fiscal_quantity,
+            'uot_id': self.uot_id,
+            'discount_value': self.discount_value,
+            'insurance_value': self.insurance_value,
+            'other_costs_value': self.other_costs_value,
+            'freight_value': self.freight_value,
+            'ncm': self.ncm_id,
+            'nbm': self.nbm_id,
+            'cest': self.cest_id,
+            'operation_line': self.fiscal_operation_line_id,
+            'icmssn_range': self.icmssn_range_id,
+        }
+
     def _compute_taxes(self, taxes, cst=None):
-        return taxes.compute_taxes(
-            company=self.company_id,
-            partner=self.partner_id,
-            product=self.product_id,
-            price_unit=self.price_unit,
-            quantity=self.quantity,
-            uom_id=self.uom_id,
-            fiscal_price=self.fiscal_price,
-            fiscal_quantity=self.fiscal_quantity,
-            uot_id=self.uot_id,
-            discount_value=self.discount_value,
-            insurance_value=self.insurance_value,
-            other_costs_value=self.other_costs_value,
-            freight_value=self.freight_value,
-            ncm=self.ncm_id,
-            nbm=self.nbm_id,
-            cest=self.cest_id,
-            operation_line=self.fiscal_operation_line_id,
-            icmssn_range=self.icmssn_range_id)
+        return taxes.compute_taxes(**self._prepare_compute_taxes_kwargs())
 
     @api.multi
     def _prepare_br_fiscal_dict(self, default=False):
@@ -163,34 +195,44 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
 
         return taxes
 
+    @api.multi
+    def _write_fiscal_values(self, lines_values):
+        """Assign the [(line, values)] at once: the new lines (onchanges)
+        are updated in cache and the stored lines are written with one
+        write for each distinct values, instead of one write by field."""
+        groups = {}
+        for line, values in lines_values:
+            if self.env.in_onchange or not line.id:
+                line.update(values)
+                continue
+
+            values = self._convert_to_write(values)
+            key = repr(sorted(values.items()))
+            groups.setdefault(key, (values, []))[1].append(line.id)
+
+        for values, line_ids in groups.values():
+            self.browse(line_ids).write(values)
+
+    @api.multi
+    def _prepare_fields_all_taxes(self, tax_dict):
+        """Return the values of the fields of all the tax domains"""
+        values = {}
+        for field_prefix in TAX_DOMAIN_FIELDS.values():
+            values.update(getattr(
+                self, '_prepare_fields_' + field_prefix)(tax_dict))
+        return values
+
     @api.multi
     def _remove_all_fiscal_tax_ids(self):
+        lines_values = []
         for l in self:
-            l.fiscal_tax_ids = False
-
+            values = {'fiscal_tax_ids': False}
             for fiscal_tax_field in FISCAL_TAX_ID_FIELDS:
-                l[fiscal_tax_field] = False
-
-            self._set_fields_issqn(TAX_DICT_VALUES)
-            self._set_fields_csll(TAX_DICT_VALUES)
-            self._set_fields_irpj(TAX_DICT_VALUES)
-            self._set_fields_inss(TAX_DICT_VALUES)
-            self._set_fields_icms(TAX_DICT_VALUES)
-            self._set_fields_icmsfcp(TAX_DICT_VALUES)
-            self._set_fields_icmsst(TAX_DICT_VALUES)
-            self._set_fields_icmssn(TAX_DICT_VALUES)
-            self._set_fields_ipi(TAX_DICT_VALUES)
-            self._set_fields_ii(TAX_DICT_VALUES)
-            self._set_fields_pis(TAX_DICT_VALUES)
-            self._set_fields_pisst(TAX_DICT_VALUES)
-            self._set_fields_cofins(TAX_DICT_VALUES)
-            self._set_fields_cofinsst(TAX_DICT_VALUES)
-            self._set_fields_issqn_wh(TAX_DICT_VALUES)
-            self._set_fields_pis_wh(TAX_DICT_VALUES)
-            self._set_fields_cofins_wh(TAX_DICT_VALUES)
-            self._set_fields_csll_wh(TAX_DICT_VALUES)
-            self._set_fields_irpj_wh(TAX_DICT_VALUES)
-            self._set_fields_inss_wh(TAX_DICT_VALUES)
+                values[fiscal_tax_field] = False
+            values.update(l._prepare_fields_all_taxes(TAX_DICT_VALUES))
+            lines_values.append((l, values))
+
+        self._write_fiscal_values(lines_values)
 
     @api.multi
     def _update_fiscal_tax_ids(self, taxes):
@@ -203,83 +245,36 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
 
     @api.multi
     def _update_taxes(self):
+        computed_lines = self.env['l10n_br_fiscal.tax'].compute_taxes_batch(
+            self)
+        lines_values = []
         for l in self:
-            computed_taxes = self._compute_taxes(l.fiscal_tax_ids)
-            l.amount_tax_not_included = 0.0
-            l.amount_tax_withholding = 0.0
+            computed_taxes = computed_lines[l.id]
+            values = {
+                'amount_tax_not_included': 0.0,
+                'amount_tax_withholding': 0.0,
+            }
             for tax in l.fiscal_tax_ids:
 
                 computed_tax = computed_taxes.get(tax.tax_domain)
 
                 if computed_tax:
                     if not computed_tax.get("tax_include"):
-                        l.amount_tax_not_included = computed_tax.get(
+                        values['amount_tax_not_included'] = computed_tax.get(
                             "tax_value", 0.00)
                     if computed_tax.get("tax_withholding"):
-                        l.amount_tax_withholding += computed_tax.get(
+                        values['amount_tax_withholding'] += computed_tax.get(
                             "tax_value", 0.00)
 
-                if tax.tax_domain == TAX_DOMAIN_IPI:
-                    l.ipi_tax_id = tax
-                    self._set_fields_ipi(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_II:
-                    l.ii_tax_id = tax
-                    self._set_fields_ii(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_PIS:
-                    l.pis_tax_id = tax
-                    self._set_fields_pis(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_PIS_ST:
-                    l.pisst_tax_id = tax
-                    self._set_fields_pisst(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_COFINS:
-                    l.cofins_tax_id = tax
-                    self._set_fields_cofins(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_COFINS_ST:
-                    l.cofinsst_tax_id = tax
-                    self._set_fields_cofinsst(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_ICMS:
-                    l.icms_tax_id = tax
-                    self._set_fields_icms(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_ICMS_SN:
-                    l.icmssn_tax_id = tax
-                    self._set_fields_icmssn(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_ICMS_ST:
-                    l.icmsst_tax_id = tax
-                    self._set_fields_icmsst(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_ICMS_FCP:
-                    l.icmsfcp_tax_id = tax
-                    self._set_fields_icmsfcp(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_ISSQN:
-                    l.issqn_tax_id = tax
-                    self._set_fields_issqn(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_CSLL:
-                    l.csll_tax_id = tax
-                    self._set_fields_csll(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_IRPJ:
-                    l.irpj_tax_id = tax
-                    self._set_fields_irpj(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_INSS:
-                    l.inss_tax_id = tax
-                    self._set_fields_inss(computed_tax)
-
-                if tax.tax_domain == TAX_DOMAIN_ISSQN_WH:
-                    l.issqn_wh_tax_id = tax
-                    self._set_fields_issqn_wh(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_PIS_WH:
-                    l.pis_wh_tax_id = tax
-                    self._set_fields_pis_wh(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_COFINS_WH:
-                    l.cofins_wh_tax_id = tax
-                    self._set_fields_cofins_wh(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_CSLL_WH:
-                    l.csll_wh_tax_id = tax
-                    self._set_fields_csll_wh(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_IRPJ_WH:
-                    l.irpj_wh_tax_id = tax
-                    self._set_fields_irpj_wh(computed_tax)
-                if tax.tax_domain == TAX_DOMAIN_INSS_WH:
-                    l.inss_wh_tax_id = tax
-                    self._set_fields_inss_wh(computed_tax)
+                field_prefix = TAX_DOMAIN_FIELDS.get(tax.tax_domain)
+                if field_prefix:
+                    values[field_prefix + '_tax_id'] = tax
+                    values.update(getattr(
+                        l, '_prepare_fields_' + field_prefix)(computed_tax))
+
+            lines_values.append((l, values))
+
+        self._write_fiscal_values(lines_values)
 
     def _get_product_price(self):
         price = {
@@ -319,30 +314,47 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
 
     @api.onchange("fiscal_operation_line_id")
     def _onchange_fiscal_operation_line_id(self):
+        self._map_fiscal_operation_line_taxes()
+
+    def _map_fiscal_operation_line_taxes(self):
+        """Map the CFOP and fiscal taxes of the lines from their fiscal
+        operation lines, lines with the same company, partner and
+        operation line are mapped in a single batch."""
 
         # Reset Taxes
         self._remove_all_fiscal_tax_ids()
-        if self.fiscal_operation_line_id:
 
-            mapping_result = self.fiscal_operation_line_id.map_fiscal_taxes(
-                company=self.company_id,
-                partner=self.partner_id,
-                product=self.product_id,
-                ncm=self.ncm_id,
-                nbm=self.nbm_id,
-                nbs=self.nbs_id,
-                cest=self.cest_id)
-
-            self.cfop_id = mapping_result['cfop']
-            taxes = self.env['l10n_br_fiscal.tax']
-            for tax in mapping_result['taxes'].values():
-                taxes |= tax
-            self.fiscal_tax_ids = taxes
-            self._update_taxes()
-            self.comment_ids = self.fiscal_operation_line_id.comment_ids
-
-        if not self.fiscal_operation_line_id:
-            self.cfop_id = False
+        groups = {}
+        for line in self:
+            if not line.fiscal_operation_line_id:
+                continue
+            key = (line.company_id, line.partner_id,
+                   line.fiscal_operation_line_id)
+            groups.setdefault(key, []).append(line)
+
+        mapped_lines = self.browse()
+        lines_values = [
+            (line, {'cfop_id': False}) for line in self
+            if not line.fiscal_operation_line_id]
+        for (company, partner, operation_line), lines in groups.items():
+            mapping_results = operation_line.map_fiscal_taxes_batch(
+                company, partner,
+                [(line.product_id, line.ncm_id, line.nbm_id, line.nbs_id,
+                  line.cest_id) for line in lines])
+
+            for line, mapping_result in zip(lines, mapping_results):
+                taxes = self.env['l10n_br_fiscal.tax']
+                for tax in mapping_result['taxes'].values():
+                    taxes |= tax
+                lines_values.append((line, {
+                    'cfop_id': mapping_result['cfop'],
+                    'fiscal_tax_ids': taxes,
+                    'comment_ids': operation_line.comment_ids,
+                }))
+                mapped_lines |= line
+
+        self._write_fiscal_values(lines_values)
+        mapped_lines._update_taxes()
 
     @api.onchange("product_id")
     def _onchange_product_id_fiscal(self):
@@ -374,12 +386,14 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
         self._get_product_price()
         self._onchange_fiscal_operation_id()
 
-    def _set_fields_issqn(self, tax_dict):
+    def _prepare_fields_issqn(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.issqn_base = tax_dict.get("base")
-            self.issqn_percent = tax_dict.get("percent_amount")
-            self.issqn_reduction = tax_dict.get("percent_reduction")
-            self.issqn_value = tax_dict.get("tax_value")
+            values["issqn_base"] = tax_dict.get("base")
+            values["issqn_percent"] = tax_dict.get("percent_amount")
+            values["issqn_reduction"] = tax_dict.get("percent_reduction")
+            values["issqn_value"] = tax_dict.get("tax_value")
+        return values
 
     @api.onchange(
         "issqn_base",
@@ -389,12 +403,14 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_issqn_fields(self):
         pass
 
-    def _set_fields_issqn_wh(self, tax_dict):
+    def _prepare_fields_issqn_wh(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.issqn_wh_base = tax_dict.get("base")
-            self.issqn_wh_percent = tax_dict.get("percent_amount")
-            self.issqn_wh_reduction = tax_dict.get("percent_reduction")
-            self.issqn_wh_value = tax_dict.get("tax_value")
+            values["issqn_wh_base"] = tax_dict.get("base")
+            values["issqn_wh_percent"] = tax_dict.get("percent_amount")
+            values["issqn_wh_reduction"] = tax_dict.get("percent_reduction")
+            values["issqn_wh_value"] = tax_dict.get("tax_value")
+        return values
 
     @api.onchange(
         "issqn_wh_base",
@@ -404,12 +420,14 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_issqn_wh_fields(self):
         pass
 
-    def _set_fields_csll(self, tax_dict):
+    def _prepare_fields_csll(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.csll_base = tax_dict.get("base")
-            self.csll_percent = tax_dict.get("percent_amount")
-            self.csll_reduction = tax_dict.get("percent_reduction")
-            self.csll_value = tax_dict.get("tax_value")
+            values["csll_base"] = tax_dict.get("base")
+            values["csll_percent"] = tax_dict.get("percent_amount")
+            values["csll_reduction"] = tax_dict.get("percent_reduction")
+            values["csll_value"] = tax_dict.get("tax_value")
+        return values
 
     @api.onchange(
         "csll_base",
@@ -419,12 +437,14 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_csll_fields(self):
         pass
 
-    def _set_fields_csll_wh(self, tax_dict):
+    def _prepare_fields_csll_wh(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.csll_wh_base = tax_dict.get("base")
-            self.csll_wh_percent = tax_dict.get("percent_amount")
-            self.csll_wh_reduction = tax_dict.get("percent_reduction")
-            self.csll_wh_value = tax_dict.get("tax_value")
+            values["csll_wh_base"] = tax_dict.get("base")
+            values["csll_wh_percent"] = tax_dict.get("percent_amount")
+            values["csll_wh_reduction"] = tax_dict.get("percent_reduction")
+            values["csll_wh_value"] = tax_dict.get("tax_value")
+        return values
 
     @api.onchange(
         "csll_wh_base",
@@ -434,12 +454,14 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_csll_wh_fields(self):
         pass
 
-    def _set_fields_irpj(self, tax_dict):
+    def _prepare_fields_irpj(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.irpj_base = tax_dict.get("base")
-            self.irpj_percent = tax_dict.get("percent_amount")
-            self.irpj_reduction = tax_dict.get("percent_reduction")
-            self.irpj_value = tax_dict.get("tax_value")
+            values["irpj_base"] = tax_dict.get("base")
+            values["irpj_percent"] = tax_dict.get("percent_amount")
+            values["irpj_reduction"] = tax_dict.get("percent_reduction")
+            values["irpj_value"] = tax_dict.get("tax_value")
+        return values
 
     @api.onchange(
         "irpj_base",
@@ -449,12 +471,14 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_irpj_fields(self):
         pass
 
-    def _set_fields_irpj_wh(self, tax_dict):
+    def _prepare_fields_irpj_wh(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.irpj_wh_base = tax_dict.get("base")
-            self.irpj_wh_percent = tax_dict.get("percent_amount")
-            self.irpj_wh_reduction = tax_dict.get("percent_reduction")
-            self.irpj_wh_value = tax_dict.get("tax_value")
+            values["irpj_wh_base"] = tax_dict.get("base")
+            values["irpj_wh_percent"] = tax_dict.get("percent_amount")
+            values["irpj_wh_reduction"] = tax_dict.get("percent_reduction")
+            values["irpj_wh_value"] = tax_dict.get("tax_value")
+        return values
 
     @api.onchange(
         "irpj_wh_base",
@@ -464,12 +488,14 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_irpj_wh_fields(self):
         pass
 
-    def _set_fields_inss(self, tax_dict):
+    def _prepare_fields_inss(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.inss_base = tax_dict.get("base")
-            self.inss_percent = tax_dict.get("percent_amount")
-            self.inss_reduction = tax_dict.get("percent_reduction")
-            self.inss_value = tax_dict.get("tax_value")
+            values["inss_base"] = tax_dict.get("base")
+            values["inss_percent"] = tax_dict.get("percent_amount")
+            values["inss_reduction"] = tax_dict.get("percent_reduction")
+            values["inss_value"] = tax_dict.get("tax_value")
+        return values
 
     @api.onchange(
         "inss_base",
@@ -479,12 +505,14 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_inss_fields(self):
         pass
 
-    def _set_fields_inss_wh(self, tax_dict):
+    def _prepare_fields_inss_wh(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.inss_wh_base = tax_dict.get("base")
-            self.inss_wh_percent = tax_dict.get("percent_amount")
-            self.inss_wh_reduction = tax_dict.get("percent_reduction")
-            self.inss_wh_value = tax_dict.get("tax_value")
+            values["inss_wh_base"] = tax_dict.get("base")
+            values["inss_wh_percent"] = tax_dict.get("percent_amount")
+            values["inss_wh_reduction"] = tax_dict.get("percent_reduction")
+            values["inss_wh_value"] = tax_dict.get("tax_value")
+        return values
 
     @api.onchange(
         "inss_wh_base",
@@ -494,35 +522,40 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_inss_wh_fields(self):
         pass
 
-    def _set_fields_icms(self, tax_dict):
+    def _prepare_fields_icms(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.icms_cst_id = tax_dict.get("cst_id")
-            self.icms_base_type = tax_dict.get(
+            values["icms_cst_id"] = tax_dict.get("cst_id")
+            values["icms_base_type"] = tax_dict.get(
                 "icms_base_type", ICMS_BASE_TYPE_DEFAULT)
-            self.icms_base = tax_dict.get("base")
-            self.icms_percent = tax_dict.get("percent_amount")
-            self.icms_reduction = tax_dict.get("percent_reduction")
-            self.icms_value = tax_dict.get("tax_value")
+            values["icms_base"] = tax_dict.get("base")
+            values["icms_percent"] = tax_dict.get("percent_amount")
+            values["icms_reduction"] = tax_dict.get("percent_reduction")
+            values["icms_value"] = tax_dict.get("tax_value")
 
             # vBCUFDest - Valor da BC do ICMS na UF de destino
-            self.icms_destination_base = tax_dict.get("icms_dest_base")
+            values["icms_destination_base"] = tax_dict.get("icms_dest_base")
 
             # pICMSUFDest - Alíquota interna da UF de destino
-            self.icms_origin_percent = tax_dict.get("icms_origin_perc")
+            values["icms_origin_percent"] = tax_dict.get("icms_origin_perc")
 
             # pICMSInter - Alíquota interestadual das UF envolvidas
-            self.icms_destination_percent = tax_dict.get("icms_dest_perc")
+            values["icms_destination_percent"] = tax_dict.get(
+                "icms_dest_perc")
 
             # pICMSInterPart - Percentual provisório de partilha
             # do ICMS Interestadual
-            self.icms_sharing_percent = tax_dict.get("icms_sharing_percent")
+            values["icms_sharing_percent"] = tax_dict.get(
+                "icms_sharing_percent")
 
             # vICMSUFRemet - Valor do ICMS Interestadual
             # para a UF do remetente
-            self.icms_origin_value = tax_dict.get("icms_origin_value")
+            values["icms_origin_value"] = tax_dict.get("icms_origin_value")
 
             # vICMSUFDest - Valor do ICMS Interestadual para a UF de destino
-            self.icms_destination_value = tax_dict.get("icms_dest_value")
+            values["icms_destination_value"] = tax_dict.get(
+                "icms_dest_value")
+        return values
 
     @api.onchange(
         "icms_base",
@@ -537,14 +570,21 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_icms_fields(self):
         pass
 
-    def _set_fields_icmssn(self, tax_dict):
-        self.icms_cst_id = tax_dict.get("cst_id")
-        self.icmssn_base = tax_dict.get("base")
-        self.icmssn_percent = tax_dict.get("percent_amount")
-        self.icmssn_reduction = tax_dict.get("percent_reduction")
-        self.icmssn_credit_value = tax_dict.get("tax_value")
-        self.simple_value = self.icmssn_base * self.icmssn_range_id.total_tax_percent
-        self.simple_without_icms_value = self.simple_value - self.icmssn_credit_value
+    def _prepare_fields_icmssn(self, tax_dict):
+        values = {}
+        if not tax_dict:
+            return values
+
+        values["icms_cst_id"] = tax_dict.get("cst_id")
+        values["icmssn_base"] = tax_dict.get("base")
+        values["icmssn_percent"] = tax_dict.get("percent_amount")
+        values["icmssn_reduction"] = tax_dict.get("percent_reduction")
+        values["icmssn_credit_value"] = tax_dict.get("tax_value")
+        values["simple_value"] = (
+            values["icmssn_base"] * self.icmssn_range_id.total_tax_percent)
+        values["simple_without_icms_value"] = (
+            values["simple_value"] - values["icmssn_credit_value"])
+        return values
 
     @api.onchange(
         "icmssn_base",
@@ -554,18 +594,23 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_icmssn_fields(self):
         pass
 
-    def _set_fields_icmsst(self, tax_dict):
-        self.icmsst_base_type = tax_dict.get(
+    def _prepare_fields_icmsst(self, tax_dict):
+        values = {}
+        if not tax_dict:
+            return values
+
+        values["icmsst_base_type"] = tax_dict.get(
             "icmsst_base_type", ICMS_ST_BASE_TYPE_DEFAULT)
-        self.icmsst_mva_percent = tax_dict.get("icmsst_mva_percent")
-        self.icmsst_percent = tax_dict.get("percent_amount")
-        self.icmsst_reduction = tax_dict.get("percent_reduction")
-        self.icmsst_base = tax_dict.get("base")
-        self.icmsst_value = tax_dict.get("tax_value")
+        values["icmsst_mva_percent"] = tax_dict.get("icmsst_mva_percent")
+        values["icmsst_percent"] = tax_dict.get("percent_amount")
+        values["icmsst_reduction"] = tax_dict.get("percent_reduction")
+        values["icmsst_base"] = tax_dict.get("base")
+        values["icmsst_value"] = tax_dict.get("tax_value")
 
         # TODO - OTHER TAX icmsst_wh_tax_id
         # self.icmsst_wh_base
         # self.icmsst_wh_value
+        return values
 
     @api.onchange(
         "icmsst_base_type",
@@ -579,9 +624,14 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_icmsst_fields(self):
         pass
 
-    def _set_fields_icmsfcp(self, tax_dict):
-        self.icmsfcp_percent = tax_dict.get("percent_amount")
-        self.icmsfcp_value = tax_dict.get("tax_value")
+    def _prepare_fields_icmsfcp(self, tax_dict):
+        values = {}
+        if not tax_dict:
+            return values
+
+        values["icmsfcp_percent"] = tax_dict.get("percent_amount")
+        values["icmsfcp_value"] = tax_dict.get("tax_value")
+        return values
 
     @api.onchange(
         "icmsfcp_percent",
@@ -589,14 +639,16 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_icmsfcp_fields(self):
         pass
 
-    def _set_fields_ipi(self, tax_dict):
+    def _prepare_fields_ipi(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.ipi_cst_id = tax_dict.get("cst_id")
-            self.ipi_base_type = tax_dict.get("base_type", False)
-            self.ipi_base = tax_dict.get("base", 0.00)
-            self.ipi_percent = tax_dict.get("percent_amount", 0.00)
-            self.ipi_reduction = tax_dict.get("percent_reduction", 0.00)
-            self.ipi_value = tax_dict.get("tax_value", 0.00)
+            values["ipi_cst_id"] = tax_dict.get("cst_id")
+            values["ipi_base_type"] = tax_dict.get("base_type", False)
+            values["ipi_base"] = tax_dict.get("base", 0.00)
+            values["ipi_percent"] = tax_dict.get("percent_amount", 0.00)
+            values["ipi_reduction"] = tax_dict.get("percent_reduction", 0.00)
+            values["ipi_value"] = tax_dict.get("tax_value", 0.00)
+        return values
 
     @api.onchange(
         "ipi_base",
@@ -606,11 +658,13 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_ipi_fields(self):
         pass
 
-    def _set_fields_ii(self, tax_dict):
+    def _prepare_fields_ii(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.ii_base = tax_dict.get("base", 0.00)
-            self.ii_percent = tax_dict.get("percent_amount", 0.00)
-            self.ii_value = tax_dict.get("tax_value", 0.00)
+            values["ii_base"] = tax_dict.get("base", 0.00)
+            values["ii_percent"] = tax_dict.get("percent_amount", 0.00)
+            values["ii_value"] = tax_dict.get("tax_value", 0.00)
+        return values
 
     @api.onchange(
         "ii_base",
@@ -619,14 +673,16 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_ii_fields(self):
         pass
 
-    def _set_fields_pis(self, tax_dict):
+    def _prepare_fields_pis(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.pis_cst_id = tax_dict.get("cst_id")
-            self.pis_base_type = tax_dict.get("base_type")
-            self.pis_base = tax_dict.get("base", 0.00)
-            self.pis_percent = tax_dict.get("percent_amount", 0.00)
-            self.pis_reduction = tax_dict.get("percent_reduction", 0.00)
-            self.pis_value = tax_dict.get("tax_value", 0.00)
+            values["pis_cst_id"] = tax_dict.get("cst_id")
+            values["pis_base_type"] = tax_dict.get("base_type")
+            values["pis_base"] = tax_dict.get("base", 0.00)
+            values["pis_percent"] = tax_dict.get("percent_amount", 0.00)
+            values["pis_reduction"] = tax_dict.get("percent_reduction", 0.00)
+            values["pis_value"] = tax_dict.get("tax_value", 0.00)
+        return values
 
     @api.onchange(
         "pis_base_type",
@@ -637,14 +693,17 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_pis_fields(self):
         pass
 
-    def _set_fields_pis_wh(self, tax_dict):
+    def _prepare_fields_pis_wh(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.pis_wh_cst_id = tax_dict.get("cst_id")
-            self.pis_wh_base_type = tax_dict.get("base_type")
-            self.pis_wh_base = tax_dict.get("base", 0.00)
-            self.pis_wh_percent = tax_dict.get("percent_amount", 0.00)
-            self.pis_wh_reduction = tax_dict.get("percent_reduction", 0.00)
-            self.pis_wh_value = tax_dict.get("tax_value", 0.00)
+            values["pis_wh_cst_id"] = tax_dict.get("cst_id")
+            values["pis_wh_base_type"] = tax_dict.get("base_type")
+            values["pis_wh_base"] = tax_dict.get("base", 0.00)
+            values["pis_wh_percent"] = tax_dict.get("percent_amount", 0.00)
+            values["pis_wh_reduction"] = tax_dict.get(
+                "percent_reduction", 0.00)
+            values["pis_wh_value"] = tax_dict.get("tax_value", 0.00)
+        return values
 
     @api.onchange(
         "pis_wh_base_type",
@@ -655,14 +714,16 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_pis_wh_fields(self):
         pass
 
-    def _set_fields_pisst(self, tax_dict):
+    def _prepare_fields_pisst(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.pisst_cst_id = tax_dict.get("cst_id")
-            self.pisst_base_type = tax_dict.get("base_type")
-            self.pisst_base = tax_dict.get("base", 0.00)
-            self.pisst_percent = tax_dict.get("percent_amount", 0.00)
-            self.pisst_reduction = tax_dict.get("percent_reduction", 0.00)
-            self.pisst_value = tax_dict.get("tax_value", 0.00)
+            values["pisst_cst_id"] = tax_dict.get("cst_id")
+            values["pisst_base_type"] = tax_dict.get("base_type")
+            values["pisst_base"] = tax_dict.get("base", 0.00)
+            values["pisst_percent"] = tax_dict.get("percent_amount", 0.00)
+            values["pisst_reduction"] = tax_dict.get("percent_reduction", 0.00)
+            values["pisst_value"] = tax_dict.get("tax_value", 0.00)
+        return values
 
     @api.onchange(
         "pisst_base_type",
@@ -673,14 +734,17 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_pisst_fields(self):
         pass
 
-    def _set_fields_cofins(self, tax_dict):
+    def _prepare_fields_cofins(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.cofins_cst_id = tax_dict.get("cst_id")
-            self.cofins_base_type = tax_dict.get("base_type")
-            self.cofins_base = tax_dict.get("base", 0.00)
-            self.cofins_percent = tax_dict.get("percent_amount", 0.00)
-            self.cofins_reduction = tax_dict.get("percent_reduction", 0.00)
-            self.cofins_value = tax_dict.get("tax_value", 0.00)
+            values["cofins_cst_id"] = tax_dict.get("cst_id")
+            values["cofins_base_type"] = tax_dict.get("base_type")
+            values["cofins_base"] = tax_dict.get("base", 0.00)
+            values["cofins_percent"] = tax_dict.get("percent_amount", 0.00)
+            values["cofins_reduction"] = tax_dict.get(
+                "percent_reduction", 0.00)
+            values["cofins_value"] = tax_dict.get("tax_value", 0.00)
+        return values
 
     @api.onchange(
         "cofins_base_type",
@@ -691,14 +755,17 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_cofins_fields(self):
         pass
 
-    def _set_fields_cofins_wh(self, tax_dict):
+    def _prepare_fields_cofins_wh(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.cofins_wh_cst_id = tax_dict.get("cst_id")
-            self.cofins_wh_base_type = tax_dict.get("base_type")
-            self.cofins_wh_base = tax_dict.get("base", 0.00)
-            self.cofins_wh_percent = tax_dict.get("percent_amount", 0.00)
-            self.cofins_wh_reduction = tax_dict.get("percent_reduction", 0.00)
-            self.cofins_wh_value = tax_dict.get("tax_value", 0.00)
+            values["cofins_wh_cst_id"] = tax_dict.get("cst_id")
+            values["cofins_wh_base_type"] = tax_dict.get("base_type")
+            values["cofins_wh_base"] = tax_dict.get("base", 0.00)
+            values["cofins_wh_percent"] = tax_dict.get("percent_amount", 0.00)
+            values["cofins_wh_reduction"] = tax_dict.get(
+                "percent_reduction", 0.00)
+            values["cofins_wh_value"] = tax_dict.get("tax_value", 0.00)
+        return values
 
     @api.onchange(
         "cofins_wh_base_type",
@@ -709,14 +776,17 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
     def _onchange_cofins_wh_fields(self):
         pass
 
-    def _set_fields_cofinsst(self, tax_dict):
+    def _prepare_fields_cofinsst(self, tax_dict):
+        values = {}
         if tax_dict:
-            self.cofinsst_cst_id = tax_dict.get("cst_id")
-            self.cofinsst_base_type = tax_dict.get("base_type")
-            self.cofinsst_base = tax_dict.get("base", 0.00)
-            self.cofinsst_percent = tax_dict.get("percent_amount", 0.00)
-            self.cofinsst_reduction = tax_dict.get("percent_reduction", 0.00)
-            self.cofinsst_value = tax_dict.get("tax_value", 0.00)
+            values["cofinsst_cst_id"] = tax_dict.get("cst_id")
+            values["cofinsst_base_type"] = tax_dict.get("base_type")
+            values["cofinsst_base"] = tax_dict.get("base", 0.00)
+            values["cofinsst_percent"] = tax_dict.get("percent_amount", 0.00)
+            values["cofinsst_reduction"] = tax_dict.get(
+                "percent_reduction", 0.00)
+            values["cofinsst_value"] = tax_dict.get("tax_value", 0.00)
+        return values
 
     @api.onchange(
         "cofinsst_base_type",
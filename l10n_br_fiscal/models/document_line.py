@@ -12,8 +12,11 @@ class DocumentLine(models.Model):
     _description = 'Fiscal Document Line'
 
     @api.depends(
+        'price_unit',
+        'quantity',
         'fiscal_price',
         'discount_value',
+        'icms_relief_value',
         'insurance_value',
         'other_costs_value',
         'freight_value',
@@ -63,6 +66,115 @@ class DocumentLine(models.Model):
                 # - Valor Rentenções
             )
 
+    @api.model
+    def _get_amount_trigger_fields(self):
+        """Return the line fields changing the document totals, the
+        summed fields and the fields they are computed from"""
+        line_fields = set(
+            self.env['l10n_br_fiscal.document']._get_amount_fields().values())
+        triggers = set()
+        while line_fields:
+            field = self._fields[line_fields.pop()]
+            triggers.add(field.name)
+            line_fields.update(
+                d.split('.')[0] for d in field.depends
+                if d.split('.')[0] not in triggers)
+        return triggers
+
+    @api.multi
+    def _get_document_amounts(self):
+        """Return the {document id: {amount field: total}} of the lines"""
+        amount_fields = self.env[
+            'l10n_br_fiscal.document']._get_amount_fields()
+        amounts = {}
+        for line in self.filtered('document_id'):
+            totals = amounts.setdefault(
+                line.document_id.id, dict.fromkeys(amount_fields, 0.00))
+            for field_name, line_field in amount_fields.items():
+                totals[field_name] += line[line_field]
+        return amounts
+
+    @api.multi
+    def write(self, values):
+        if ('document_id' in values
+                or not set(values) & self._get_amount_trigger_fields()):
+            return super(DocumentLine, self).write(values)
+
+        # Adjust the document totals by the delta of the changed lines
+        # instead of summing again all the document lines, the totals
+        # already waiting for a recompute are left to the ORM
+        document_model = self.env['l10n_br_fiscal.document']
+        amount_fields = [
+            document_model._fields[field_name]
+            for field_name in document_model._get_amount_fields()]
+        pending = document_model.browse()
+        for field in amount_fields:
+            pending |= self.env.field_todo(field)
+        lines = self.filtered(
+            lambda line: line.document_id and line.document_id not in pending)
+        old_amounts = lines._get_document_amounts()
+
+        result = super(DocumentLine, self.with_context(
+            recompute=False)).write(values)
+
+        amounts = lines._get_document_amounts()
+        for document_id, totals in amounts.items():
+            for field_name, old_total in old_amounts[document_id].items():
+                totals[field_name] -= old_total
+        documents = document_model.browse(list(amounts))
+        for field in amount_fields:
+            self.env.remove_todo(field, documents)
+        document_model._add_amounts(amounts)
+
+        if self.env.recompute and self._context.get('recompute', True):
+            self.recompute()
+        return result
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        if not self.env.context.get('fiscal_defer_compute'):
+            return super(DocumentLine, self).create(vals_list)
+
+        # With the fiscal_defer_compute context the lines only store the
+        # given values, the document totals are left to
+        # Document.action_recompute_fiscal
+        lines = super(DocumentLine, self.with_context(
+            recompute=False)).create(vals_list)
+        documents = lines.mapped('document_id')
+        document_model = self.env['l10n_br_fiscal.document']
+        for field_name in document_model._get_amount_fields():
+            self.env.remove_todo(document_model._fields[field_name], documents)
+        lines.recompute()
+        return self.browse(lines.ids)
+
+    @api.multi
+    def _recompute_fiscal(self):
+        """Define the fiscal operation lines, map and compute the taxes
+        of lines created or written with the fiscal_defer_compute context
+        in one batch, the documents totals are reconciled by the callers,
+        Document.action_recompute_fiscal and Document.write"""
+        lines = self.with_context(fiscal_defer_compute=True)
+
+        operation_lines = {}
+        lines_values = []
+        for line in lines.filtered(
+                lambda line: line.fiscal_operation_id
+                and not line.fiscal_operation_line_id):
+            key = (line.fiscal_operation_id, line.company_id,
+                   line.partner_id, line.product_id)
+            if key not in operation_lines:
+                operation_lines[key] = line.fiscal_operation_id \
+                    .line_definition(
+                        company=line.company_id,
+                        partner=line.partner_id,
+                        product=line.product_id)
+            lines_values.append(
+                (line, {'fiscal_operation_line_id': operation_lines[key]}))
+
+        lines._write_fiscal_values(lines_values)
+        lines.filtered(
+            'fiscal_operation_line_id')._map_fiscal_operation_line_taxes()
+
     @api.model
     def _operation_domain(self):
         domain = [('state', '=', 'approved')]
@@ -2,9 +2,16 @@
 # Copyright (C) 2019  Renato Lima - Akretion
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
+import csv
+import io
+import threading
+import time
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from odoo import _
 from odoo.exceptions import UserError
 
@@ -19,10 +26,106 @@ WS_IBPT = {
 
 DeOlhoNoImposto = namedtuple("Config", "token cnpj uf")
 
+# Code types of the IBPT table file
+IBPT_TABLE_NCM = "0"
+IBPT_TABLE_NBS = "1"
 
-def _request(ws_url, params):
+IbptTableRow = namedtuple(
+    "IbptTableRow",
+    "code ex code_type federal_national federal_import state municipal "
+    "key origin")
+
+# Seconds to wait for the IBPT API response
+REQUEST_TIMEOUT = 30
+
+# HTTP status of the failed requests retried with backoff
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def get_session(pool_size=10, retries=3, backoff_factor=0.5):
+    """Return a requests.Session keeping up to pool_size connections
+    open and retrying the failed requests with exponential backoff"""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS)
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RateLimiter(object):
+    """Space the calls of the threads sharing it to at most rate calls
+    per second, without limit when rate is not set"""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class IbptFetcher(object):
+    """Query the IBPT API for many codes concurrently
+
+    The requests are made by a pool of workers threads sharing a
+    requests.Session, so the connections are reused, and a RateLimiter.
+    The threads only make the HTTP requests, the results must be written
+    to the database by the caller.
+    """
+
+    def __init__(self, workers=4, rate=None, retries=3, backoff_factor=0.5,
+                 timeout=REQUEST_TIMEOUT):
+        self.workers = max(workers, 1)
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate)
+        self.session = get_session(self.workers, retries, backoff_factor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _fetch(self, get_function, config, code):
+        self.limiter.wait()
+        try:
+            return code, get_function(
+                config, code, session=self.session, timeout=self.timeout)
+        except Exception as e:
+            return code, e
+
+    def fetch(self, get_function, config, codes):
+        """Call get_function (get_ibpt_product or get_ibpt_service) for
+        each code and return a dict of the results by code, holding the
+        raised exception for the failed ones"""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return dict(executor.map(
+                lambda code: self._fetch(get_function, config, code),
+                set(codes)))
+
+
+def _request(ws_url, params, session=None, timeout=REQUEST_TIMEOUT):
     try:
-        response = requests.get(ws_url, params=params)
+        response = (session or requests).get(
+            ws_url, params=params, timeout=timeout)
         if response.ok:
             data = response.json()
             return namedtuple("Result", [k.lower() for k in data.keys()])(
@@ -52,7 +155,8 @@ def _request(ws_url, params):
 
 
 def get_ibpt_product(
-    config, ncm, ex="0", reference="", description="", uom="", amount="0", gtin=""
+    config, ncm, ex="0", reference="", description="", uom="", amount="0", gtin="",
+    session=None, timeout=REQUEST_TIMEOUT
 ):
 
     data = {
@@ -68,10 +172,11 @@ def get_ibpt_product(
         "gtin": gtin,
     }
 
-    return _request(WS_IBPT[WS_PRODUTOS], data)
+    return _request(WS_IBPT[WS_PRODUTOS], data, session, timeout)
 
 
-def get_ibpt_service(config, nbs, description="", uom="", amount="0"):
+def get_ibpt_service(config, nbs, description="", uom="", amount="0",
+                     session=None, timeout=REQUEST_TIMEOUT):
     data = {
         "token": config.token,
         "cnpj": config.cnpj,
@@ -82,4 +187,37 @@ def get_ibpt_service(config, nbs, description="", uom="", amount="0"):
         "valor": amount,
     }
 
-    return _request(WS_IBPT[WS_SERVICOS], data)
+    return _request(WS_IBPT[WS_SERVICOS], data, session, timeout)
+
+
+def _table_float(value):
+    return float((value or "0").replace(",", "."))
+
+
+def read_ibpt_table(content):
+    """Return the IbptTableRow of the per state table file distributed by
+    IBPT (TabelaIBPTax<UF>.csv), a semicolon separated file encoded in
+    latin-1 when content is bytes"""
+    if isinstance(content, bytes):
+        try:
+            content = content.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            content = content.decode("latin-1")
+
+    reader = csv.DictReader(io.StringIO(content), delimiter=";")
+    reader.fieldnames = [f.strip().lower() for f in reader.fieldnames or []]
+    return [
+        IbptTableRow(
+            code=line["codigo"].strip(),
+            ex=(line["ex"] or "").strip(),
+            code_type=(line["tipo"] or "").strip(),
+            federal_national=_table_float(line["nacionalfederal"]),
+            federal_import=_table_float(line["importadosfederal"]),
+            state=_table_float(line["estadual"]),
+            municipal=_table_float(line["municipal"]),
+            key=line["chave"],
+            origin=line["fonte"],
+        )
+        for line in reader
+        if line.get("codigo")
+    ]
@@ -1,10 +1,13 @@
 # Copyright (C) 2019  Renato Lima - Akretion <renato.lima@akretion.com.br>
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
+from collections import namedtuple
+
 from lxml import etree
 
-from odoo import api, fields, models
+from odoo import api, fields, models, tools
 
+from .cache_generation import generation_key
 from ..constants.icms import ICMS_ORIGIN_TAX_IMPORTED
 from ..constants.fiscal import (
     FISCAL_OUT,
@@ -13,6 +16,14 @@ from ..constants.fiscal import (
     TAX_DOMAIN_ICMS_FCP
 )
 
+TaxDefinitionIndex = namedtuple('TaxDefinitionIndex', [
+    'id',
+    'tax_id',
+    'ncm_ids',
+    'nbm_ids',
+    'cest_ids',
+    'product_ids',
+])
 
 VIEW = """
 <page name="uf_{0}" string="{1}">
@@ -943,11 +954,87 @@ class ICMSRegulation(models.Model):
 
         return view_super
 
+    @api.model
+    @tools.ormcache('regulation_id', 'tax_group_id', 'state_from_id',
+                    'state_to_id', generation_key('tax_definition'))
+    def _get_tax_definition_index(self, regulation_id, tax_group_id,
+                                  state_from_id, state_to_id):
+        """Return the approved tax definitions of the regulation for a tax
+        group, origin and destination states as TaxDefinitionIndex tuples,
+        state_from_id None matches any origin state.
+
+        Each (tax group, origin state, destination state) entry is built
+        on the first lookup and kept until a tax definition is changed,
+        so the following lookups only check ids in the index sets.
+        """
+        domain = [
+            ('icms_regulation_id', '=', regulation_id),
+            ('state', '=', 'approved'),
+            ('tax_group_id', '=', tax_group_id),
+            ('state_to_ids', '=', state_to_id),
+        ]
+
+        if state_from_id is not None:
+            domain.append(('state_from_id', '=', state_from_id))
+
+        tax_definitions = self.env['l10n_br_fiscal.tax.definition'].search(
+            domain)
+
+        return tuple(TaxDefinitionIndex(
+            id=d.id,
+            tax_id=d.tax_id.id,
+            ncm_ids=frozenset(d.ncm_ids.ids),
+            nbm_ids=frozenset(d.nbm_ids.ids),
+            cest_ids=frozenset(d.cest_ids.ids),
+            product_ids=frozenset(d.product_ids.ids),
+        ) for d in tax_definitions)
+
+    @api.multi
+    def _index_lookup(self, tax_group, state_from, state_to):
+        self.ensure_one()
+        return self._get_tax_definition_index(
+            self.id, tax_group.id,
+            state_from.id if state_from is not None else None,
+            state_to.id)
+
+    @api.model
+    def _select_tax_definitions(self, index, product, ncm, nbm, cest):
+        """Return the taxes of the index definitions specific to the
+        product, its NCM, NBM or CEST, otherwise of the generic ones."""
+        if len(index) != 1:
+            ncm_id = ncm and ncm.id
+            nbm_id = nbm and nbm.id
+            cest_id = cest and cest.id
+            product_id = product.id
+
+            specific = [
+                d for d in index
+                if ncm_id in d.ncm_ids
+                or nbm_id in d.nbm_ids
+                or cest_id in d.cest_ids
+                or product_id in d.product_ids]
+
+            index = specific or [
+                d for d in index
+                if not d.ncm_ids
+                and not d.nbm_ids
+                and not d.cest_ids
+                and not d.product_ids]
+
+        return self._index_taxes(index)
+
+    @api.model
+    def _index_taxes(self, index):
+        tax_ids = []
+        for definition in index:
+            if definition.tax_id and definition.tax_id not in tax_ids:
+                tax_ids.append(definition.tax_id)
+        return self.env['l10n_br_fiscal.tax'].browse(tax_ids)
+
     @api.multi
     def map_tax_icms(self, company, partner, product, ncm=None, nbm=None,
                      cest=None, operation_line=None):
         self.ensure_one()
-        tax_definitions = self.env['l10n_br_fiscal.tax.definition']
         icms_taxes = self.env['l10n_br_fiscal.tax']
         tax_group_icms = self.env.ref('l10n_br_fiscal.tax_group_icms')
 
@@ -965,45 +1052,17 @@ class ICMSRegulation(models.Model):
             if not cest:
                 cest = product.cest_id
 
-            domain = [
-                ('icms_regulation_id', '=', self.id),
-                ('state', '=', 'approved'),
-                ('tax_group_id', '=', tax_group_icms.id),
-                ('state_from_id', '=', company.state_id.id),
-                ('state_to_ids', '=', partner.state_id.id)
-            ]
-
-            icms_defs = tax_definitions.search(domain)
-
-            if len(icms_defs) == 1:
-                tax_definitions |= icms_defs
-            else:
-                icms_defs_specific = icms_defs.filtered(
-                    lambda d: ncm.id in d.ncm_ids.ids
-                    or nbm.id in d.nbm_ids.ids
-                    or cest.id in d.cest_ids.ids
-                    or product.id in d.product_ids.ids)
-
-                icms_defs_generic = icms_defs.filtered(
-                    lambda d: not d.ncm_ids.ids
-                    and not d.nbm_ids.ids
-                    and not d.cest_ids.ids
-                    and not d.product_ids.ids)
-
-                if icms_defs_specific:
-                    tax_definitions |= icms_defs_specific
-                else:
-                    tax_definitions |= icms_defs_generic
-
-        icms_taxes |= tax_definitions.mapped('tax_id')
+            icms_index = self._index_lookup(
+                tax_group_icms, company.state_id, partner.state_id)
+            icms_taxes |= self._select_tax_definitions(
+                icms_index, product, ncm, nbm, cest)
+
         return icms_taxes
 
     @api.multi
     def map_tax_icmsst(self, company, partner, product, ncm=None, nbm=None,
                        cest=None, operation_line=None):
         self.ensure_one()
-        tax_definitions = self.env['l10n_br_fiscal.tax.definition']
-        icms_taxes = self.env['l10n_br_fiscal.tax']
         tax_group_icmsst = self.env.ref('l10n_br_fiscal.tax_group_icmsst')
 
         if not ncm:
@@ -1013,38 +1072,36 @@ class ICMSRegulation(models.Model):
             cest = product.cest_id
 
         # ICMS ST
-        domain = [
-            ('icms_regulation_id', '=', self.id),
-            ('state', '=', 'approved'),
-            ('state_from_id', '=', company.state_id.id),
-            ('tax_group_id', '=', tax_group_icmsst.id),
-            '|',
-            ('state_to_ids', '=', partner.state_id.id),
-            ('state_to_ids', '=', company.state_id.id),
-            ('ncm_ids', '=', ncm.id),
-            ('cest_ids', '=', cest.id)
-        ]
-
-        icmsst_defs = tax_definitions.search(domain)
-
-        if len(icmsst_defs) == 1:
-            tax_definitions |= icmsst_defs
-        else:
-            tax_definitions |= icmsst_defs.filtered(
-                lambda d: ncm.id in d.ncm_ids.ids
-                or nbm.id in d.nbm_ids.ids
-                or cest.id in d.cest_ids.ids
-                or product.id in d.product_ids.ids)
-
-        icms_taxes |= tax_definitions.mapped('tax_id')
-        return icms_taxes
+        icmsst_index = self._index_lookup(
+            tax_group_icmsst, company.state_id, partner.state_id)
+        if partner.state_id != company.state_id:
+            definition_ids = {d.id for d in icmsst_index}
+            icmsst_index += tuple(
+                d for d in self._index_lookup(
+                    tax_group_icmsst, company.state_id, company.state_id)
+                if d.id not in definition_ids)
+
+        # The definitions must match both the NCM and the CEST
+        icmsst_index = [
+            d for d in icmsst_index
+            if (ncm.id in d.ncm_ids if ncm else not d.ncm_ids)
+            and (cest.id in d.cest_ids if cest else not d.cest_ids)]
+
+        if len(icmsst_index) != 1:
+            icmsst_index = [
+                d for d in icmsst_index
+                if ncm.id in d.ncm_ids
+                or (nbm and nbm.id) in d.nbm_ids
+                or cest.id in d.cest_ids
+                or product.id in d.product_ids]
+
+        return self._index_taxes(icmsst_index)
 
     @api.multi
     def map_tax_icmsfcp(self, company, partner, product, ncm=None, nbm=None,
                         cest=None, operation_line=None):
 
         self.ensure_one()
-        tax_definitions = self.env['l10n_br_fiscal.tax.definition']
         icms_taxes = self.env['l10n_br_fiscal.tax']
         tax_group_icmsfcp = self.env.ref('l10n_br_fiscal.tax_group_icmsfcp')
 
@@ -1059,51 +1116,17 @@ class ICMSRegulation(models.Model):
             if not cest:
                 cest = product.cest_id
 
-            domain = [
-                ('icms_regulation_id', '=', self.id),
-                ('state', '=', 'approved'),
-                ('tax_group_id', '=', tax_group_icmsfcp.id),
-            ]
-
-            if operation_line.fiscal_operation_type == FISCAL_OUT:
-                domain.append(
-                    ('state_to_ids', '=', partner.state_id.id))
-            else:
-                domain.append(
-                    ('state_from_id', '=', partner.state_id.id))
-
-            icmsfcp_defs = tax_definitions.search(domain)
-
-            if len(icmsfcp_defs) == 1:
-                tax_definitions |= icmsfcp_defs
-            else:
-
-                icmsfcp_defs_specific = icmsfcp_defs.filtered(
-                    lambda d: ncm.id in d.ncm_ids.ids
-                    or nbm.id in d.nbm_ids.ids
-                    or cest.id in d.cest_ids.ids
-                    or product.id in d.product_ids.ids)
-
-                icmsfcp_defs_generic = icmsfcp_defs.filtered(
-                    lambda d: not d.ncm_ids.ids
-                    and not d.nbm_ids.ids
-                    and not d.cest_ids.ids
-                    and not d.product_ids.ids)
-
-                if icmsfcp_defs_specific:
-                    tax_definitions |= icmsfcp_defs_specific
-                else:
-                    tax_definitions |= icmsfcp_defs_generic
-
-        icms_taxes |= tax_definitions.mapped('tax_id')
+            icmsfcp_index = self._index_lookup(
+                tax_group_icmsfcp, None, partner.state_id)
+            icms_taxes |= self._select_tax_definitions(
+                icmsfcp_index, product, ncm, nbm, cest)
+
         return icms_taxes
 
     @api.multi
     def map_tax_icms_difal(self, company, partner, product, ncm=None,
                            nbm=None, cest=None, operation_line=None):
         self.ensure_one()
-        tax_definitions = self.env['l10n_br_fiscal.tax.definition']
-        icms_taxes = self.env['l10n_br_fiscal.tax']
         tax_group_icms = self.env.ref('l10n_br_fiscal.tax_group_icms')
 
         # ICMS
@@ -1113,38 +1136,68 @@ class ICMSRegulation(models.Model):
         if not cest:
             cest = product.cest_id
 
-        domain = [
-            ('icms_regulation_id', '=', self.id),
-            ('state', '=', 'approved'),
-            ('state_from_id', '=', partner.state_id.id),
-            ('state_to_ids', '=', partner.state_id.id),
-            ('tax_group_id', '=', tax_group_icms.id)
-        ]
+        icms_index = self._index_lookup(
+            tax_group_icms, partner.state_id, partner.state_id)
+        return self._select_tax_definitions(
+            icms_index, product, ncm, nbm, cest)
 
-        icms_defs = tax_definitions.search(domain)
+    @api.multi
+    def map_difal_percents(self, partner, product, ncm=None, nbm=None,
+                           cest=None):
+        """Return the ICMS and ICMS FCP percents of the partner state used
+        to compute the DIFAL of an interstate sale to a final consumer.
+
+        The percents are cached by regulation, destination state, NCM,
+        NBM, CEST and product, the cache is cleared when any tax
+        definition or tax is changed.
+        """
+        self.ensure_one()
+        if not ncm:
+            ncm = product.ncm_id
 
-        if len(icms_defs) == 1:
-            tax_definitions |= icms_defs
-        else:
-            icms_defs_specific = icms_defs.filtered(
-                lambda d: ncm.id in d.ncm_ids.ids
-                or nbm.id in d.nbm_ids.ids
-                or cest.id in d.cest_ids.ids
-                or product.id in d.product_ids.ids)
-
-            icms_defs_generic = icms_defs.filtered(
-                lambda d: not d.ncm_ids.ids
-                and not d.nbm_ids.ids
-                and not d.cest_ids.ids
-                and not d.product_ids.ids)
-
-            if icms_defs_specific:
-                tax_definitions |= icms_defs_specific
-            else:
-                tax_definitions |= icms_defs_generic
-
-        icms_taxes |= tax_definitions.mapped('tax_id')
-        return icms_taxes
+        if not cest:
+            cest = product.cest_id
+
+        return self._get_difal_percents(
+            self.id, partner.state_id.id, ncm.id, nbm and nbm.id,
+            cest.id, product.id)
+
+    @api.model
+    @tools.ormcache('regulation_id', 'state_to_id', 'ncm_id', 'nbm_id',
+                    'cest_id', 'product_id', generation_key('tax'),
+                    generation_key('tax_definition'))
+    def _get_difal_percents(self, regulation_id, state_to_id, ncm_id, nbm_id,
+                            cest_id, product_id):
+        regulation = self.browse(regulation_id)
+        state_to = self.env['res.country.state'].browse(state_to_id)
+        product = self.env['product.product'].browse(product_id)
+        ncm = self.env['l10n_br_fiscal.ncm'].browse(ncm_id)
+        nbm = self.env['l10n_br_fiscal.nbm'].browse(nbm_id)
+        cest = self.env['l10n_br_fiscal.cest'].browse(cest_id)
+
+        # Same taxes mapped by map_tax_icms_difal and map_tax_icmsfcp
+        # in an interstate sale to a final consumer
+        icms_taxes = regulation._select_tax_definitions(
+            regulation._index_lookup(
+                self.env.ref('l10n_br_fiscal.tax_group_icms'),
+                state_to, state_to),
+            product, ncm, nbm, cest)
+
+        icmsfcp_taxes = regulation._select_tax_definitions(
+            regulation._index_lookup(
+                self.env.ref('l10n_br_fiscal.tax_group_icmsfcp'),
+                None, state_to),
+            product, ncm, nbm, cest)
+
+        icms_dest_perc = 0.00
+        if icms_taxes:
+            icms_dest_perc = icms_taxes[0].percent_amount
+
+        icmsfcp_perc = 0.00
+        if icmsfcp_taxes:
+            icmsfcp_perc = icmsfcp_taxes[0].percent_amount
+
+        return icms_dest_perc, icmsfcp_perc
 
     @api.multi
     def map_tax(self, company, partner, product, ncm=None, nbm=None,
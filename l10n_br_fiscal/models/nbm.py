@@ -53,8 +53,10 @@ class Nbm(models.Model):
 
     @api.multi
     def action_search_ncms(self):
-        ncm = self.env['l10n_br_fiscal.ncm']
+        ncms = None
         for r in self:
             if r.ncms:
-                domain = misc.domain_field_codes(field_codes=r.ncms)
-                r.ncm_ids = ncm.search(domain)
+                if ncms is None:
+                    ncms = self.env['l10n_br_fiscal.ncm']._get_codes()
+                matcher = misc.CodeMatcher(field_codes=r.ncms)
+                r.ncm_ids = [(6, 0, matcher.filter(ncms))]
@@ -30,5 +30,5 @@ class Nbs(models.Model):
         'unique (code)',
         _('NBS already exists with this code !'))]
 
-    def _get_ibpt(self, config, code_unmasked):
-        return get_ibpt_service(config, code_unmasked)
+    def _get_ibpt(self, config, code_unmasked, **kwargs):
+        return get_ibpt_service(config, code_unmasked, **kwargs)
@@ -1,13 +1,18 @@
 # Copyright (C) 2012  Renato Lima - Akretion <renato.lima@akretion.com.br>
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import _, fields, models
+from odoo import _, api, fields, models
 from .ibpt.taxes import get_ibpt_product
 
 from ..constants.fiscal import (
     TAX_DOMAIN_II,
     TAX_DOMAIN_IPI
 )
+from ..tools import misc
+
+# Set while NCMs created by the modules data are waiting for their
+# memberships to be updated in a single pass
+PENDING_MEMBERSHIPS_PARAM = 'l10n_br_fiscal.ncm_memberships_pending'
 
 
 class Ncm(models.Model):
@@ -52,10 +57,130 @@ class Ncm(models.Model):
     tax_estimate_ids = fields.One2many(
         inverse_name='ncm_id')
 
+    active = fields.Boolean(
+        string='Active',
+        default=True)
+
     _sql_constraints = [(
         'fiscal_ncm_code_exception_uniq',
         "unique (code, exception)",
         _("NCM already exists with this code !"))]
 
-    def _get_ibpt(self, config, code_unmasked):
-        return get_ibpt_product(config, code_unmasked)
+    def _get_ibpt(self, config, code_unmasked, **kwargs):
+        return get_ibpt_product(config, code_unmasked, **kwargs)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        ncms = super(Ncm, self).create(vals_list)
+        # The NCMs loaded with the modules data, created one by one, are
+        # matched at the end of the load by _update_pending_memberships
+        if self.pool._init or self.env.context.get('defer_code_search'):
+            config = self.env['ir.config_parameter'].sudo()
+            if not config.get_param(PENDING_MEMBERSHIPS_PARAM):
+                config.set_param(PENDING_MEMBERSHIPS_PARAM, 'True')
+        else:
+            ncms._update_ncm_memberships()
+        return ncms
+
+    @api.multi
+    def write(self, values):
+        result = super(Ncm, self).write(values)
+        if 'code' in values or 'exception' in values:
+            self._update_ncm_memberships()
+        return result
+
+    @api.model
+    def _get_ncm_pattern_models(self):
+        """Return the {model: (ncms field, not in ncms field, ncm exception
+        field)} of the models keeping the NCMs matching their NCM lists
+        in the ncm_ids field."""
+        return {
+            'l10n_br_fiscal.tax.definition': (
+                'ncms', 'not_in_ncms', 'ncm_exception'),
+            'l10n_br_fiscal.tax.pis.cofins': (
+                'ncms', 'not_in_ncms', 'ncm_exception'),
+            'l10n_br_fiscal.cest': ('ncms', None, None),
+            'l10n_br_fiscal.nbm': ('ncms', None, None),
+        }
+
+    @api.model
+    def _update_pending_memberships(self):
+        """Update in a single pass the memberships of all NCMs if NCMs
+        were created with deferred memberships"""
+        config = self.env['ir.config_parameter'].sudo()
+        if config.get_param(PENDING_MEMBERSHIPS_PARAM):
+            self.search([])._update_ncm_memberships()
+            config.set_param(PENDING_MEMBERSHIPS_PARAM, False)
+
+    @api.model_cr
+    def _register_hook(self):
+        super(Ncm, self)._register_hook()
+        # NCMs created by the data of the modules loaded with the registry
+        self._update_pending_memberships()
+
+    @api.multi
+    def _update_ncm_memberships(self):
+        """Add or remove the NCMs in self to the ncm_ids of the records
+        whose NCM lists match them, instead of searching again all NCMs
+        of every record."""
+        if not self:
+            return
+
+        ncm_codes = [(n.id, n.code_unmasked, n.exception) for n in self]
+        ncm_ids = tuple(self.ids)
+
+        for model_name, pattern_fields in (
+                self._get_ncm_pattern_models().items()):
+            model = self.env[model_name]
+            field_names = [f for f in pattern_fields if f]
+            domain = ['|'] * (len(field_names) - 1) + [
+                (f, '!=', False) for f in field_names]
+            records = model.search_read(domain, field_names)
+            if not records:
+                continue
+
+            ncm_field = model._fields['ncm_ids']
+            self.env.cr.execute(
+                "SELECT {0}, {1} FROM {2} WHERE {1} IN %s".format(
+                    ncm_field.column1, ncm_field.column2,
+                    ncm_field.relation), (ncm_ids,))
+            current = set(self.env.cr.fetchall())
+
+            to_add = []
+            to_remove = []
+            for record in records:
+                ncms, not_in_ncms, ncm_exception = (
+                    record[f] if f else False for f in pattern_fields)
+                matched = set(misc.CodeMatcher(
+                    field_codes=ncms,
+                    not_in_codes=not_in_ncms,
+                    exception_codes=ncm_exception).filter(ncm_codes))
+
+                for ncm_id in ncm_ids:
+                    member = (record['id'], ncm_id)
+                    if ncm_id in matched and member not in current:
+                        to_add.append(member)
+                    elif ncm_id not in matched and member in current:
+                        to_remove.append(member)
+
+            if to_add:
+                self.env.cr.execute(
+                    "INSERT INTO {0} ({1}, {2}) "
+                    "SELECT * FROM unnest(%s::int[], %s::int[]) "
+                    "ON CONFLICT DO NOTHING".format(
+                        ncm_field.relation, ncm_field.column1,
+                        ncm_field.column2),
+                    ([m[0] for m in to_add], [m[1] for m in to_add]))
+
+            if to_remove:
+                self.env.cr.execute(
+                    "DELETE FROM {0} WHERE ({1}, {2}) IN %s".format(
+                        ncm_field.relation, ncm_field.column1,
+                        ncm_field.column2), (tuple(to_remove),))
+
+            if to_add or to_remove:
+                model.invalidate_cache(['ncm_ids'])
+                if model._name == 'l10n_br_fiscal.tax.definition':
+                    cache_generation = self.env[
+                        'l10n_br_fiscal.cache.generation']
+                    cache_generation._renew_generation('tax_definition')
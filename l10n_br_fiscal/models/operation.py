@@ -1,9 +1,12 @@
 # Copyright (C) 2013  Renato Lima - Akretion
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import _, api, fields, models
+import itertools
+
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import UserError
 
+from .cache_generation import generation_key
 from ..constants.fiscal import (
     OPERATION_FISCAL_TYPE,
     OPERATION_FISCAL_TYPE_DEFAULT,
@@ -167,48 +170,30 @@ class Operation(models.Model):
 
         return serie
 
-    def _line_domain(self, company, partner, product):
-
-        domain = [
-            ('fiscal_operation_id', '=', self.id),
-            ('fiscal_operation_type', '=', self.fiscal_operation_type),
+    @api.model
+    @tools.ormcache('operation_id', 'operation_type',
+                    generation_key('operation_line'))
+    def _get_line_decision_table(self, operation_id, operation_type):
+        """Return the approved lines of the operation as a dict
+        {(company tax framework, partner tax framework, product fiscal
+        type, ICMS or ISSQN): ((line id, date start, date end), ...)},
+        False keys matching any value, lines sorted by id."""
+        lines = self.env['l10n_br_fiscal.operation.line'].search([
+            ('fiscal_operation_id', '=', operation_id),
+            ('fiscal_operation_type', '=', operation_type),
             ('state', '=', 'approved'),
-        ]
-
-        domain += [
-            '|',
-            ('date_start', '=', False),
-            ('date_start', '<=', fields.Datetime.now()),
-            '|',
-            ('date_end', '=', False),
-            ('date_end', '>=', fields.Datetime.now())
-        ]
-
-        domain += [
-            '|',
-            ('company_tax_framework', '=', company.tax_framework),
-            ('company_tax_framework', '=', False),
-        ]
-
-        domain += [
-            '|',
-            ('partner_tax_framework', '=', partner.tax_framework),
-            ('partner_tax_framework', '=', False),
-        ]
-
-        domain += [
-            '|',
-            ('product_type', '=', product.fiscal_type),
-            ('product_type', '=', False),
-        ]
-
-        domain += [
-            '|',
-            ('tax_icms_or_issqn', '=', product.tax_icms_or_issqn),
-            ('tax_icms_or_issqn', '=', False),
-        ]
-
-        return domain
+        ], order='id')
+
+        decision_table = {}
+        for line in lines:
+            key = (line.company_tax_framework or False,
+                   line.partner_tax_framework or False,
+                   line.product_type or False,
+                   line.tax_icms_or_issqn or False)
+            decision_table.setdefault(key, []).append(
+                (line.id, line.date_start, line.date_end))
+
+        return {k: tuple(v) for k, v in decision_table.items()}
 
     @api.multi
     def line_definition(self, company, partner, product):
@@ -216,10 +201,28 @@ class Operation(models.Model):
         if not company:
             company = self.env.user.company_id
 
-        line = self.line_ids.search(
-            self._line_domain(company, partner, product), limit=1)
-
-        return line
+        decision_table = self._get_line_decision_table(
+            self.id, self.fiscal_operation_type)
+
+        keys = set(itertools.product(
+            (company.tax_framework or False, False),
+            (partner.tax_framework or False, False),
+            (product.fiscal_type or False, False),
+            (product.tax_icms_or_issqn or False, False)))
+
+        now = fields.Datetime.now()
+        line_id = False
+        for key in keys:
+            for candidate_id, date_start, date_end in decision_table.get(
+                    key, ()):
+                if line_id and candidate_id > line_id:
+                    break
+                if ((not date_start or date_start <= now)
+                        and (not date_end or date_end >= now)):
+                    line_id = candidate_id
+                    break
+
+        return self.env['l10n_br_fiscal.operation.line'].browse(line_id)
 
     @api.onchange('operation_subsequent_ids')
     def _onchange_operation_subsequent_ids(self):
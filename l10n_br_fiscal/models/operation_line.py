@@ -23,6 +23,20 @@ from ..constants.fiscal import (
 
 from ..constants.icms import ICMS_ORIGIN
 
+# Fields read by the operations lines decision tables, writing other
+# fields keeps them
+CACHED_FIELDS = (
+    'fiscal_operation_id',
+    'fiscal_operation_type',
+    'state',
+    'company_tax_framework',
+    'partner_tax_framework',
+    'product_type',
+    'tax_icms_or_issqn',
+    'date_start',
+    'date_end',
+)
+
 
 class OperationLine(models.Model):
     _name = 'l10n_br_fiscal.operation.line'
@@ -181,17 +195,61 @@ class OperationLine(models.Model):
                          fiscal_price=None, fiscal_quantity=None,
                          ncm=None, nbm=None, nbs=None, cest=None):
 
-        mapping_result = {
-            'taxes': {},
-            'cfop': False,
-            'taxes_value': 0.00
-        }
+        self.ensure_one()
+        return self.map_fiscal_taxes_batch(
+            company, partner, [(product, ncm, nbm, nbs, cest)])[0]
+
+    def map_fiscal_taxes_batch(self, company, partner, products):
+        """Map the fiscal taxes of many products sold with this operation
+        line to the same partner.
 
+        :param products: list of (product, ncm, nbm, nbs, cest) tuples
+        :return: list of mapping results, one for each tuple. Tuples with
+            the same records share the same mapping result.
+        """
         self.ensure_one()
 
         # Define CFOP
         cfop = self._get_cfop(company, partner)
-        mapping_result['cfop'] = cfop
+
+        # Operation line, CFOP and partner profile taxes are the same for
+        # every product, so they are mapped only once.
+        shared_taxes = {}
+        if company.tax_framework == TAX_FRAMEWORK_NORMAL:
+            # 4 From Operation Line
+            for tax in self.tax_definition_ids.mapped('tax_id'):
+                shared_taxes[tax.tax_domain] = tax
+
+            # 5 From CFOP
+            for tax in cfop.tax_definition_ids.mapped('tax_id'):
+                shared_taxes[tax.tax_domain] = tax
+
+            # 6 From Partner Profile
+            for tax in partner.fiscal_profile_id.tax_definition_ids.mapped(
+                    'tax_id'):
+                shared_taxes[tax.tax_domain] = tax
+
+        results = []
+        product_results = {}
+        for product, ncm, nbm, nbs, cest in products:
+            key = tuple(
+                r.id if r else False for r in (product, ncm, nbm, nbs, cest))
+            if key not in product_results:
+                product_results[key] = self._map_product_fiscal_taxes(
+                    company, partner, cfop, shared_taxes,
+                    product, ncm, nbm, nbs, cest)
+            results.append(product_results[key])
+
+        return results
+
+    def _map_product_fiscal_taxes(self, company, partner, cfop, shared_taxes,
+                                  product, ncm, nbm, nbs, cest):
+
+        mapping_result = {
+            'taxes': {},
+            'cfop': cfop,
+            'taxes_value': 0.00
+        }
 
         # 1 Get Tax Defs from Company
         company_tax_defs = company.tax_definition_ids.map_tax_definition(
@@ -226,17 +284,8 @@ class OperationLine(models.Model):
                 for tax in tax_icms_ids:
                     mapping_result['taxes'][tax.tax_domain] = tax
 
-            # 4 From Operation Line
-            for tax in self.tax_definition_ids.mapped('tax_id'):
-                mapping_result['taxes'][tax.tax_domain] = tax
-
-            # 5 From CFOP
-            for tax in cfop.tax_definition_ids.mapped('tax_id'):
-                mapping_result['taxes'][tax.tax_domain] = tax
-
-            # 6 From Partner Profile
-            for tax in partner.fiscal_profile_id.tax_definition_ids.mapped('tax_id'):
-                mapping_result['taxes'][tax.tax_domain] = tax
+            # 4, 5 and 6 From Operation Line, CFOP and Partner Profile
+            mapping_result['taxes'].update(shared_taxes)
 
         if product.tax_icms_or_issqn == TAX_DOMAIN_ICMS:
             mapping_result['taxes'].pop(TAX_DOMAIN_ISSQN, None)
@@ -252,12 +301,28 @@ class OperationLine(models.Model):
     def action_review(self):
         self.write({'state': 'review'})
 
+    @api.model
+    def create(self, values):
+        # Invalidate the operation lines decision table
+        self.env['l10n_br_fiscal.cache.generation']._renew_generation(
+            'operation_line')
+        return super(OperationLine, self).create(values)
+
+    @api.multi
+    def write(self, values):
+        if set(CACHED_FIELDS).intersection(values.keys()):
+            self.env['l10n_br_fiscal.cache.generation']._renew_generation(
+                'operation_line')
+        return super(OperationLine, self).write(values)
+
     @api.multi
     def unlink(self):
         lines = self.filtered(lambda l: l.state == 'approved')
         if lines:
             raise UserError(
                 _("You cannot delete an Operation Line which is not draft !"))
+        self.env['l10n_br_fiscal.cache.generation']._renew_generation(
+            'operation_line')
         return super(OperationLine, self).unlink()
 
     @api.multi
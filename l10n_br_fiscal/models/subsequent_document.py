@@ -116,7 +116,10 @@ class SubsequentDocument(models.Model):
 
         for item in new_doc.line_ids:
             item._onchange_fiscal_operation_id()
-            item._onchange_fiscal_operation_line_id()
+
+        new_doc.line_ids._map_fiscal_operation_line_taxes()
+
+        for item in new_doc.line_ids:
             item._onchange_fiscal_taxes()
 
         document = new_doc
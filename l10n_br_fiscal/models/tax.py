@@ -1,9 +1,13 @@
 # Copyright (C) 2013  Renato Lima - Akretion
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import api, fields, models
+from collections import namedtuple
+
+from odoo import api, fields, models, tools
 from odoo.addons import decimal_precision as dp
+from odoo.tools.lru import LRU
 
+from .cache_generation import generation_key
 from ..constants.fiscal import (
     FISCAL_IN,
     FISCAL_OUT,
@@ -11,7 +15,21 @@ from ..constants.fiscal import (
     TAX_BASE_TYPE_PERCENT,
     TAX_BASE_TYPE_VALUE,
     TAX_DOMAIN,
+    TAX_DOMAIN_COFINS,
+    TAX_DOMAIN_COFINS_WH,
+    TAX_DOMAIN_CSLL,
+    TAX_DOMAIN_CSLL_WH,
     TAX_DOMAIN_ICMS,
+    TAX_DOMAIN_II,
+    TAX_DOMAIN_INSS,
+    TAX_DOMAIN_INSS_WH,
+    TAX_DOMAIN_IPI,
+    TAX_DOMAIN_IRPJ,
+    TAX_DOMAIN_IRPJ_WH,
+    TAX_DOMAIN_ISSQN,
+    TAX_DOMAIN_ISSQN_WH,
+    TAX_DOMAIN_PIS,
+    TAX_DOMAIN_PIS_WH,
     NFE_IND_FINAL_DEFAULT,
     NFE_IND_IE_DEST_1,
     NFE_IND_IE_DEST_2,
@@ -24,11 +42,11 @@ from ..constants.icms import (
     ICMS_ST_BASE_TYPE,
     ICMS_ST_BASE_TYPE_DEFAULT,
     ICMS_SN_CST_WITH_CREDIT,
-    ICMS_DIFAL_PARTITION,
-    ICMS_DIFAL_UNIQUE_BASE,
-    ICMS_DIFAL_DOUBLE_BASE
 )
 
+from ..tools import tax_kernel
+from ..tools.tax_kernel import numpy
+
 
 TAX_DICT_VALUES = {
     "name": False,
@@ -48,12 +66,67 @@ TAX_DICT_VALUES = {
     "tax_value": 0.00,
 }
 
+# Domains whose taxes are computed by the generic formula
+GENERIC_TAX_DOMAINS = (
+    TAX_DOMAIN_COFINS,
+    TAX_DOMAIN_COFINS_WH,
+    TAX_DOMAIN_CSLL,
+    TAX_DOMAIN_CSLL_WH,
+    TAX_DOMAIN_II,
+    TAX_DOMAIN_INSS,
+    TAX_DOMAIN_INSS_WH,
+    TAX_DOMAIN_IPI,
+    TAX_DOMAIN_IRPJ,
+    TAX_DOMAIN_IRPJ_WH,
+    TAX_DOMAIN_ISSQN,
+    TAX_DOMAIN_ISSQN_WH,
+    TAX_DOMAIN_PIS,
+    TAX_DOMAIN_PIS_WH,
+)
+
+# Methods implementing the generic formula with the tax kernel
+GENERIC_COMPUTE_METHODS = (
+    '_compute_generic',
+    '_compute_tax',
+    '_compute_tax_base',
+    'cst_from_tax',
+)
+
+# Minimum number of lines sharing the same taxes to use numpy
+VECTORIZE_MIN_LINES = 100
+
+# Default number of compute taxes results kept by database, it can be
+# changed with the fiscal_tax_cache_size option, 0 disables the cache
+TAX_CACHE_SIZE = 4096
+
+# Compute taxes caches by database name
+TAX_CACHES = {}
+
+RecordRef = namedtuple('RecordRef', 'model ids')
+
+
+class TaxCache(object):
+    """LRU of compute taxes results with its hit/miss counters"""
+
+    def __init__(self, size):
+        self.size = size
+        self.lru = LRU(max(size, 1))
+        self.generation = None
+        self.hit = 0
+        self.miss = 0
+
+    def clear(self):
+        self.lru.clear()
+
 
 class Tax(models.Model):
     _name = 'l10n_br_fiscal.tax'
     _order = 'sequence, tax_domain, name'
     _description = 'Fiscal Tax'
 
+    # {tax domain: compute function}, built by _build_compute_dispatch
+    _compute_dispatch = None
+
     name = fields.Char(
         string="Name",
         size=256,
@@ -159,6 +232,20 @@ class Tax(models.Model):
         "fiscal_tax_code_uniq", "unique (name)",
         "Tax already exists with this name !")]
 
+    @api.multi
+    def write(self, values):
+        # Invalidate tax snapshots used by the tax kernel, the sequence
+        # is not read by the computation
+        if set(values) - {'sequence'}:
+            self.env['l10n_br_fiscal.cache.generation']._renew_generation(
+                'tax')
+        return super(Tax, self).write(values)
+
+    @api.multi
+    def unlink(self):
+        self.env['l10n_br_fiscal.cache.generation']._renew_generation('tax')
+        return super(Tax, self).unlink()
+
     @api.multi
     def get_account_tax(self, fiscal_operation_type=FISCAL_OUT):
         account_tax_type = {'out': 'sale', 'in': 'purchase'}
@@ -181,81 +268,49 @@ class Tax(models.Model):
             cst = self.cst_out_id
         return cst
 
+    @api.model
+    @tools.ormcache('tax_id', generation_key('tax'))
+    def _get_tax_snapshot(self, tax_id):
+        tax = self.browse(tax_id)
+        return tax_kernel.TaxSnapshot(
+            id=tax.id,
+            name=tax.name,
+            tax_domain=tax.tax_domain,
+            tax_base_type=tax.tax_base_type,
+            tax_include=tax.tax_group_id.tax_include,
+            tax_withholding=tax.tax_group_id.tax_withholding,
+            percent_amount=tax.percent_amount,
+            percent_reduction=tax.percent_reduction,
+            value_amount=tax.value_amount,
+            icms_base_type=tax.icms_base_type,
+            icmsst_base_type=tax.icmsst_base_type)
+
+    def _snapshot(self):
+        """Return a TaxSnapshot with the values used by the tax kernel"""
+        self.ensure_one()
+        return self._get_tax_snapshot(self.id)
+
     def _compute_tax_base(self, tax, tax_dict, **kwargs):
         company = kwargs.get("company", tax.env.user.company_id)
         currency = kwargs.get("currency", company.currency_id)
-        precision = currency.decimal_places
-        fiscal_price = kwargs.get("fiscal_price", 0.00)
-        fiscal_quantity = kwargs.get("fiscal_quantity", 0.00)
-        add_to_base = kwargs.get("add_to_base", 0.00)
-        remove_from_base = kwargs.get("remove_from_base", 0.00)
-        compute_reduction = kwargs.get("compute_reduction", True)
-
-        tax_dict["name"] = tax.name
-        tax_dict["base_type"] = tax.tax_base_type
-        tax_dict["tax_include"] = tax.tax_group_id.tax_include
-        tax_dict["tax_withholding"] = tax.tax_group_id.tax_withholding
-        tax_dict["fiscal_tax_id"] = tax.id
-        tax_dict["tax_domain"] = tax.tax_domain
-        tax_dict["percent_reduction"] = tax.percent_reduction
-
-        base = 0.00
-
-        if not tax_dict.get("percent_amount") and tax.percent_amount:
-            tax_dict["percent_amount"] = tax.percent_amount
-            tax_dict["value_amount"] = tax.value_amount
-
-        if tax_dict["base_type"] == "percent":
-            # Compute initial Tax Base for base_type Percent
-            base = round(fiscal_price * fiscal_quantity, precision)
-
-        if tax_dict["base_type"] == "quantity":
-            # Compute initial Tax Base for base_type Quantity
-            base = fiscal_quantity
-
-        if tax_dict["base_type"] == "fixed":
-            # Compute initial Tax Base
-            base = round(fiscal_price * fiscal_quantity, precision)
-
-        # Update Base Value
-        base_amount = (base + add_to_base) - remove_from_base
-
-        # Compute Tax Base Reduction
-        base_reduction = round(
-            base_amount * abs(tax.percent_reduction / 100), precision)
-
-        # Compute Tax Base Amount
-        if compute_reduction:
-            base_amount -= base_reduction
-
-        if not tax.percent_amount and not tax.value_amount:
-            tax_dict["base"] = 0.00
-        else:
-            tax_dict["base"] = base_amount
-
-        return tax_dict
+        return tax_kernel.compute_tax_base(
+            tax._snapshot(),
+            tax_dict,
+            currency.decimal_places,
+            fiscal_price=kwargs.get("fiscal_price", 0.00),
+            fiscal_quantity=kwargs.get("fiscal_quantity", 0.00),
+            add_to_base=kwargs.get("add_to_base", 0.00),
+            remove_from_base=kwargs.get("remove_from_base", 0.00),
+            compute_reduction=kwargs.get("compute_reduction", True))
 
     def _compute_tax(self, tax, taxes_dict, **kwargs):
 
         tax_dict = taxes_dict.get(tax.tax_domain)
 
         company = kwargs.get("company", tax.env.user.company_id)
-        # partner = kwargs.get("partner")
         currency = kwargs.get("currency", company.currency_id)
         precision = currency.decimal_places
-        # product = kwargs.get("product")
-        # price_unit = kwargs.get("price_unit", 0.00)
-        # quantity = kwargs.get("quantity", 0.00)
-        # uom_id = kwargs.get("uom_id")
-        # fiscal_price = kwargs.get("fiscal_price", 0.00)
-        # fiscal_quantity = kwargs.get("fiscal_quantity", 0.00)
-        # uot_id = kwargs.get("uot_id")
         discount_value = kwargs.get("discount_value", 0.00)
-        # insurance_value = kwargs.get("insurance_value", 0.00)
-        # other_costs_value = kwargs.get("other_costs_value", 0.00)
-        # freight_value = kwargs.get("freight_value", 0.00)
-        # ncm = kwargs.get("ncm")
-        # cest = kwargs.get("cest")
         operation_line = kwargs.get("operation_line")
         remove_from_base = [discount_value]
 
@@ -265,27 +320,12 @@ class Tax(models.Model):
 
         tax_dict = self._compute_tax_base(tax, tax_dict, **kwargs)
 
-        fiscal_operation_type = (operation_line.fiscal_operation_type
-                                 or FISCAL_OUT)
+        fiscal_operation_type = (
+            operation_line and operation_line.fiscal_operation_type
+            or FISCAL_OUT)
         tax_dict['cst_id'] = tax.cst_from_tax(fiscal_operation_type)
 
-        base_amount = tax_dict.get("base", 0.00)
-
-        if tax_dict["base_type"] == "percent":
-            # Compute Tax Value
-            tax_value = round(
-                base_amount * (tax_dict["percent_amount"] / 100),
-                precision)
-
-            tax_dict["tax_value"] = tax_value
-
-        if tax_dict["base_type"] in ("quantity", "fixed"):
-
-            tax_dict["tax_value"] = round(
-                base_amount * tax_dict["value_amount"],
-                precision)
-
-        return tax_dict
+        return tax_kernel.compute_tax_value(tax_dict, precision)
 
     def _compute_icms(self, tax, taxes_dict, **kwargs):
         partner = kwargs.get("partner")
@@ -309,7 +349,8 @@ class Tax(models.Model):
         tax_dict_ipi = taxes_dict.get("ipi", {})
 
         if partner.ind_ie_dest in (NFE_IND_IE_DEST_2, NFE_IND_IE_DEST_9) or \
-                (operation_line.fiscal_operation_id.ind_final ==
+                (operation_line and
+                 operation_line.fiscal_operation_id.ind_final ==
                  NFE_IND_FINAL_DEFAULT):
             # Add IPI in ICMS Base
             add_to_base.append(tax_dict_ipi.get("tax_value", 0.00))
@@ -322,7 +363,7 @@ class Tax(models.Model):
             'add_to_base': sum(add_to_base),
             'remove_from_base': sum(remove_from_base),
             'compute_reduction': compute_reduction,
-            'icms_base_type': tax.icms_base_type
+            'icms_base_type': tax._snapshot().icms_base_type
         })
 
         taxes_dict[tax.tax_domain].update(self._compute_tax_base(
@@ -333,86 +374,21 @@ class Tax(models.Model):
 
         # DIFAL
         if (company.state_id != partner.state_id
+                and operation_line
                 and operation_line.fiscal_operation_type == FISCAL_OUT
                 and not partner.is_company):
-            tax_icms_difal = company.icms_regulation_id.map_tax_icms_difal(
-                company, partner, product, ncm, nbm, cest, operation_line)
-            tax_icmsfcp_difal = company.icms_regulation_id.map_tax_icmsfcp(
-                company, partner, product, ncm, nbm, cest, operation_line)
-
-            # Difal - Origin Percent
-            icms_origin_perc = taxes_dict[tax.tax_domain].get(
-                'percent_amount')
-
-            # Difal - Destination Percent
-            icms_dest_perc = 0.00
-            if tax_icms_difal:
-                icms_dest_perc = tax_icms_difal[0].percent_amount
-
-            # Difal - FCP Percent
-            icmsfcp_perc = 0.00
-            if tax_icmsfcp_difal:
-                icmsfcp_perc = tax_icmsfcp_difal[0].percent_amount
-
-            # Difal - Base
-            icms_base = taxes_dict[tax.tax_domain].get('base')
-            difal_icms_base = 0.00
-
-            if partner.state_id.code in ICMS_DIFAL_UNIQUE_BASE:
-                difal_icms_base = round(
-                    icms_base / (1 - (
-                        (icms_origin_perc + icmsfcp_perc) / 100)),
-                    precision)
-
-            if partner.state_id.code in ICMS_DIFAL_DOUBLE_BASE:
-                difal_icms_base = round(
-                    icms_base / (1 - (
-                        (icms_dest_perc + icmsfcp_perc) / 100)),
-                    precision)
-
-            origin_value = round(
-                difal_icms_base * (icms_origin_perc / 100), precision)
-            dest_value = round(
-                difal_icms_base * (icms_dest_perc / 100), precision)
-
-            difal_value = dest_value - origin_value
-
-            # Difal - Sharing Percent
-            date_year = fields.Date.today().year
-
-            if date_year >= 2019:
-                taxes_dict[tax.tax_domain].update(
-                    ICMS_DIFAL_PARTITION[2019])
-            else:
-                if date_year == 2018:
-                    taxes_dict[tax.tax_domain].update(
-                        ICMS_DIFAL_PARTITION[2018])
-                if date_year == 2017:
-                    taxes_dict[tax.tax_domain].update(
-                        ICMS_DIFAL_PARTITION[2017])
-                else:
-                    taxes_dict[tax.tax_domain].update(
-                        ICMS_DIFAL_PARTITION[2016])
-
-            difal_share_origin = taxes_dict[tax.tax_domain].get(
-                'difal_origin_perc')
-
-            difal_share_dest = taxes_dict[tax.tax_domain].get(
-                'difal_dest_perc')
-
-            difal_origin_value = round(
-                difal_value * difal_share_origin / 100, precision)
-            difal_dest_value = round(
-                difal_value * difal_share_dest / 100, precision)
-
-            taxes_dict[tax.tax_domain].update({
-                'icms_origin_perc': icms_origin_perc,
-                'icms_dest_perc': icms_dest_perc,
-                'icms_dest_base': difal_icms_base,
-                'icms_sharing_percent': difal_share_dest,
-                'icms_origin_value': difal_origin_value,
-                'icms_dest_value': difal_dest_value,
-            })
+            # Difal - Destination and FCP Percents
+            icms_dest_perc, icmsfcp_perc = (
+                company.icms_regulation_id.map_difal_percents(
+                    partner, product, ncm, nbm, cest))
+
+            tax_kernel.compute_icms_difal(
+                taxes_dict[tax.tax_domain],
+                partner.state_id.code,
+                icms_dest_perc,
+                icmsfcp_perc,
+                fields.Date.today().year,
+                precision)
 
         return taxes_dict
 
@@ -442,7 +418,7 @@ class Tax(models.Model):
         kwargs.update({
             'add_to_base': sum(add_to_base),
             'remove_from_base': sum(remove_from_base),
-            'icmsst_base_type': tax.icmsst_base_type
+            'icmsst_base_type': tax._snapshot().icmsst_base_type
         })
 
         taxes_dict[tax.tax_domain].update(self._compute_tax_base(
@@ -492,7 +468,7 @@ class Tax(models.Model):
             'compute_reduction': compute_reduction
         })
 
-        taxes_dict.update(self._compute_tax_base(
+        taxes_dict[tax.tax_domain].update(self._compute_tax_base(
             tax, taxes_dict.get(tax.tax_domain), **kwargs))
 
         return self._compute_tax(tax, taxes_dict, **kwargs)
@@ -545,6 +521,83 @@ class Tax(models.Model):
 
         return self._compute_tax(tax, taxes_dict, **kwargs)
 
+    @api.model
+    def _get_compute_methods(self):
+        """Return the {tax domain: compute method name} dispatch table.
+
+        Each tax domain is computed by its _compute_<tax domain> method,
+        or by _compute_generic if there is none. Modules adding new tax
+        domains may override it to register their own compute methods.
+        """
+        cls = type(self)
+        compute_methods = {}
+        for tax_domain in self._fields['tax_domain'].get_values(self.env):
+            method_name = "_compute_%s" % tax_domain
+            if not hasattr(cls, method_name):
+                method_name = "_compute_generic"
+            compute_methods[tax_domain] = method_name
+        return compute_methods
+
+    @api.model
+    def _build_compute_dispatch(self):
+        cls = type(self)
+        cls._compute_dispatch = {
+            tax_domain: getattr(cls, method_name)
+            for tax_domain, method_name
+            in self._get_compute_methods().items()
+        }
+        return cls._compute_dispatch
+
+    @api.model
+    def _get_compute_dispatch(self):
+        return type(self)._compute_dispatch or self._build_compute_dispatch()
+
+    @api.model_cr
+    def _register_hook(self):
+        super(Tax, self)._register_hook()
+        self._build_compute_dispatch()
+
+    def _compute_order_key(self):
+        """Generic taxes first, as the vectorized mode computes them
+        before the other ones, and ICMS last"""
+        return (self.tax_domain == TAX_DOMAIN_ICMS,
+                not self._is_generic_tax_domain(self.tax_domain))
+
+    @api.model
+    @tools.ormcache('tax_ids', generation_key('tax'))
+    def _get_compute_order(self, tax_ids):
+        taxes = self.browse(tax_ids).sorted(
+            lambda t: t._compute_order_key())
+        return tuple(taxes.ids)
+
+    def _sort_for_compute(self):
+        """Return the taxes in the order they must be computed, the
+        generic taxes first and ICMS last since their bases depend on
+        the other taxes values."""
+        if not all(isinstance(tax_id, int) for tax_id in self.ids):
+            return self.sorted(lambda t: t._compute_order_key())
+        return self.browse(self._get_compute_order(tuple(self.ids)))
+
+    def _compute_sorted_taxes(self, taxes_dict=None, **kwargs):
+        taxes = taxes_dict if taxes_dict is not None else {}
+        dispatch = self._get_compute_dispatch()
+        operation_line = kwargs.get("operation_line")
+        fiscal_operation_type = (
+            operation_line and operation_line.fiscal_operation_type
+            or FISCAL_OUT)
+        for tax in self:
+            tax_dict = TAX_DICT_VALUES.copy()
+            taxes[tax.tax_domain] = tax_dict
+
+            # Define CST FROM TAX
+            kwargs.update({"cst": tax.cst_from_tax(fiscal_operation_type)})
+
+            compute_method = dispatch.get(
+                tax.tax_domain, type(self)._compute_generic)
+            taxes[tax.tax_domain].update(
+                compute_method(self, tax, taxes, **kwargs))
+        return taxes
+
     @api.multi
     def compute_taxes(self, **kwargs):
         """
@@ -568,29 +621,272 @@ class Tax(models.Model):
             operation_line,
             icmssn_range
         """
+        return self._sort_for_compute()._compute_taxes_cached(**kwargs)
+
+    @api.model
+    def _compute_taxes_cache_generation(self):
+        """Token renewed when a tax, tax group or tax definition read by
+        the computation is changed in any worker."""
+        cache_generation = self.env['l10n_br_fiscal.cache.generation']
+        return (cache_generation._get_generation('tax'),
+                cache_generation._get_generation('tax_definition'))
+
+    @api.model
+    def _get_compute_taxes_cache(self):
+        dbname = self.env.cr.dbname
+        cache = TAX_CACHES.get(dbname)
+        if cache is None:
+            cache = TAX_CACHES[dbname] = TaxCache(int(tools.config.get(
+                'fiscal_tax_cache_size', TAX_CACHE_SIZE)))
+
+        generation = self._compute_taxes_cache_generation()
+        if cache.generation != generation:
+            cache.clear()
+            cache.generation = generation
+        return cache
+
+    @api.model
+    def get_compute_taxes_cache_stats(self):
+        """Return the compute taxes cache counters, use them to size the
+        cache with the fiscal_tax_cache_size option of the config file."""
+        cache = self._get_compute_taxes_cache()
+        return {
+            'hit': cache.hit,
+            'miss': cache.miss,
+            'size': len(cache.lru),
+            'max_size': cache.size,
+        }
+
+    def _compute_taxes_cache_key(self, **kwargs):
+        """Return a hashable key normalizing the compute_taxes arguments
+        or None if they can not be cached (e.g. unsaved records).
+
+        Besides the records ids, the values of the related records read by
+        the computation are part of the key, so the cache does not need
+        to be invalidated when partners, products or operations are
+        changed.
+        """
+        key = [tuple(self.ids), fields.Date.today().year]
+        for name, value in sorted(kwargs.items()):
+            if isinstance(value, models.BaseModel):
+                if not all(isinstance(i, int) for i in value.ids):
+                    return None
+                value = (value._name, tuple(value.ids))
+            elif not isinstance(value, (bool, int, float, str, type(None))):
+                return None
+            key.append((name, value))
+
+        company = kwargs.get("company", self.env.user.company_id)
+        currency = kwargs.get("currency", company.currency_id)
+        partner = kwargs.get("partner")
+        product = kwargs.get("product")
+        operation_line = kwargs.get("operation_line")
+        icmssn_range = kwargs.get("icmssn_range")
+
+        key.append((
+            company.state_id.id,
+            company.icms_regulation_id.id,
+            currency.decimal_places))
+
+        if partner:
+            key.append((
+                partner.state_id.id,
+                partner.ind_ie_dest,
+                partner.is_company))
+
+        # The product codes are used when no NCM, NBM or CEST is given
+        if product:
+            key.append((
+                product.ncm_id.id,
+                product.nbm_id.id,
+                product.cest_id.id))
+
+        if operation_line:
+            key.append((
+                operation_line.fiscal_operation_type,
+                operation_line.fiscal_operation_id.ind_final))
+
+        if icmssn_range:
+            key.append((
+                icmssn_range.total_tax_percent,
+                icmssn_range.tax_icms_percent))
+
+        return tuple(key)
+
+    def _compute_taxes_cached(self, **kwargs):
+        """Compute the sorted taxes in self, reusing the result of a
+        previous computation made with the same arguments."""
+        cache = self._get_compute_taxes_cache()
+        key = cache.size > 0 and self._compute_taxes_cache_key(**kwargs)
+        if not key:
+            return self._compute_sorted_taxes(**kwargs)
+
+        try:
+            taxes = cache.lru[key]
+            cache.hit += 1
+            return self._thaw_taxes_result(taxes)
+        except KeyError:
+            cache.miss += 1
+
+        taxes = self._compute_sorted_taxes(**kwargs)
+        cache.lru[key] = self._freeze_taxes_result(taxes)
+        return taxes
+
+    @api.model
+    def _freeze_taxes_result(self, taxes):
+        """Copy a compute taxes result without records, which are bound
+        to the current environment."""
+        frozen = {}
+        for tax_domain, tax_dict in taxes.items():
+            frozen[tax_domain] = {
+                k: (RecordRef(v._name, tuple(v.ids))
+                    if isinstance(v, models.BaseModel) else v)
+                for k, v in tax_dict.items()}
+        return frozen
+
+    @api.model
+    def _thaw_taxes_result(self, frozen):
         taxes = {}
-        for tax in self.sorted(lambda t: t.tax_domain == TAX_DOMAIN_ICMS):
-            tax_dict = TAX_DICT_VALUES.copy()
-            taxes[tax.tax_domain] = tax_dict
-            try:
-                # Define CST FROM TAX
-                operation_line = kwargs.get("operation_line")
-                fiscal_operation_type = (operation_line.fiscal_operation_type
-                                         or FISCAL_OUT)
-                kwargs.update({"cst": tax.cst_from_tax(fiscal_operation_type)})
-
-                compute_method = getattr(self, "_compute_%s" % tax.tax_domain)
-                taxes[tax.tax_domain].update(
-                    compute_method(tax, taxes, **kwargs)
-                )
-            except AttributeError:
-                taxes[tax.tax_domain].update(
-                    tax._compute_generic(tax, taxes, **kwargs))
-                # Caso não exista campos especificos dos impostos
-                # no documento fiscal, os mesmos são calculados.
-                continue
+        for tax_domain, tax_dict in frozen.items():
+            taxes[tax_domain] = {
+                k: (self.env[v.model].browse(v.ids)
+                    if isinstance(v, RecordRef) else v)
+                for k, v in tax_dict.items()}
         return taxes
 
+    def _is_generic_tax_domain(self, tax_domain):
+        """Return True if the taxes of this domain are computed with the
+        plain generic formula, not customized by any module, so they can
+        be computed in vectorized mode."""
+        cls = type(self)
+        for method_name in GENERIC_COMPUTE_METHODS:
+            if getattr(cls, method_name) is not getattr(Tax, method_name):
+                return False
+
+        compute_method = self._get_compute_dispatch().get(tax_domain)
+        return compute_method in (None, Tax._compute_generic) or (
+            tax_domain in GENERIC_TAX_DOMAINS
+            and compute_method is getattr(
+                Tax, "_compute_%s" % tax_domain, None))
+
+    def _compute_taxes_vector(self, lines_kwargs):
+        """Compute the generic taxes in self for all lines at once with
+        the tax kernel vectorized mode.
+
+        :param lines_kwargs: list of (line id, compute_taxes kwargs)
+        :return: dict {line id: {tax domain: tax dict}}
+        """
+        results = {line_id: {} for line_id, kwargs in lines_kwargs}
+        if not self:
+            return results
+
+        # Lines are grouped by currency precision
+        precision_lines = {}
+        for line_id, kwargs in lines_kwargs:
+            company = kwargs.get("company", self.env.user.company_id)
+            currency = kwargs.get("currency", company.currency_id)
+            precision_lines.setdefault(
+                int(currency.decimal_places or 0), []).append(
+                    (line_id, kwargs))
+
+        csts = {}
+        for precision, group in precision_lines.items():
+            group_kwargs = [kwargs for line_id, kwargs in group]
+            fiscal_price = numpy.array(
+                [kw.get("fiscal_price", 0.00) for kw in group_kwargs],
+                dtype=float)
+            fiscal_quantity = numpy.array(
+                [kw.get("fiscal_quantity", 0.00) for kw in group_kwargs],
+                dtype=float)
+            discount_value = numpy.array(
+                [kw.get("discount_value", 0.00) for kw in group_kwargs],
+                dtype=float)
+
+            for tax in self:
+                values = tax_kernel.compute_generic_vector(
+                    tax._snapshot(), precision, fiscal_price,
+                    fiscal_quantity, discount_value)
+                bases = values.pop("base")
+                tax_values = values.pop("tax_value")
+
+                for i, (line_id, kwargs) in enumerate(group):
+                    operation_line = kwargs.get("operation_line")
+                    fiscal_operation_type = (
+                        operation_line
+                        and operation_line.fiscal_operation_type
+                        or FISCAL_OUT)
+                    cst_key = (tax.id, fiscal_operation_type)
+                    if cst_key not in csts:
+                        csts[cst_key] = tax.cst_from_tax(
+                            fiscal_operation_type)
+
+                    tax_dict = TAX_DICT_VALUES.copy()
+                    tax_dict.update(values)
+                    tax_dict.update({
+                        "base": float(bases[i]),
+                        "tax_value": float(tax_values[i]),
+                        "cst_id": csts[cst_key],
+                    })
+                    results[line_id][tax.tax_domain] = tax_dict
+
+        return results
+
+    @api.multi
+    def compute_taxes_batch(self, lines, vectorize=None, kwargs_method=None):
+        """Compute the taxes of many document lines in one pass.
+
+        :param lines: recordset of any model inheriting from
+            l10n_br_fiscal.document.line.mixin.methods (fiscal document,
+            invoice or sale order lines).
+        :param vectorize: compute the generic taxes (IPI, PIS, COFINS...)
+            of lines sharing the same taxes with numpy arrays. By default
+            it is used when numpy is installed and at least
+            VECTORIZE_MIN_LINES lines share the same taxes.
+        :param kwargs_method: name of the lines method returning the
+            compute_taxes arguments, _prepare_compute_taxes_kwargs by
+            default.
+        :return: dict {line id: taxes dict as returned by compute_taxes}
+
+        If self is empty, each line is computed with its own fiscal_tax_ids,
+        otherwise self is applied to every line. Lines sharing the same set
+        of taxes share their ordering, which is resolved only once.
+        """
+        kwargs_method = kwargs_method or '_prepare_compute_taxes_kwargs'
+        results = {}
+        groups = {}
+        for line in lines:
+            taxes = self or line.fiscal_tax_ids
+            groups.setdefault(tuple(taxes.ids), (taxes, []))[1].append(
+                (line.id, getattr(line, kwargs_method)()))
+
+        for taxes, lines_kwargs in groups.values():
+            sorted_taxes = taxes._sort_for_compute()
+            vector_taxes = self.browse()
+
+            vectorize_group = vectorize
+            if vectorize_group is None:
+                vectorize_group = len(lines_kwargs) >= VECTORIZE_MIN_LINES
+
+            if vectorize_group and numpy is not None:
+                vector_taxes = sorted_taxes.filtered(
+                    lambda t: self._is_generic_tax_domain(t.tax_domain))
+
+            # Generic taxes do not depend on other taxes values, so they
+            # are computed first, then the other ones line by line.
+            if not vector_taxes:
+                for line_id, kwargs in lines_kwargs:
+                    results[line_id] = sorted_taxes._compute_taxes_cached(
+                        **kwargs)
+                continue
+
+            vector_results = vector_taxes._compute_taxes_vector(lines_kwargs)
+            other_taxes = sorted_taxes - vector_taxes
+            for line_id, kwargs in lines_kwargs:
+                results[line_id] = other_taxes._compute_sorted_taxes(
+                    taxes_dict=vector_results.get(line_id), **kwargs)
+
+        return results
+
     @api.onchange('icmsst_base_type')
     def _onchange_icmsst_base_type(self):
         if self.icmsst_base_type:
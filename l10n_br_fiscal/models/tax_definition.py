@@ -1,7 +1,10 @@
 # Copyright (C) 2013  Renato Lima - Akretion
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import _, api, fields, models
+import logging
+import time
+
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import UserError
 
 from ..constants.fiscal import (
@@ -13,6 +16,24 @@ from ..constants.fiscal import (
 )
 
 from ..tools import misc
+from .cache_generation import generation_key
+
+_logger = logging.getLogger(__name__)
+
+# Fields read by the tax definitions indexes, applicability and DIFAL
+# percents caches, writing other fields keeps them
+CACHED_FIELDS = (
+    'icms_regulation_id',
+    'state',
+    'tax_group_id',
+    'tax_id',
+    'state_from_id',
+    'state_to_ids',
+    'ncm_ids',
+    'nbm_ids',
+    'cest_ids',
+    'product_ids',
+)
 
 
 class TaxDefinition(models.Model):
@@ -221,86 +242,111 @@ class TaxDefinition(models.Model):
         if operations:
             raise UserError(
                 _("You cannot delete an Tax Definition which is not draft !"))
+        self.env['l10n_br_fiscal.cache.generation']._renew_generation(
+            'tax_definition')
         return super(TaxDefinition, self).unlink()
 
     @api.multi
     def action_search_ncms(self):
-        ncm = self.env['l10n_br_fiscal.ncm']
+        ncms = None
         for r in self:
-            domain = []
-
             # Clear Field to recompute
             r.ncm_ids = False
-            if r.ncms:
-                domain += misc.domain_field_codes(r.ncms)
-
-            if r.not_in_ncms:
-                domain += misc.domain_field_codes(
-                    field_codes=r.not_in_ncms,
-                    operator1='!=',
-                    operator2='not ilike')
+            matcher = misc.CodeMatcher(
+                field_codes=r.ncms,
+                not_in_codes=r.not_in_ncms,
+                exception_codes=r.ncm_exception)
 
-            if r.ncm_exception:
-                domain += misc.domain_field_codes(
-                    field_codes=r.ncm_exception,
-                    field_name='exception',
-                    code_size=2)
-
-            if domain:
-                r.ncm_ids = ncm.search(domain)
+            if matcher:
+                if ncms is None:
+                    ncms = self.env['l10n_br_fiscal.ncm']._get_codes()
+                r.ncm_ids = [(6, 0, matcher.filter(ncms))]
 
     @api.multi
     def action_search_cests(self):
-        cest = self.env['l10n_br_fiscal.cest']
+        cests = None
         for r in self:
-            domain = []
-
             # Clear Field
             r.cest_ids = False
-            if r.cests:
-                domain += misc.domain_field_codes(r.cests, code_size=7)
+            matcher = misc.CodeMatcher(field_codes=r.cests, code_size=7)
 
-            if domain:
-                r.cest_ids = cest.search(domain)
+            if matcher:
+                if cests is None:
+                    cests = self.env['l10n_br_fiscal.cest']._get_codes()
+                r.cest_ids = [(6, 0, matcher.filter(cests))]
 
     @api.multi
     def action_search_nbms(self):
-        nbm = self.env['l10n_br_fiscal.nbm']
+        nbms = None
         for r in self:
-            domain = []
-
             # Clear Field
             r.nbm_ids = False
-            if r.nbms:
-                domain += misc.domain_field_codes(r.nbms, code_size=10)
-
-            if r.not_in_nbms:
-                domain += misc.domain_field_codes(
-                    field_codes=r.not_in_nbms,
-                    operator1='!=',
-                    operator2='not ilike',
-                    code_size=10)
+            matcher = misc.CodeMatcher(
+                field_codes=r.nbms,
+                not_in_codes=r.not_in_nbms,
+                code_size=10)
+
+            if matcher:
+                if nbms is None:
+                    nbms = self.env['l10n_br_fiscal.nbm']._get_codes()
+                r.nbm_ids = [(6, 0, matcher.filter(nbms))]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        # Invalidate compute taxes results using the tax definitions
+        self.env['l10n_br_fiscal.cache.generation']._renew_generation(
+            'tax_definition')
+        records = super(TaxDefinition, self).create(vals_list)
+
+        # The NCM, CEST and NBM lists of all records are expanded in one
+        # batch, or later with _search_codes for the defer_code_search
+        # context, e.g. to import many tax definitions.
+        if not self.env.context.get('defer_code_search'):
+            search_fields = set()
+            for values in vals_list:
+                search_fields.update(values.keys())
+            records.with_context(do_not_write=True)._search_codes(
+                search_fields)
+
+        return records
 
-            if domain:
-                r.nbm_ids = nbm.search(domain)
-
-    @api.model
-    def create(self, values):
-        create_super = super(TaxDefinition, self).create(values)
+    @api.multi
+    def _search_codes(self, search_fields=None):
+        """Expand the NCM, CEST and NBM lists of the tax definitions in a
+        single batch, only for the lists in search_fields if given."""
+        start = time.time()
         ncm_fields_list = ('ncms', 'not_in_ncms', 'ncm_exception')
-        if set(ncm_fields_list).intersection(values.keys()):
-            create_super.with_context(do_not_write=True).action_search_ncms()
-
-        if 'cests' in values.keys():
-            create_super.with_context(do_not_write=True).action_search_cests()
-
-        if 'nbms' in values.keys():
-            create_super.with_context(do_not_write=True).action_search_nbms()
-
-        return create_super
+        cest_fields_list = ('cests',)
+        nbm_fields_list = ('nbms', 'not_in_nbms')
+
+        searches = (
+            (ncm_fields_list, 'action_search_ncms'),
+            (cest_fields_list, 'action_search_cests'),
+            (nbm_fields_list, 'action_search_nbms'),
+        )
+
+        searched = self.browse()
+        for fields_list, action in searches:
+            if search_fields is not None and not set(
+                    fields_list).intersection(search_fields):
+                continue
+
+            records = self.filtered(
+                lambda r: any(r[f] for f in fields_list))
+            if records:
+                getattr(records, action)()
+                searched |= records
+
+        if searched:
+            _logger.info(
+                "Searched the codes of %s tax definitions in %.2fs",
+                len(searched), time.time() - start)
 
     @api.multi
     def write(self, values):
+        if set(CACHED_FIELDS).intersection(values.keys()):
+            self.env['l10n_br_fiscal.cache.generation']._renew_generation(
+                'tax_definition')
         write_super = super(TaxDefinition, self).write(values)
         ncm_fields_list = ('ncms', 'not_in_ncms', 'ncm_exception')
         do_not_write = self.env.context.get('do_not_write')
@@ -329,26 +375,29 @@ class TaxDefinition(models.Model):
         if not cest:
             cest = product.cest_id
 
-        domain = [
-            ('id', 'in', self.ids),
-            '|',
-            ('state_to_ids', '=', False),
-            ('state_to_ids', '=', partner.state_id.id),
-            '|',
-            ('ncm_ids', '=', False),
-            ('ncm_ids', '=', ncm.id),
-            '|',
-            ('nbm_ids', '=', False),
-            ('nbm_ids', '=', nbm.id),
-            '|',
-            ('cest_ids', '=', False),
-            ('cest_ids', '=', cest.id),
-            '|',
-            ('product_ids', '=', False),
-            ('product_ids', '=', product.id),
+        values = (partner.state_id.id, ncm.id, nbm.id, cest.id, product.id)
+        tax_definition_ids = [
+            tax_definition_id for tax_definition_id in self.ids
+            if all(not ids or value in ids for ids, value in zip(
+                self._get_applicability(tax_definition_id), values))
         ]
 
-        return self.search(domain)
+        return self.browse(sorted(tax_definition_ids))
+
+    @api.model
+    @tools.ormcache('tax_definition_id', generation_key('tax_definition'))
+    def _get_applicability(self, tax_definition_id):
+        """Return the sets of destination states, NCMs, NBMs, CESTs and
+        products ids the tax definition applies to, an empty set applies
+        to all of them. Changing tax definitions renews this cache."""
+        tax_definition = self.browse(tax_definition_id)
+        return (
+            frozenset(tax_definition.state_to_ids.ids),
+            frozenset(tax_definition.ncm_ids.ids),
+            frozenset(tax_definition.nbm_ids.ids),
+            frozenset(tax_definition.cest_ids.ids),
+            frozenset(tax_definition.product_ids.ids),
+        )
 
     @api.onchange('is_taxed')
     def _onchange_tribute(self):
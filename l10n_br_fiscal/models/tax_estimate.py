@@ -1,9 +1,17 @@
 # Copyright (C) 2012  Renato Lima - Akretion <renato.lima@akretion.com.br>
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import fields, models
+import glob
+import logging
+import os
+
+from odoo import api, fields, models, tools
 from odoo.addons import decimal_precision as dp
 
+from .ibpt.taxes import IBPT_TABLE_NBS, IBPT_TABLE_NCM, read_ibpt_table
+
+_logger = logging.getLogger(__name__)
+
 
 class TaxEstimate(models.Model):
     _name = 'l10n_br_fiscal.tax.estimate'
@@ -60,3 +68,84 @@ class TaxEstimate(models.Model):
         string='Company',
         default=lambda self: self.env['res.company']._company_default_get(
             'l10n_br_fiscal.tax.estimate'))
+
+    @api.model
+    def import_ibpt_table(self, content, state=None):
+        """Create in batch the tax estimates of the NCMs and NBSs found in
+        the IBPT table file of the state, instead of querying the IBPT API
+        for each code. The codes already having an estimate of the same
+        table version (key) are skipped. Return the created estimates."""
+        company = self.env.user.company_id
+        state = state or company.state_id
+        rows = read_ibpt_table(content)
+
+        code_fields = {
+            IBPT_TABLE_NCM: ('ncm_id', {
+                (code, exception or ''): ncm_id
+                for ncm_id, code, exception in
+                self.env['l10n_br_fiscal.ncm']._get_codes()}),
+            IBPT_TABLE_NBS: ('nbs_id', {
+                (code, ''): nbs_id
+                for nbs_id, code, exception in
+                self.env['l10n_br_fiscal.nbs']._get_codes()}),
+        }
+
+        existing = set()
+        for estimate in self.search_read([
+                ('state_id', '=', state.id),
+                ('company_id', '=', company.id),
+                ('key', 'in', list({r.key for r in rows}))],
+                ['ncm_id', 'nbs_id', 'key']):
+            for field_name in ('ncm_id', 'nbs_id'):
+                if estimate[field_name]:
+                    existing.add((
+                        field_name, estimate[field_name][0],
+                        estimate['key']))
+
+        vals_list = []
+        for row in rows:
+            field_name, record_ids = code_fields.get(
+                row.code_type, (None, {}))
+            record_id = record_ids.get((row.code, row.ex))
+            if not record_id or (field_name, record_id, row.key) in existing:
+                continue
+
+            existing.add((field_name, record_id, row.key))
+            vals_list.append({
+                field_name: record_id,
+                'key': row.key,
+                'origin': row.origin,
+                'state_id': state.id,
+                'company_id': company.id,
+                'state_taxes': row.state,
+                'federal_taxes_national': row.federal_national,
+                'federal_taxes_import': row.federal_import,
+                'municipal_taxes': row.municipal,
+            })
+
+        estimates = self.create(vals_list)
+        _logger.info(
+            "%s tax estimates imported from the IBPT table of %s",
+            len(estimates), state.code)
+        return estimates
+
+    @api.model
+    def _scheduled_import_ibpt_table(self):
+        """Import the IBPT table file of the company state found in the
+        fiscal_ibpt_table_path option of the config file, a file or a
+        directory holding the TabelaIBPTax<UF>*.csv files."""
+        path = tools.config.get('fiscal_ibpt_table_path')
+        state = self.env.user.company_id.state_id
+        if path and os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(
+                path, '*IBPTax{}*.csv'.format(state.code))))
+            path = files and files[-1]
+
+        if not path or not os.path.isfile(path):
+            _logger.warning(
+                "IBPT table file of %s not found, set the "
+                "fiscal_ibpt_table_path option", state.code)
+            return self.browse()
+
+        with open(path, 'rb') as table_file:
+            return self.import_ibpt_table(table_file.read(), state)
@@ -1,7 +1,7 @@
 # Copyright (C) 2019  Renato Lima - Akretion <renato.lima@akretion.com.br>
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import _, fields, models
+from odoo import _, api, fields, models
 
 from ..constants.fiscal import TAX_DOMAIN
 
@@ -50,3 +50,16 @@ class TaxGroup(models.Model):
         'unique (name)',
         _('Tax Group already exists with this name !'),
     )]
+
+    @api.multi
+    def write(self, values):
+        # Tax snapshots hold tax group values
+        if {'tax_domain', 'tax_include', 'tax_withholding'} & set(values):
+            self.env['l10n_br_fiscal.cache.generation']._renew_generation(
+                'tax')
+        return super(TaxGroup, self).write(values)
+
+    @api.multi
+    def unlink(self):
+        self.env['l10n_br_fiscal.cache.generation']._renew_generation('tax')
+        return super(TaxGroup, self).unlink()
@@ -79,25 +79,16 @@ class TaxPisCofins(models.Model):
     @api.multi
     @api.depends('ncms')
     def _compute_ncms(self):
-        ncm = self.env['l10n_br_fiscal.ncm']
+        ncms = None
         for r in self:
-            domain = []
-
             # Clear Field to recompute
             r.ncm_ids = False
-            if r.ncms:
-                domain = misc.domain_field_codes(r.ncms)
-
-            if r.not_in_ncms:
-                domain += misc.domain_field_codes(
-                    field_codes=r.not_in_ncms,
-                    operator1="!=", operator2="not ilike")
-
-            if r.ncm_exception:
-                domain += misc.domain_field_codes(
-                    field_codes=r.ncm_exception,
-                    field_name="exception",
-                    code_size=2)
-
-            if domain:
-                r.ncm_ids = ncm.search(domain)
+            matcher = misc.CodeMatcher(
+                field_codes=r.ncms,
+                not_in_codes=r.not_in_ncms,
+                exception_codes=r.ncm_exception)
+
+            if matcher:
+                if ncms is None:
+                    ncms = self.env['l10n_br_fiscal.ncm']._get_codes()
+                r.ncm_ids = [(6, 0, matcher.filter(ncms))]
@@ -12,3 +12,12 @@ from . import test_fiscal_closing
 from . import test_subsequent_operation
 from . import test_uom_uom
 from . import test_fiscal_document_nfse
+from . import test_tax_kernel
+from . import test_code_matcher
+from . import test_ncm
+from . import test_ibpt_fetcher
+from . import test_fiscal_tax
+from . import test_cache_generation
+from . import test_icms_regulation
+from . import test_fiscal_operation
+from . import test_tax_definition
@@ -0,0 +1,43 @@
+# Copyright 2020 Akretion - Renato Lima <renato.lima@akretion.com.br>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests import common
+
+
+class TestCacheGeneration(common.TransactionCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_generation = self.env['l10n_br_fiscal.cache.generation']
+        self.tax_ipi = self.env.ref('l10n_br_fiscal.tax_ipi_10')
+        self.operation_line = self.env.ref('l10n_br_fiscal.fo_venda_venda')
+
+    def _assertRenewed(self, name, function, renewed=True):
+        generation = self.cache_generation._get_generation(name)
+        function()
+        new_generation = self.cache_generation._get_generation(name)
+        if renewed:
+            self.assertNotEqual(generation, new_generation)
+        else:
+            self.assertEqual(generation, new_generation)
+
+    def test_tax_generation(self):
+        """ Test the tax caches are only renewed by the fields they read """
+        self._assertRenewed('tax', lambda: self.tax_ipi.tax_group_id.write(
+            {'name': 'IPI Group'}), renewed=False)
+        self._assertRenewed('tax', lambda: self.tax_ipi.tax_group_id.write(
+            {'tax_include': True}))
+
+        snapshot = self.tax_ipi._snapshot()
+        self._assertRenewed('tax', lambda: self.tax_ipi.write(
+            {'percent_amount': 11.00}))
+        self.assertEqual(snapshot.percent_amount, 10.00)
+        self.assertEqual(self.tax_ipi._snapshot().percent_amount, 11.00)
+
+    def test_operation_line_generation(self):
+        """ Test the decision tables are only renewed by the fields they
+        read """
+        line = self.operation_line
+        self._assertRenewed('operation_line', lambda: line.write(
+            {'name': 'Venda de Produção'}), renewed=False)
+        self._assertRenewed('operation_line', lambda: line.write(
+            {'date_end': '2000-01-01 00:00:00'}))
@@ -0,0 +1,46 @@
+# Copyright 2020 Akretion - Renato Lima <renato.lima@akretion.com.br>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests.common import BaseCase
+
+from ..tools import misc
+
+
+class TestCodeMatcher(BaseCase):
+
+    codes = [
+        (1, '84713012', False),
+        (2, '84713019', '01'),
+        (3, '84733041', False),
+        (4, '84733049', '02'),
+        (5, '22030000', False),
+        (6, '847130', False),
+    ]
+
+    def test_include(self):
+        """ Test include codes by prefix and exact code """
+        matcher = misc.CodeMatcher(field_codes='8471.30,2203.00.00')
+        self.assertEqual(matcher.filter(self.codes), [1, 2, 5, 6])
+
+        matcher = misc.CodeMatcher(field_codes='84713012')
+        self.assertEqual(matcher.filter(self.codes), [1])
+
+    def test_not_in(self):
+        """ Test not in codes alone and with include codes """
+        matcher = misc.CodeMatcher(
+            field_codes='8471,8473', not_in_codes='84713019,8473.30.4')
+        self.assertEqual(matcher.filter(self.codes), [1, 6])
+
+        matcher = misc.CodeMatcher(not_in_codes='84')
+        self.assertEqual(matcher.filter(self.codes), [5])
+
+    def test_exception(self):
+        """ Test exception codes """
+        matcher = misc.CodeMatcher(field_codes='84', exception_codes='01,02')
+        self.assertEqual(matcher.filter(self.codes), [2, 4])
+
+    def test_empty(self):
+        """ Test matcher without codes """
+        matcher = misc.CodeMatcher(field_codes=False)
+        self.assertFalse(matcher)
+        self.assertTrue(misc.CodeMatcher(not_in_codes='84'))
@@ -2,6 +2,7 @@
 #   Magno Costa <magno.costa@akretion.com.br>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+from odoo.exceptions import ValidationError
 from odoo.tests.common import TransactionCase
 
 from ..constants.icms import ICMS_ORIGIN_TAX_IMPORTED
@@ -784,3 +785,206 @@ class TestFiscalDocumentGeneric(TransactionCase):
             self.nfe_same_state.fiscal_operation_id.return_fiscal_operation_id.id,
             "Error on creation return"
         )
+
+    def test_document_amount(self):
+        """ Test the document totals are the sums of the line fields """
+        document = self.nfe_same_state
+        for line in document.line_ids:
+            line._onchange_fiscal_operation_line_id()
+            line._onchange_fiscal_taxes()
+
+        document._compute_amount()
+        for field_name, line_field in document._get_amount_fields().items():
+            self.assertAlmostEqual(
+                document[field_name],
+                sum(document.line_ids.mapped(line_field)),
+                msg="Error to compute the document %s" % field_name)
+
+    def test_document_amount_delta(self):
+        """ Test the document totals adjusted by the line deltas """
+        document = self.nfe_same_state
+        document._reconcile_amount()
+        line = document.line_ids[0]
+        amount_icms_value = document.amount_icms_value
+        amount_total = document.amount_total
+
+        line.write({
+            'icms_value': line.icms_value + 10.00,
+            'freight_value': line.freight_value + 5.00,
+        })
+
+        self.assertAlmostEqual(
+            document.amount_icms_value, amount_icms_value + 10.00)
+        self.assertAlmostEqual(
+            document.amount_freight_value,
+            sum(document.line_ids.mapped('freight_value')))
+        self.assertAlmostEqual(
+            document.amount_total,
+            sum(document.line_ids.mapped('amount_total')))
+        self.assertNotAlmostEqual(document.amount_total, amount_total)
+
+        # The full reconciliation gives the same totals
+        amounts = {f: document[f] for f in document._get_amount_fields()}
+        document._reconcile_amount()
+        for field_name, amount in amounts.items():
+            self.assertAlmostEqual(document[field_name], amount)
+
+    def test_document_amount_quantity(self):
+        """ Test the document totals updated by a line quantity write """
+        document = self.nfe_same_state
+        document._reconcile_amount()
+        line = document.line_ids[0]
+        amount_untaxed = document.amount_untaxed
+
+        line.write({'quantity': line.quantity + 2})
+
+        self.assertNotAlmostEqual(document.amount_untaxed, amount_untaxed)
+        self.assertAlmostEqual(
+            document.amount_untaxed,
+            sum(document.line_ids.mapped('amount_untaxed')))
+        self.assertAlmostEqual(
+            document.amount_total,
+            sum(document.line_ids.mapped('amount_total')))
+
+        line.write({'price_unit': line.price_unit + 10.00})
+        self.assertAlmostEqual(
+            document.amount_untaxed,
+            sum(document.line_ids.mapped('amount_untaxed')))
+
+    def test_document_amount_pending(self):
+        """ Test the document totals waiting for a recompute are left to
+        the ORM by the line deltas """
+        document = self.nfe_same_state
+        line = document.line_ids[0]
+        self.env.add_todo(document._fields['amount_total'], document)
+        line.write({'freight_value': line.freight_value + 3.00})
+        self.assertAlmostEqual(
+            document.amount_total,
+            sum(document.line_ids.mapped('amount_total')))
+        self.assertAlmostEqual(
+            document.amount_freight_value,
+            sum(document.line_ids.mapped('freight_value')))
+
+    def test_update_taxes_lines(self):
+        """ Test the tax fields of each line set by a multi lines update """
+        lines = self.nfe_same_state.line_ids
+        lines._map_fiscal_operation_line_taxes()
+
+        computed_lines = self.env['l10n_br_fiscal.tax'].compute_taxes_batch(
+            lines)
+        for line in lines:
+            self.assertTrue(line.cfop_id, "Error to map the line CFOP")
+            icms_tax = line.fiscal_tax_ids.filtered(
+                lambda t: t.tax_domain == 'icms')
+            self.assertEqual(line.icms_tax_id, icms_tax)
+            self.assertTrue(icms_tax, "Error to map the line ICMS")
+            computed_icms = computed_lines[line.id]['icms']
+            self.assertAlmostEqual(
+                line.icms_value, computed_icms['tax_value'],
+                msg="Error to set the ICMS value of each line")
+            self.assertAlmostEqual(
+                line.icms_base, computed_icms['base'],
+                msg="Error to set the ICMS base of each line")
+
+    def _prepare_defer_lines_values(self, document):
+        return [{
+            'name': line.name,
+            'product_id': line.product_id.id,
+            'uom_id': line.uom_id.id,
+            'uot_id': line.uot_id.id,
+            'ncm_id': line.ncm_id.id,
+            'quantity': line.quantity,
+            'price_unit': line.price_unit,
+            'fiscal_quantity': line.fiscal_quantity,
+            'fiscal_price': line.fiscal_price,
+            'partner_id': line.partner_id.id,
+            'fiscal_operation_id': line.fiscal_operation_id.id,
+        } for line in document.line_ids]
+
+    def test_defer_compute(self):
+        """ Test the document lines created with the deferred compute """
+        document = self.nfe_same_state
+        lines_values = [
+            (0, 0, values)
+            for values in self._prepare_defer_lines_values(document)]
+
+        new_document = document.with_context(
+            fiscal_defer_compute=True).copy({
+                'number': '999999',
+                'line_ids': lines_values,
+            })
+
+        self.assertEqual(
+            len(new_document.line_ids), len(document.line_ids))
+        for line in new_document.line_ids:
+            self.assertTrue(
+                line.fiscal_operation_line_id,
+                "Error to define the line fiscal operation line")
+            self.assertTrue(line.cfop_id, "Error to map the line CFOP")
+            self.assertTrue(
+                line.fiscal_tax_ids, "Error to map the line taxes")
+
+        self.assertAlmostEqual(
+            new_document.amount_total,
+            sum(new_document.line_ids.mapped('amount_total')))
+        self.assertAlmostEqual(
+            new_document.amount_icms_value,
+            sum(new_document.line_ids.mapped('icms_value')))
+
+    def test_defer_compute_write(self):
+        """ Test the document lines updated with the deferred compute """
+        document = self.nfe_same_state
+        line = document.line_ids[0]
+        line.write({'fiscal_tax_ids': [(5, 0, 0)], 'cfop_id': False})
+
+        document.with_context(fiscal_defer_compute=True).write({
+            'line_ids': [(1, line.id, {'quantity': line.quantity + 1})]})
+
+        self.assertTrue(line.cfop_id, "Error to map the updated line CFOP")
+        self.assertTrue(
+            line.fiscal_tax_ids, "Error to map the updated line taxes")
+        self.assertAlmostEqual(
+            document.amount_total,
+            sum(document.line_ids.mapped('amount_total')))
+
+    def test_check_number(self):
+        """ Test the unique document number check """
+        document = self.nfe_same_state
+        document.number = '888888'
+
+        with self.assertRaises(ValidationError), self.cr.savepoint():
+            document.copy({'number': document.number})
+
+        other_serie = document.copy({
+            'number': document.number,
+            'document_serie': 'T{}'.format(document.document_serie or ''),
+        })
+        self.assertEqual(other_serie.number, document.number)
+
+        with self.assertRaises(ValidationError), self.cr.savepoint():
+            other_serie.document_serie = document.document_serie
+
+    def test_defer_compute_lines(self):
+        """ Test the document lines created one by one with the deferred
+        compute """
+        document = self.nfe_same_state
+        new_document = document.copy({'number': '999998', 'line_ids': []})
+        line_model = self.env['l10n_br_fiscal.document.line'].with_context(
+            fiscal_defer_compute=True)
+        for values in self._prepare_defer_lines_values(document):
+            values['document_id'] = new_document.id
+            line_model.create(values)
+
+        # The line stored related fields are not deferred
+        self.env.cr.execute(
+            "SELECT DISTINCT company_id FROM l10n_br_fiscal_document_line "
+            "WHERE document_id = %s", (new_document.id,))
+        self.assertEqual(
+            self.env.cr.fetchall(), [(new_document.company_id.id,)])
+
+        new_document.action_recompute_fiscal()
+        for line in new_document.line_ids:
+            self.assertTrue(line.cfop_id, "Error to map the line CFOP")
+        self.assertAlmostEqual(
+            new_document.amount_total,
+            sum(new_document.line_ids.mapped('amount_total')))
@@ -0,0 +1,61 @@
+# Copyright 2020 Akretion - Renato Lima <renato.lima@akretion.com.br>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests.common import TransactionCase
+
+
+class TestFiscalOperation(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.nfe_other_state = self.env.ref(
+            'l10n_br_fiscal.demo_nfe_other_state')
+
+    def test_line_definition(self):
+        """ Test operation line definition follows operation lines
+        changes """
+        document = self.nfe_other_state
+        line = document.line_ids[0]
+        operation = line.fiscal_operation_id
+        operation_line = operation.line_definition(
+            document.company_id, document.partner_id, line.product_id)
+
+        self.assertTrue(operation_line, "Error to define operation line")
+        self.assertEqual(operation_line.state, 'approved')
+
+        operation_line.date_end = '2000-01-01 00:00:00'
+        self.assertNotEqual(
+            operation.line_definition(
+                document.company_id, document.partner_id, line.product_id),
+            operation_line,
+            "Error expired operation line defined")
+
+    def test_map_fiscal_taxes_batch(self):
+        """ Test batch fiscal taxes mapping matches the single mapping """
+        document = self.nfe_other_state
+        lines = document.line_ids.filtered('fiscal_operation_line_id')
+        self.assertTrue(lines)
+        for operation_line in lines.mapped('fiscal_operation_line_id'):
+            op_lines = lines.filtered(
+                lambda ln: ln.fiscal_operation_line_id == operation_line)
+            products = [
+                (line.product_id, line.ncm_id, line.nbm_id, line.nbs_id,
+                 line.cest_id) for line in op_lines] * 2
+
+            mapping_results = operation_line.map_fiscal_taxes_batch(
+                document.company_id, document.partner_id, products)
+
+            self.assertEqual(len(mapping_results), len(products))
+            for product_data, mapping_result in zip(products,
+                                                    mapping_results):
+                product, ncm, nbm, nbs, cest = product_data
+                self.assertEqual(
+                    mapping_result, operation_line.map_fiscal_taxes(
+                        document.company_id, document.partner_id,
+                        product=product, ncm=ncm, nbm=nbm, nbs=nbs,
+                        cest=cest),
+                    "Error on batch mapping of fiscal taxes")
+
+            # Same products share the same mapping result
+            self.assertIs(
+                mapping_results[0], mapping_results[len(op_lines)])
@@ -1,8 +1,15 @@
 # Copyright 2020 Akretion - Renato Lima <renato.lima@akretion.com.br>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+import unittest
+from unittest.mock import patch
+
+from odoo import tools
 from odoo.tests import common
 
+from ..models import tax as tax_module
+from ..tools.tax_kernel import numpy
+
 
 class TestFiscalTax(common.TransactionCase):
     def setUp(self):
@@ -23,3 +30,127 @@ class TestFiscalTax(common.TransactionCase):
                 "company_id": company.id,
             }
         )
+
+    def test_compute_taxes_without_operation_line(self):
+        """ Test compute taxes called without a fiscal operation line """
+        tax_model = self.env['l10n_br_fiscal.tax']
+        self.assertEqual(tax_model.compute_taxes(
+            company=self.company_lucro_presumido,
+            operation_line=False), {})
+
+        tax_ipi = self.env.ref('l10n_br_fiscal.tax_ipi_10')
+        taxes = tax_ipi.compute_taxes(
+            company=self.company_lucro_presumido,
+            fiscal_price=100.00,
+            fiscal_quantity=2.00,
+            operation_line=False)
+        self.assertEqual(taxes['ipi']['base'], 200.00)
+        self.assertEqual(taxes['ipi']['tax_value'], 20.00)
+        self.assertEqual(taxes['ipi']['cst_id'], tax_ipi.cst_out_id)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_compute_taxes_batch_order(self):
+        """ Test the vectorized and scalar modes compute the taxes in the
+        same order """
+        tax_icmsst = self.env.ref('l10n_br_fiscal.tax_icmsst_40')
+        tax_ipi = self.env.ref('l10n_br_fiscal.tax_ipi_10')
+        taxes = tax_icmsst | tax_ipi
+        self.assertEqual(taxes._sort_for_compute(), tax_ipi | tax_icmsst)
+
+        lines = self.env.ref('l10n_br_fiscal.demo_nfe_same_state').line_ids
+        vector_results = taxes.compute_taxes_batch(lines, vectorize=True)
+        scalar_results = taxes.compute_taxes_batch(lines, vectorize=False)
+        for line in lines:
+            self.assertEqual(
+                vector_results[line.id]['icmsst']['base'],
+                scalar_results[line.id]['icmsst']['base'])
+            self.assertEqual(
+                vector_results[line.id]['icmsst']['tax_value'],
+                scalar_results[line.id]['icmsst']['tax_value'])
+            self.assertEqual(
+                vector_results[line.id]['ipi']['tax_value'],
+                scalar_results[line.id]['ipi']['tax_value'])
+
+    def test_compute_taxes_cache_key_product(self):
+        """ Test the compute taxes cache key changes with the product
+        codes used when no NCM is given """
+        tax_ipi = self.env.ref('l10n_br_fiscal.tax_ipi_10')
+        product = self.env['product.product'].create({
+            'name': 'Cache Key Product',
+            'ncm_id': self.env.ref('l10n_br_fiscal.ncm_73239900').id,
+        })
+        key = tax_ipi._compute_taxes_cache_key(
+            company=self.company_lucro_presumido, product=product)
+
+        product.ncm_id = self.env.ref('l10n_br_fiscal.ncm_85014029')
+        self.assertNotEqual(key, tax_ipi._compute_taxes_cache_key(
+            company=self.company_lucro_presumido, product=product))
+
+    def test_compute_taxes_batch(self):
+        """ Test batch tax computation matches the per line computation """
+        lines = self.env.ref(
+            'l10n_br_fiscal.demo_nfe_other_state').line_ids
+        for line in lines:
+            line._onchange_product_id_fiscal()
+            line._onchange_fiscal_operation_line_id()
+
+        batch_results = self.env['l10n_br_fiscal.tax'].compute_taxes_batch(
+            lines)
+
+        for line in lines:
+            self.assertEqual(
+                batch_results[line.id],
+                line._compute_taxes(line.fiscal_tax_ids),
+                "Error on batch computation of fiscal document line taxes")
+
+    def test_compute_taxes_cache(self):
+        """ Test compute taxes results cache """
+        dbname = self.env.cr.dbname
+        self.addCleanup(tax_module.TAX_CACHES.pop, dbname, None)
+        tax_module.TAX_CACHES.pop(dbname, None)
+        config_patcher = patch.dict(
+            tools.config.options, {'fiscal_tax_cache_size': 16})
+        config_patcher.start()
+        self.addCleanup(config_patcher.stop)
+
+        line = self.env.ref(
+            'l10n_br_fiscal.demo_nfe_other_state').line_ids[0]
+        tax = self.env.ref('l10n_br_fiscal.tax_ipi_10')
+        tax_model = self.env['l10n_br_fiscal.tax']
+
+        stats = tax_model.get_compute_taxes_cache_stats()
+        self.assertEqual(stats['max_size'], 16)
+        first_result = line._compute_taxes(tax)
+        second_result = line._compute_taxes(tax)
+        new_stats = tax_model.get_compute_taxes_cache_stats()
+
+        self.assertEqual(
+            first_result, second_result,
+            "Error cached taxes differ from the computed taxes")
+        self.assertEqual(new_stats['hit'], stats['hit'] + 1)
+        self.assertEqual(new_stats['miss'], stats['miss'] + 1)
+
+        # Changing a tax invalidates the cached results
+        tax.percent_amount += 1
+        third_result = line._compute_taxes(tax)
+        self.assertEqual(
+            third_result['ipi']['percent_amount'], 11.00,
+            "Error cached taxes not invalidated on tax write")
+
+    def test_compute_taxes_dispatch(self):
+        """ Test tax domains compute methods dispatch table """
+        tax_model = self.env['l10n_br_fiscal.tax']
+        dispatch = tax_model._get_compute_dispatch()
+        tax_class = type(tax_model)
+
+        self.assertIs(dispatch['icms'], tax_class._compute_icms)
+        self.assertIs(dispatch['icmsst'], tax_class._compute_icmsst)
+        self.assertIs(dispatch['pisst'], tax_class._compute_generic)
+        self.assertIs(dispatch['others'], tax_class._compute_generic)
+
+        tax_icms = self.env.ref('l10n_br_fiscal.tax_icms_12')
+        tax_icmsst = self.env.ref('l10n_br_fiscal.tax_icmsst_40')
+        tax_ipi = self.env.ref('l10n_br_fiscal.tax_ipi_10')
+        sorted_taxes = (tax_icms | tax_icmsst | tax_ipi)._sort_for_compute()
+        self.assertEqual(sorted_taxes[:2], tax_icmsst | tax_ipi)
+        self.assertEqual(sorted_taxes[-1], tax_icms)
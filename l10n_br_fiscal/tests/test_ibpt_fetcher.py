@@ -0,0 +1,98 @@
+# Copyright 2020 Akretion - Renato Lima <renato.lima@akretion.com.br>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from odoo.tests.common import BaseCase
+
+from ..models.ibpt import taxes
+
+
+class IbptStubHandler(BaseHTTPRequestHandler):
+    """Answer the IBPT products API, failing once for the codes
+    starting with 9 to check the retries"""
+
+    failed = set()
+
+    def do_GET(self):
+        code = parse_qs(urlparse(self.path).query)['codigo'][0]
+
+        if code.startswith('9') and code not in self.failed:
+            self.failed.add(code)
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        if code.startswith('0'):
+            self.send_response(403)
+            self.end_headers()
+            return
+
+        body = json.dumps({
+            'Codigo': code,
+            'Chave': 'KEY' + code,
+            'Fonte': 'IBPT',
+            'Nacional': 13.45,
+            'Importado': 15.45,
+            'Estadual': 18.00,
+            'Municipal': 0.00,
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestIbptFetcher(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        IbptStubHandler.failed = set()
+        self.server = HTTPServer(('127.0.0.1', 0), IbptStubHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        url = 'http://127.0.0.1:{}/produtos?'.format(self.server.server_port)
+        patcher = patch.dict(taxes.WS_IBPT, {taxes.WS_PRODUTOS: url})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.config = taxes.DeOlhoNoImposto('TOKEN', '02960895000212', 'ES')
+
+    def test_fetch(self):
+        """ Test concurrent IBPT requests with retries """
+        codes = ['85030010', '85014029', '94036000', '01012100']
+        with taxes.IbptFetcher(workers=3, backoff_factor=0) as fetcher:
+            results = fetcher.fetch(
+                taxes.get_ibpt_product, self.config, codes)
+
+        self.assertEqual(set(results), set(codes))
+        self.assertEqual(results['85030010'].chave, 'KEY85030010')
+        self.assertEqual(results['85014029'].nacional, 13.45)
+
+        # Retried after the 503 response
+        self.assertEqual(results['94036000'].estadual, 18.00)
+
+        # Failures are returned, not raised
+        self.assertIsInstance(results['01012100'], Exception)
+
+    def test_rate_limiter(self):
+        """ Test the rate limiter spaces the calls """
+        limiter = taxes.RateLimiter(rate=100)
+        with patch.object(taxes.time, 'sleep') as sleep:
+            for _i in range(3):
+                limiter.wait()
+        self.assertEqual(sleep.call_count, 2)
+        for call in sleep.call_args_list:
+            self.assertLessEqual(call[0][0], 0.02)
@@ -97,3 +97,31 @@ class TestIbptProduct(common.TransactionCase):
         self.tax_estimate_model.search(
             [("ncm_id", "in", (self.ncm_85030010.id, self.ncm_85014029.id))]
         ).unlink()
+
+    def test_import_ibpt_table(self):
+        """Check tax estimates import from the IBPT table file"""
+        table = (
+            "codigo;ex;tipo;descricao;nacionalfederal;importadosfederal;"
+            "estadual;municipal;vigenciainicio;vigenciafim;chave;versao;"
+            "fonte\n"
+            "85030010;;0;Coletores;15.45;21.69;17.00;0.00;01/01/2020;"
+            "31/03/2020;B8B4F1;20.1.A;IBPT/empresometro.com.br\n"
+            "85014029;;0;Outros;13.45;19.69;17.00;0.00;01/01/2020;"
+            "31/03/2020;B8B4F1;20.1.A;IBPT/empresometro.com.br\n"
+            "99999999;;0;Sem NCM;13.45;19.69;17.00;0.00;01/01/2020;"
+            "31/03/2020;B8B4F1;20.1.A;IBPT/empresometro.com.br\n"
+        ).encode("latin-1")
+
+        estimates = self.tax_estimate_model.import_ibpt_table(table)
+
+        self.assertEqual(
+            estimates.mapped("ncm_id"), self.ncm_85030010 | self.ncm_85014029)
+        estimate = estimates.filtered(
+            lambda e: e.ncm_id == self.ncm_85030010)
+        self.assertEqual(estimate.federal_taxes_national, 15.45)
+        self.assertEqual(estimate.state_id, self.company.state_id)
+        self.assertEqual(
+            self.ncm_85030010.estimate_tax_national, 15.45 + 17.00)
+
+        # The same table version is not imported twice
+        self.assertFalse(self.tax_estimate_model.import_ibpt_table(table))
@@ -99,3 +99,26 @@ class TestIbptService(common.TransactionCase):
         self.tax_estimate_model.search(
             [("nbs_id", "in", (self.nbs_115069000.id, self.nbs_124043300.id))]
         ).unlink()
+
+    def test_estimate_tax_amount(self):
+        """Check NBS estimate tax percents from their last tax estimate"""
+        self.tax_estimate_model.create([{
+            "nbs_id": self.nbs_115069000.id,
+            "state_id": self.company.state_id.id,
+            "federal_taxes_national": 13.45,
+            "federal_taxes_import": 15.45,
+            "state_taxes": 0.00,
+            "municipal_taxes": 2.00,
+        }, {
+            "nbs_id": self.nbs_124043300.id,
+            "state_id": self.company.state_id.id,
+            "federal_taxes_national": 10.00,
+            "federal_taxes_import": 12.00,
+            "state_taxes": 0.00,
+            "municipal_taxes": 5.00,
+        }])
+
+        self.assertAlmostEqual(self.nbs_115069000.estimate_tax_national, 15.45)
+        self.assertAlmostEqual(self.nbs_115069000.estimate_tax_imported, 17.45)
+        self.assertAlmostEqual(self.nbs_124043300.estimate_tax_national, 15.00)
+        self.assertAlmostEqual(self.nbs_124043300.estimate_tax_imported, 17.00)
@@ -0,0 +1,65 @@
+# Copyright 2020 Akretion - Renato Lima <renato.lima@akretion.com.br>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests.common import TransactionCase
+
+
+class TestICMSRegulation(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.nfe_other_state = self.env.ref(
+            'l10n_br_fiscal.demo_nfe_other_state')
+
+    def test_map_difal_percents(self):
+        """ Test cached DIFAL percents match the mapped DIFAL taxes """
+        document = self.nfe_other_state
+        regulation = document.company_id.icms_regulation_id
+        for line in document.line_ids:
+            icms_taxes = regulation.map_tax_icms_difal(
+                document.company_id, document.partner_id, line.product_id,
+                line.ncm_id, line.nbm_id, line.cest_id,
+                line.fiscal_operation_line_id)
+
+            icms_dest_perc, icmsfcp_perc = regulation.map_difal_percents(
+                document.partner_id, line.product_id, line.ncm_id,
+                line.nbm_id, line.cest_id)
+
+            self.assertEqual(
+                icms_dest_perc, icms_taxes[:1].percent_amount or 0.00,
+                "Error to map DIFAL destination percent")
+
+    def test_icms_regulation_index(self):
+        """ Test ICMS regulation index follows tax definitions changes """
+        document = self.nfe_other_state
+        company = document.company_id
+        regulation = company.icms_regulation_id
+        state_to = document.partner_id.state_id
+        tax_group_icms = self.env.ref('l10n_br_fiscal.tax_group_icms')
+        tax_icms = self.env.ref('l10n_br_fiscal.tax_icms_isento').copy({
+            'name': 'ICMS Index Test'})
+
+        tax_definition = self.env['l10n_br_fiscal.tax.definition'].create({
+            'icms_regulation_id': regulation.id,
+            'tax_group_id': tax_group_icms.id,
+            'tax_id': tax_icms.id,
+            'state_from_id': company.state_id.id,
+            'state_to_ids': [(6, 0, state_to.ids)],
+        })
+
+        def index_ids():
+            return [d.id for d in regulation._index_lookup(
+                tax_group_icms, company.state_id, state_to)]
+
+        self.assertNotIn(tax_definition.id, index_ids())
+
+        tax_definition.action_approve()
+        self.assertIn(tax_definition.id, index_ids())
+        for tax_definition_index in regulation._index_lookup(
+                tax_group_icms, company.state_id, state_to):
+            definition = tax_definition.browse(tax_definition_index.id)
+            self.assertEqual(definition.state, 'approved')
+            self.assertIn(state_to, definition.state_to_ids)
+
+        tax_definition.action_draft()
+        self.assertNotIn(tax_definition.id, index_ids())
@@ -0,0 +1,162 @@
+# Copyright 2020 Akretion - Renato Lima <renato.lima@akretion.com.br>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests.common import TransactionCase
+
+from ..tools import misc
+
+
+class TestNcm(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        tax_definition_model = self.env['l10n_br_fiscal.tax.definition']
+        self.tax_definition = tax_definition_model.create({
+            'icms_regulation_id': self.env.ref(
+                'l10n_br_fiscal.tax_icms_regulation').id,
+            'tax_group_id': self.env.ref('l10n_br_fiscal.tax_group_icms').id,
+            'tax_id': self.env.ref('l10n_br_fiscal.tax_icms_isento').id,
+            'ncms': '9999.01',
+            'not_in_ncms': '9999.01.02',
+        })
+
+    def test_ncm_memberships(self):
+        """ Test NCM memberships maintained on NCMs create and write """
+        ncm_model = self.env['l10n_br_fiscal.ncm']
+        ncm_in = ncm_model.create({
+            'code': '9999.01.01',
+            'name': 'NCM Test In',
+        })
+        ncm_not_in = ncm_model.create({
+            'code': '9999.01.02',
+            'name': 'NCM Test Not In',
+        })
+
+        self.assertIn(ncm_in, self.tax_definition.ncm_ids)
+        self.assertNotIn(ncm_not_in, self.tax_definition.ncm_ids)
+
+        ncm_in.code = '9999.02.01'
+        ncm_not_in.code = '9999.01.03'
+
+        self.assertNotIn(ncm_in, self.tax_definition.ncm_ids)
+        self.assertIn(ncm_not_in, self.tax_definition.ncm_ids)
+
+        # Same result than searching the NCMs again
+        ncm_ids = self.tax_definition.ncm_ids
+        self.tax_definition.action_search_ncms()
+        self.assertEqual(self.tax_definition.ncm_ids, ncm_ids)
+
+    def test_ncm_memberships_deferred(self):
+        """ Test NCM memberships deferred while loading data """
+        ncm_model = self.env['l10n_br_fiscal.ncm']
+        ncm_in = ncm_model.with_context(defer_code_search=True).create({
+            'code': '9999.01.04',
+            'name': 'NCM Test Deferred',
+        })
+        self.assertNotIn(ncm_in, self.tax_definition.ncm_ids)
+        self.assertTrue(self.env['ir.config_parameter'].get_param(
+            'l10n_br_fiscal.ncm_memberships_pending'))
+
+        ncm_model._update_pending_memberships()
+        self.assertIn(ncm_in, self.tax_definition.ncm_ids)
+        self.assertFalse(self.env['ir.config_parameter'].get_param(
+            'l10n_br_fiscal.ncm_memberships_pending'))
+
+    def _get_ncms_domain(self, ncms, not_in_ncms, ncm_exception):
+        """Domain formerly used to search the NCMs of the NCM lists"""
+        domain = []
+        if ncms:
+            domain += misc.domain_field_codes(ncms)
+
+        if not_in_ncms:
+            domain += misc.domain_field_codes(
+                field_codes=not_in_ncms,
+                operator1='!=',
+                operator2='not ilike')
+
+        if ncm_exception:
+            domain += misc.domain_field_codes(
+                field_codes=ncm_exception,
+                field_name='exception',
+                code_size=2)
+        return domain
+
+    def test_code_matcher_domain(self):
+        """ Test the code matcher matches the NCMs of the former domain
+        search for the NCM lists of the data """
+        ncm_model = self.env['l10n_br_fiscal.ncm']
+        ncm_codes = ncm_model._get_codes()
+        domain = [
+            '|', '|',
+            ('ncms', '!=', False),
+            ('not_in_ncms', '!=', False),
+            ('ncm_exception', '!=', False),
+        ]
+        records = list(self.env['l10n_br_fiscal.tax.definition'].search(
+            domain)) + list(self.env['l10n_br_fiscal.tax.pis.cofins'].search(
+                domain))
+        self.assertTrue(records)
+
+        for record in records:
+            matcher = misc.CodeMatcher(
+                field_codes=record.ncms,
+                not_in_codes=record.not_in_ncms,
+                exception_codes=record.ncm_exception)
+
+            # Include lists without any valid code, e.g. separated by
+            # semicolons, were ignored by the domain
+            if record.ncms and not matcher.include.root:
+                self.assertEqual(matcher.filter(ncm_codes), [])
+                continue
+
+            ncm_domain = self._get_ncms_domain(
+                record.ncms, record.not_in_ncms, record.ncm_exception)
+            self.assertEqual(
+                sorted(ncm_model.search(ncm_domain).ids),
+                sorted(matcher.filter(ncm_codes)),
+                "Error matching the NCMs of {}".format(record.display_name))
+
+    def test_import_release(self):
+        """ Test the upsert of a new NCM table release """
+        ncm_model = self.env['l10n_br_fiscal.ncm']
+        tax_ipi_nt = self.env.ref('l10n_br_fiscal.tax_ipi_nt')
+        ncm_same = ncm_model.create({
+            'code': '9999.03.01',
+            'name': 'NCM Test Same',
+            'tax_ipi_id': tax_ipi_nt.id,
+        })
+        ncm_changed = ncm_model.create({
+            'code': '9999.03.02',
+            'name': 'NCM Test Changed',
+        })
+        ncm_missing = ncm_model.create({
+            'code': '9999.03.03',
+            'name': 'NCM Test Missing',
+        })
+
+        changes = ncm_model.import_release([{
+            'code': '9999.03.01',
+            'name': 'NCM Test Same',
+            'tax_ipi_id': tax_ipi_nt.id,
+        }, {
+            'code': '9999.03.02',
+            'name': 'NCM Test Changed Name',
+        }, {
+            'code': '9999.03.04',
+            'name': 'NCM Test New',
+        }], domain=[('code', '=like', '9999.03.%')])
+
+        self.assertEqual(changes['created'].code, '9999.03.04')
+        self.assertEqual(changes['updated'], ncm_changed)
+        self.assertEqual(changes['archived'], ncm_missing)
+        self.assertEqual(ncm_changed.name, 'NCM Test Changed Name')
+        self.assertTrue(ncm_same.active)
+        self.assertFalse(ncm_missing.active)
+
+        # A code back in a release is unarchived
+        changes = ncm_model.import_release([{
+            'code': '9999.03.03',
+            'name': 'NCM Test Missing',
+        }], archive_missing=False)
+        self.assertEqual(changes['updated'], ncm_missing)
+        self.assertTrue(ncm_missing.active)
@@ -0,0 +1,43 @@
+# Copyright 2020 Akretion - Renato Lima <renato.lima@akretion.com.br>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests.common import TransactionCase
+
+
+class TestTaxDefinition(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.nfe_other_state = self.env.ref(
+            'l10n_br_fiscal.demo_nfe_other_state')
+
+    def test_map_tax_definition(self):
+        """ Test tax definitions mapping from the applicability cache """
+        document = self.nfe_other_state
+        tax_definitions = self.env['l10n_br_fiscal.tax.definition'].search([])
+        for line in document.line_ids:
+            domain = [
+                ('id', 'in', tax_definitions.ids),
+                '|',
+                ('state_to_ids', '=', False),
+                ('state_to_ids', '=', document.partner_id.state_id.id),
+                '|',
+                ('ncm_ids', '=', False),
+                ('ncm_ids', '=', line.product_id.ncm_id.id),
+                '|',
+                ('nbm_ids', '=', False),
+                ('nbm_ids', '=', line.product_id.nbm_id.id),
+                '|',
+                ('cest_ids', '=', False),
+                ('cest_ids', '=', line.product_id.cest_id.id),
+                '|',
+                ('product_ids', '=', False),
+                ('product_ids', '=', line.product_id.id),
+            ]
+
+            self.assertEqual(
+                tax_definitions.map_tax_definition(
+                    document.company_id, document.partner_id,
+                    line.product_id),
+                tax_definitions.search(domain, order='id'),
+                "Error to map tax definitions")
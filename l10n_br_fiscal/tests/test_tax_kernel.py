@@ -0,0 +1,120 @@
+# Copyright 2020 Akretion - Renato Lima <renato.lima@akretion.com.br>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from unittest import skipIf
+
+from odoo.tests.common import BaseCase
+
+from ..tools import tax_kernel
+from ..tools.tax_kernel import numpy
+
+
+class TestTaxKernel(BaseCase):
+
+    def _tax(self, **values):
+        tax_values = {
+            'id': 1,
+            'name': 'Tax Test',
+            'tax_domain': 'ipi',
+            'tax_base_type': 'percent',
+            'tax_include': False,
+            'tax_withholding': False,
+            'percent_amount': 0.00,
+            'percent_reduction': 0.00,
+            'value_amount': 0.00,
+            'icms_base_type': '0',
+            'icmsst_base_type': '4',
+        }
+        tax_values.update(values)
+        return tax_kernel.TaxSnapshot(**tax_values)
+
+    def _tax_dict(self):
+        return {
+            'base_type': 'percent',
+            'percent_amount': 0.00,
+            'value_amount': 0.00,
+            'tax_value': 0.00,
+        }
+
+    def test_tax_percent(self):
+        """ Test tax with percent base type """
+        tax = self._tax(percent_amount=12.00, percent_reduction=10.00)
+        tax_dict = tax_kernel.compute_tax_base(
+            tax, self._tax_dict(), 2,
+            fiscal_price=33.33, fiscal_quantity=3.00,
+            add_to_base=10.00, remove_from_base=5.00)
+        tax_kernel.compute_tax_value(tax_dict, 2)
+
+        # (99.99 + 10.00 - 5.00) - 10.50 of reduction
+        self.assertAlmostEqual(tax_dict['base'], 94.49)
+        self.assertAlmostEqual(tax_dict['tax_value'], 11.34)
+        self.assertEqual(tax_dict['fiscal_tax_id'], 1)
+
+    def test_tax_quantity(self):
+        """ Test tax with quantity base type """
+        tax = self._tax(
+            tax_base_type='quantity', percent_amount=1.00, value_amount=0.25)
+        tax_dict = tax_kernel.compute_tax_base(
+            tax, self._tax_dict(), 2, fiscal_price=10.00, fiscal_quantity=8)
+        tax_kernel.compute_tax_value(tax_dict, 2)
+
+        self.assertEqual(tax_dict['base'], 8)
+        self.assertAlmostEqual(tax_dict['tax_value'], 2.00)
+
+    def test_tax_without_amount(self):
+        """ Test tax without percent and value has no base """
+        tax = self._tax()
+        tax_dict = tax_kernel.compute_tax_base(
+            tax, self._tax_dict(), 2, fiscal_price=10.00, fiscal_quantity=1)
+        tax_kernel.compute_tax_value(tax_dict, 2)
+
+        self.assertEqual(tax_dict['base'], 0.00)
+        self.assertEqual(tax_dict['tax_value'], 0.00)
+
+    def test_icms_difal(self):
+        """ Test ICMS DIFAL to a unique base state """
+        tax = self._tax(tax_domain='icms', percent_amount=12.00)
+        tax_dict = tax_kernel.compute_tax_base(
+            tax, self._tax_dict(), 2, fiscal_price=100.00, fiscal_quantity=1)
+        tax_kernel.compute_tax_value(tax_dict, 2)
+        tax_kernel.compute_icms_difal(tax_dict, 'SP', 18.00, 0.00, 2020, 2)
+
+        self.assertAlmostEqual(tax_dict['icms_dest_base'], 113.64)
+        self.assertAlmostEqual(tax_dict['icms_origin_value'], 0.00)
+        self.assertAlmostEqual(tax_dict['icms_dest_value'], 6.82)
+        self.assertEqual(tax_dict['icms_sharing_percent'], 100.00)
+
+    @skipIf(numpy is None, "numpy not installed")
+    def test_generic_vector(self):
+        """ Test vectorized generic taxes match the scalar computation """
+        prices = [1.005, 2.675, 10.00, 0.125, 33.33, 1234.565, 0.00]
+        quantities = [1.00, 3.00, 0.333, 7.00, 2.50, 1.00, 5.00]
+        discounts = [0.00, 0.01, 1.00, 0.00, 2.345, 0.005, 0.00]
+
+        taxes = [
+            self._tax(percent_amount=1.65),
+            self._tax(percent_amount=7.60, percent_reduction=33.33),
+            self._tax(tax_base_type='quantity', percent_amount=1.00,
+                      value_amount=0.3333),
+            self._tax(tax_base_type='fixed', value_amount=2.00),
+            self._tax(),
+        ]
+
+        for tax in taxes:
+            values = tax_kernel.compute_generic_vector(
+                tax, 2, numpy.array(prices), numpy.array(quantities),
+                numpy.array(discounts))
+
+            for i, price in enumerate(prices):
+                tax_dict = tax_kernel.compute_tax_base(
+                    tax, self._tax_dict(), 2, fiscal_price=price,
+                    fiscal_quantity=quantities[i],
+                    remove_from_base=discounts[i])
+                tax_kernel.compute_tax_value(tax_dict, 2)
+
+                self.assertEqual(values['base'][i], tax_dict['base'])
+                self.assertEqual(values['tax_value'][i], tax_dict['tax_value'])
+                self.assertEqual(
+                    values['percent_amount'], tax_dict['percent_amount'])
+                self.assertEqual(
+                    values['value_amount'], tax_dict['value_amount'])
@@ -1,3 +1,5 @@
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
+from . import copy_loader
 from . import misc
+from . import tax_kernel
@@ -0,0 +1,180 @@
+# Copyright (C) 2020  Renato Lima - Akretion <renato.lima@akretion.com.br>
+# License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
+"""Bulk loader of the fiscal codes CSV files
+
+Opt-in alternative to tools.convert_file for the big NCM, NBM, NBS and
+CEST files, enabled with the fast_load_codes option of the config file.
+The CSV file is streamed into a temporary table with COPY, then inserted
+in the model table with its xmlids and unmasked codes by a few SQL
+statements instead of creating the records one by one with the ORM.
+"""
+
+import csv
+import logging
+import os
+
+from odoo import SUPERUSER_ID, api, models
+from odoo.modules.module import get_module_resource
+
+from . import misc
+
+_logger = logging.getLogger(__name__)
+
+# Models the bulk loader can load
+COPY_MODELS = (
+    'l10n_br_fiscal.ncm',
+    'l10n_br_fiscal.nbm',
+    'l10n_br_fiscal.nbs',
+    'l10n_br_fiscal.cest',
+)
+
+TMP_TABLE = 'tmp_fiscal_copy_load'
+
+
+def copy_model_name(filename):
+    """Return the model of a CSV file the bulk loader can load or None,
+    e.g. l10n_br_fiscal.ncm for data/l10n_br_fiscal.ncm-demo.csv"""
+    basename, ext = os.path.splitext(os.path.basename(filename))
+    model_name = basename.split('-')[0]
+    if ext == '.csv' and model_name in COPY_MODELS:
+        return model_name
+    return None
+
+
+def _xmlid_parts(column, module):
+    """SQL expressions of the module and name of a CSV xmlid column"""
+    module_expr = (
+        "CASE WHEN strpos({0}, '.') > 0 THEN split_part({0}, '.', 1) "
+        "ELSE '{1}' END".format(column, module))
+    name_expr = (
+        "CASE WHEN strpos({0}, '.') > 0 THEN split_part({0}, '.', 2) "
+        "ELSE {0} END".format(column))
+    return module_expr, name_expr
+
+
+def load_csv(cr, module, filename, noupdate=True):
+    """Load a fiscal codes CSV file with COPY.
+
+    Only empty tables are loaded, so the ids of the existing records and
+    their xmlids do not need to be merged. It returns False when the file
+    was not loaded, it must then be loaded with tools.convert_file.
+    """
+    model_name = copy_model_name(filename)
+    if not model_name:
+        return False
+
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    model = env[model_name]
+    table = model._table
+
+    cr.execute('SELECT 1 FROM "{}" LIMIT 1'.format(table))
+    if cr.fetchone():
+        return False
+
+    path = get_module_resource(module, *filename.split('/'))
+    with open(path, encoding='utf-8') as csv_file:
+        header = next(csv.reader(csv_file))
+        csv_file.seek(0)
+
+        cr.execute('DROP TABLE IF EXISTS {}'.format(TMP_TABLE))
+        cr.execute('CREATE TEMPORARY TABLE {} ({})'.format(
+            TMP_TABLE, ', '.join('"{}" varchar'.format(c) for c in header)))
+        cr.copy_expert(
+            'COPY {} FROM STDIN WITH (FORMAT csv, HEADER true)'.format(
+                TMP_TABLE), csv_file)
+
+    cr.execute('ALTER TABLE {} ADD COLUMN new_id integer'.format(TMP_TABLE))
+    cr.execute("UPDATE {} SET new_id = nextval('{}_id_seq')".format(
+        TMP_TABLE, table))
+
+    columns = ['id', 'create_uid', 'create_date', 'write_uid', 'write_date']
+    values = [
+        't.new_id', '%(uid)s', "(now() at time zone 'UTC')",
+        '%(uid)s', "(now() at time zone 'UTC')"]
+    params = {'uid': SUPERUSER_ID}
+
+    loaded_fields = set()
+    for csv_column in header:
+        if csv_column == 'id':
+            continue
+
+        column = 't."{}"'.format(csv_column)
+        if csv_column.endswith(':id'):
+            field_name = csv_column[:-3]
+            module_expr, name_expr = _xmlid_parts(column, module)
+            value = (
+                "(SELECT res_id FROM ir_model_data "
+                "WHERE module = {} AND name = {})".format(
+                    module_expr, name_expr))
+        else:
+            field_name = csv_column
+            field = model._fields[field_name]
+            value = "NULLIF({}, '')::{}".format(column, field.column_type[1])
+
+        loaded_fields.add(field_name)
+        columns.append(field_name)
+        values.append(value)
+
+    if 'code' in loaded_fields and 'code_unmasked' in model._fields:
+        loaded_fields.add('code_unmasked')
+        columns.append('code_unmasked')
+        values.append("regexp_replace(t.code, '[[:punct:]]', '', 'g')")
+
+    # Default values of the other stored fields
+    default_fields = [
+        name for name, field in model._fields.items()
+        if field.store and field.column_type
+        and name not in loaded_fields
+        and name not in models.MAGIC_COLUMNS]
+    for name, value in model.default_get(default_fields).items():
+        field = model._fields[name]
+        columns.append(name)
+        values.append('%({})s'.format(name))
+        params[name] = field.convert_to_column(value, model)
+
+    cr.execute('INSERT INTO "{}" ({}) SELECT {} FROM {} t'.format(
+        table, ', '.join('"{}"'.format(c) for c in columns),
+        ', '.join(values), TMP_TABLE), params)
+    count = cr.rowcount
+
+    # xmlids of the records
+    module_expr, name_expr = _xmlid_parts('t.id', module)
+    cr.execute(
+        "INSERT INTO ir_model_data (module, name, model, res_id, noupdate, "
+        "date_init, date_update) "
+        "SELECT {}, {}, %(model)s, t.new_id, %(noupdate)s, "
+        "(now() at time zone 'UTC'), (now() at time zone 'UTC') "
+        "FROM {} t".format(module_expr, name_expr, TMP_TABLE),
+        {'model': model_name, 'noupdate': noupdate})
+
+    cr.execute('DROP TABLE {}'.format(TMP_TABLE))
+    model.invalidate_cache()
+
+    if 'ncms' in loaded_fields:
+        _expand_ncms(env, model)
+
+    _logger.info("%s records of %s loaded with COPY", count, model_name)
+    return True
+
+
+def _expand_ncms(env, model):
+    """Fill the ncm_ids of the loaded records matching their ncms lists"""
+    ncm_codes = env['l10n_br_fiscal.ncm']._get_codes()
+    ncm_field = model._fields['ncm_ids']
+
+    record_ids = []
+    ncm_ids = []
+    for record in model.search_read([('ncms', '!=', False)], ['ncms']):
+        matched = misc.CodeMatcher(
+            field_codes=record['ncms']).filter(ncm_codes)
+        record_ids += [record['id']] * len(matched)
+        ncm_ids += matched
+
+    if record_ids:
+        env.cr.execute(
+            "INSERT INTO {0} ({1}, {2}) "
+            "SELECT * FROM unnest(%s::int[], %s::int[]) "
+            "ON CONFLICT DO NOTHING".format(
+                ncm_field.relation, ncm_field.column1, ncm_field.column2),
+            (record_ids, ncm_ids))
+        model.invalidate_cache(['ncm_ids'])
@@ -24,3 +24,73 @@ def domain_field_codes(field_codes, field_name="code_unmasked",
             domain.append((field_name, operator2, n + '%'))
 
     return domain
+
+
+class CodeTrie(object):
+    """Prefix trie of a comma separated list of codes, it matches the
+    same codes of the domain_field_codes domain: a code with code_size
+    characters must be equal to the code, a shorter one is a prefix."""
+
+    _EXACT = 0
+    _PREFIX = 1
+
+    def __init__(self, field_codes, delimiter=",", code_size=8):
+        self.root = {}
+        for code in field_codes.replace('.', '').split(delimiter):
+            if len(code) > code_size:
+                continue
+            node = self.root
+            for char in code.lower():
+                node = node.setdefault(char, {})
+            node[self._EXACT if len(code) == code_size else self._PREFIX] = 1
+
+    def match(self, code):
+        if code is None or code is False:
+            return False
+
+        node = self.root
+        if self._PREFIX in node:
+            return True
+
+        for char in code.lower():
+            node = node.get(char)
+            if node is None:
+                return False
+            if self._PREFIX in node:
+                return True
+
+        return self._EXACT in node
+
+
+class CodeMatcher(object):
+    """Match codes against the include, not in and exception code lists
+    of the tax definitions in memory, in a single pass over the codes.
+
+    A code matches if it matches any code of the include list, none of
+    the not in list, and if its exception matches any code of the
+    exception list. Empty lists are ignored, like in the domain built
+    with domain_field_codes.
+    """
+
+    def __init__(self, field_codes=None, not_in_codes=None,
+                 exception_codes=None, code_size=8):
+        self.include = field_codes and CodeTrie(
+            field_codes, code_size=code_size)
+        self.exclude = not_in_codes and CodeTrie(
+            not_in_codes, code_size=code_size)
+        self.exception = exception_codes and CodeTrie(
+            exception_codes, code_size=2)
+
+    def __bool__(self):
+        return bool(self.include or self.exclude or self.exception)
+
+    def match(self, code, exception=None):
+        return ((not self.include or self.include.match(code))
+                and not (self.exclude and self.exclude.match(code))
+                and (not self.exception or self.exception.match(exception)))
+
+    def filter(self, codes):
+        """Return the ids of the (id, code, exception) codes matching"""
+        return [
+            code_id for code_id, code, exception in codes
+            if self.match(code, exception)]
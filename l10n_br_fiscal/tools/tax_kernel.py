@@ -0,0 +1,232 @@
+# Copyright (C) 2020  Renato Lima - Akretion <renato.lima@akretion.com.br>
+# License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
+"""Tax computation kernel
+
+Pure Python implementation of the fiscal tax arithmetic. It works over
+TaxSnapshot tuples holding the plain values of a l10n_br_fiscal.tax
+record, so it does not need an Odoo environment: the ORM layer only
+builds the snapshots, feeds the line inputs and writes the results.
+"""
+
+import logging
+from collections import namedtuple
+
+from ..constants.icms import (
+    ICMS_DIFAL_PARTITION,
+    ICMS_DIFAL_UNIQUE_BASE,
+    ICMS_DIFAL_DOUBLE_BASE,
+)
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    _logger.debug("Python library numpy not installed, tax kernel "
+                  "vectorized mode disabled.")
+
+TaxSnapshot = namedtuple('TaxSnapshot', [
+    'id',
+    'name',
+    'tax_domain',
+    'tax_base_type',
+    'tax_include',
+    'tax_withholding',
+    'percent_amount',
+    'percent_reduction',
+    'value_amount',
+    'icms_base_type',
+    'icmsst_base_type',
+])
+
+
+def compute_tax_base(tax, tax_dict, precision, fiscal_price=0.00,
+                     fiscal_quantity=0.00, add_to_base=0.00,
+                     remove_from_base=0.00, compute_reduction=True):
+    """Update tax_dict with the tax base of the TaxSnapshot tax"""
+    tax_dict["name"] = tax.name
+    tax_dict["base_type"] = tax.tax_base_type
+    tax_dict["tax_include"] = tax.tax_include
+    tax_dict["tax_withholding"] = tax.tax_withholding
+    tax_dict["fiscal_tax_id"] = tax.id
+    tax_dict["tax_domain"] = tax.tax_domain
+    tax_dict["percent_reduction"] = tax.percent_reduction
+
+    base = 0.00
+
+    if not tax_dict.get("percent_amount") and tax.percent_amount:
+        tax_dict["percent_amount"] = tax.percent_amount
+        tax_dict["value_amount"] = tax.value_amount
+
+    if tax_dict["base_type"] in ("percent", "fixed"):
+        # Compute initial Tax Base for base_type Percent and Fixed
+        base = round(fiscal_price * fiscal_quantity, precision)
+
+    if tax_dict["base_type"] == "quantity":
+        # Compute initial Tax Base for base_type Quantity
+        base = fiscal_quantity
+
+    # Update Base Value
+    base_amount = (base + add_to_base) - remove_from_base
+
+    # Compute Tax Base Reduction
+    base_reduction = round(
+        base_amount * abs(tax.percent_reduction / 100), precision)
+
+    # Compute Tax Base Amount
+    if compute_reduction:
+        base_amount -= base_reduction
+
+    if not tax.percent_amount and not tax.value_amount:
+        tax_dict["base"] = 0.00
+    else:
+        tax_dict["base"] = base_amount
+
+    return tax_dict
+
+
+def compute_tax_value(tax_dict, precision):
+    """Update tax_dict with the tax value computed over its base"""
+    base_amount = tax_dict.get("base", 0.00)
+
+    if tax_dict["base_type"] == "percent":
+        tax_dict["tax_value"] = round(
+            base_amount * (tax_dict["percent_amount"] / 100), precision)
+
+    if tax_dict["base_type"] in ("quantity", "fixed"):
+        tax_dict["tax_value"] = round(
+            base_amount * tax_dict["value_amount"], precision)
+
+    return tax_dict
+
+
+def difal_partition(year):
+    """ICMS DIFAL sharing percents between origin and destination states"""
+    return ICMS_DIFAL_PARTITION[min(max(year, 2016), 2019)]
+
+
+def compute_icms_difal(tax_dict, state_to_code, icms_dest_perc,
+                       icmsfcp_perc, year, precision):
+    """Update the ICMS tax_dict with the interstate DIFAL values
+
+    :param state_to_code: code of the destination state (partner state)
+    :param icms_dest_perc: ICMS internal percent of the destination state
+    :param icmsfcp_perc: ICMS FCP percent of the destination state
+    :param year: year of the operation, defines the DIFAL partition
+    """
+    # Difal - Origin Percent
+    icms_origin_perc = tax_dict.get('percent_amount')
+
+    # Difal - Base
+    icms_base = tax_dict.get('base')
+    difal_icms_base = 0.00
+
+    if state_to_code in ICMS_DIFAL_UNIQUE_BASE:
+        difal_icms_base = round(
+            icms_base / (1 - ((icms_origin_perc + icmsfcp_perc) / 100)),
+            precision)
+
+    if state_to_code in ICMS_DIFAL_DOUBLE_BASE:
+        difal_icms_base = round(
+            icms_base / (1 - ((icms_dest_perc + icmsfcp_perc) / 100)),
+            precision)
+
+    origin_value = round(
+        difal_icms_base * (icms_origin_perc / 100), precision)
+    dest_value = round(
+        difal_icms_base * (icms_dest_perc / 100), precision)
+
+    difal_value = dest_value - origin_value
+
+    # Difal - Sharing Percent
+    tax_dict.update(difal_partition(year))
+
+    difal_share_origin = tax_dict.get('difal_origin_perc')
+    difal_share_dest = tax_dict.get('difal_dest_perc')
+
+    difal_origin_value = round(
+        difal_value * difal_share_origin / 100, precision)
+    difal_dest_value = round(
+        difal_value * difal_share_dest / 100, precision)
+
+    tax_dict.update({
+        'icms_origin_perc': icms_origin_perc,
+        'icms_dest_perc': icms_dest_perc,
+        'icms_dest_base': difal_icms_base,
+        'icms_sharing_percent': difal_share_dest,
+        'icms_origin_value': difal_origin_value,
+        'icms_dest_value': difal_dest_value,
+    })
+
+    return tax_dict
+
+
+def round_array(values, precision):
+    """Round each element of a numpy array exactly like the builtin
+    round(value, precision).
+
+    numpy.round scales the values before rounding, so values lying on a
+    half (e.g. 1.005) may end on the other side of the tie. Those few
+    elements are rounded again with the builtin round.
+    """
+    rounded = numpy.round(values, precision)
+    scaled = values * 10 ** precision
+    ties = numpy.abs(
+        numpy.abs(scaled - numpy.trunc(scaled)) - 0.5) < 1e-6
+    for i in numpy.flatnonzero(ties):
+        rounded[i] = round(float(values[i]), precision)
+    return rounded
+
+
+def compute_generic_vector(tax, precision, fiscal_price, fiscal_quantity,
+                           discount_value):
+    """Vectorized equivalent of the generic tax computation (tax base
+    followed by the tax value) for many lines sharing the same tax.
+
+    :param tax: TaxSnapshot
+    :param fiscal_price: numpy array with the fiscal price of each line
+    :param fiscal_quantity: numpy array with the fiscal quantity
+    :param discount_value: numpy array with the discount removed from base
+    :return: dict of the scalar tax values shared by all lines and
+        the numpy arrays 'base' and 'tax_value', one element per line
+    """
+    percent_amount = tax.percent_amount or 0.00
+    value_amount = tax.value_amount if tax.percent_amount else 0.00
+
+    if tax.tax_base_type == "quantity":
+        base = numpy.array(fiscal_quantity, dtype=float)
+    elif tax.tax_base_type in ("percent", "fixed"):
+        base = round_array(fiscal_price * fiscal_quantity, precision)
+    else:
+        base = numpy.zeros(len(fiscal_quantity))
+
+    base_amount = base - discount_value
+    base_reduction = round_array(
+        base_amount * abs(tax.percent_reduction / 100), precision)
+    base_amount = base_amount - base_reduction
+
+    if not tax.percent_amount and not tax.value_amount:
+        base_amount = numpy.zeros(len(base_amount))
+
+    if tax.tax_base_type == "percent":
+        tax_value = round_array(
+            base_amount * (percent_amount / 100), precision)
+    elif tax.tax_base_type in ("quantity", "fixed"):
+        tax_value = round_array(base_amount * value_amount, precision)
+    else:
+        tax_value = numpy.zeros(len(base_amount))
+
+    return {
+        "name": tax.name,
+        "base_type": tax.tax_base_type,
+        "tax_include": tax.tax_include,
+        "tax_withholding": tax.tax_withholding,
+        "fiscal_tax_id": tax.id,
+        "tax_domain": tax.tax_domain,
+        "percent_amount": percent_amount,
+        "percent_reduction": tax.percent_reduction,
+        "value_amount": value_amount,
+        "base": base_amount,
+        "tax_value": tax_value,
+    }
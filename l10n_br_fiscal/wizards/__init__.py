@@ -4,3 +4,5 @@ from . import wizard_document_status
 from . import wizard_document_cancel
 from . import wizard_document_correction
 from . import wizard_document_invalidate
+from . import wizard_release_import
+from . import wizard_tax_estimate_import
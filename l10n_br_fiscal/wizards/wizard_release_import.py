@@ -0,0 +1,137 @@
+# Copyright (C) 2020  Renato Lima - Akretion <renato.lima@akretion.com.br>
+# License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
+
+import base64
+import csv
+import io
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+# Maximum of codes listed by change in the import report
+REPORT_CODES_LIMIT = 100
+
+
+class ReleaseImportWizard(models.TransientModel):
+    _name = "l10n_br_fiscal.release.import.wizard"
+    _description = "Fiscal Official Table Release Import"
+
+    model_name = fields.Selection(
+        selection=[
+            ("l10n_br_fiscal.ncm", "NCM"),
+            ("l10n_br_fiscal.cest", "CEST")],
+        string="Table",
+        required=True,
+        default="l10n_br_fiscal.ncm")
+
+    data = fields.Binary(
+        string="Release File",
+        required=True,
+        help="CSV file with the same columns than the module data files, "
+             "e.g. code, exception, name and tax_ipi_id:id for NCMs.")
+
+    filename = fields.Char(
+        string="File Name")
+
+    archive_missing = fields.Boolean(
+        string="Archive Missing Codes",
+        default=True,
+        help="Archive the codes not found in the release file.")
+
+    state = fields.Selection(
+        selection=[
+            ("init", "Init"),
+            ("done", "Done")],
+        string="State",
+        readonly=True,
+        default="init")
+
+    created_count = fields.Integer(
+        string="Created",
+        readonly=True)
+
+    updated_count = fields.Integer(
+        string="Updated",
+        readonly=True)
+
+    archived_count = fields.Integer(
+        string="Archived",
+        readonly=True)
+
+    report = fields.Text(
+        string="Report",
+        readonly=True)
+
+    @api.multi
+    def _read_rows(self):
+        """Return the field values of the release file rows"""
+        self.ensure_one()
+        model = self.env[self.model_name]
+        content = base64.b64decode(self.data).decode("utf-8-sig")
+        reader = csv.DictReader(io.StringIO(content))
+
+        columns = {}
+        for column in reader.fieldnames or []:
+            if column == "id":
+                continue
+            field_name = column[:-3] if column.endswith(":id") else column
+            if field_name not in model._fields:
+                raise UserError(
+                    _("Unknown column %s in the release file.") % column)
+            columns[column] = field_name
+
+        if "code" not in columns:
+            raise UserError(_("The release file has no code column."))
+
+        xmlids = {}
+        rows = []
+        for line in reader:
+            row = {}
+            for column, field_name in columns.items():
+                value = line[column] or False
+                if value and column.endswith(":id"):
+                    if value not in xmlids:
+                        xmlid = value if "." in value else (
+                            "l10n_br_fiscal." + value)
+                        record = self.env.ref(xmlid, False)
+                        if not record:
+                            raise UserError(
+                                _("Record %s not found.") % xmlid)
+                        xmlids[value] = record.id
+                    value = xmlids[value]
+                row[field_name] = value
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _report_codes(title, records):
+        codes = records[:REPORT_CODES_LIMIT].mapped("code")
+        if len(records) > REPORT_CODES_LIMIT:
+            codes.append("...")
+        return "{} ({}): {}".format(title, len(records), ", ".join(codes))
+
+    @api.multi
+    def action_import(self):
+        self.ensure_one()
+        changes = self.env[self.model_name].import_release(
+            self._read_rows(), archive_missing=self.archive_missing)
+
+        self.write({
+            "state": "done",
+            "created_count": len(changes["created"]),
+            "updated_count": len(changes["updated"]),
+            "archived_count": len(changes["archived"]),
+            "report": "\n\n".join([
+                self._report_codes(_("Created"), changes["created"]),
+                self._report_codes(_("Updated"), changes["updated"]),
+                self._report_codes(_("Archived"), changes["archived"]),
+            ]),
+        })
+
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
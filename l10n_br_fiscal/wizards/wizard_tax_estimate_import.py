@@ -0,0 +1,58 @@
+# Copyright (C) 2020  Renato Lima - Akretion <renato.lima@akretion.com.br>
+# License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
+
+import base64
+
+from odoo import api, fields, models
+
+
+class TaxEstimateImportWizard(models.TransientModel):
+    _name = "l10n_br_fiscal.tax.estimate.import.wizard"
+    _description = "Fiscal Tax Estimate Table Import"
+
+    state_id = fields.Many2one(
+        comodel_name="res.country.state",
+        string="State",
+        required=True,
+        domain="[('country_id.code', '=', 'BR')]",
+        default=lambda self: self.env.user.company_id.state_id)
+
+    data = fields.Binary(
+        string="IBPT Table File",
+        required=True,
+        help="Table file TabelaIBPTax<UF>.csv distributed by IBPT "
+             "(De Olho no Imposto).")
+
+    filename = fields.Char(
+        string="File Name")
+
+    state = fields.Selection(
+        selection=[
+            ("init", "Init"),
+            ("done", "Done")],
+        string="Status",
+        readonly=True,
+        default="init")
+
+    estimate_count = fields.Integer(
+        string="Imported Tax Estimates",
+        readonly=True)
+
+    @api.multi
+    def action_import(self):
+        self.ensure_one()
+        estimates = self.env["l10n_br_fiscal.tax.estimate"].import_ibpt_table(
+            base64.b64decode(self.data), self.state_id)
+
+        self.write({
+            "state": "done",
+            "estimate_count": len(estimates),
+        })
+
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
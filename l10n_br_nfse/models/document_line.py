@@ -61,11 +61,10 @@ class DocumentLine(models.Model):
             if city_id:
                 self.city_taxation_code_id = city_id
 
-    def _compute_taxes(self, taxes, cst=None):
-        discount_value = self.discount_value
-        self.discount_value += self.fiscal_deductions_value
-        res = super(DocumentLine, self)._compute_taxes(taxes, cst)
-        self.discount_value = discount_value
+    def _prepare_compute_taxes_kwargs(self):
+        res = super(DocumentLine, self)._prepare_compute_taxes_kwargs()
+        res['discount_value'] = (
+            self.discount_value + self.fiscal_deductions_value)
         return res
 
     @api.model
@@ -28,7 +28,10 @@ class L10nBrWebsiteSale(WebsiteSale):
             line._onchange_commercial_quantity()
             line._onchange_ncm_id()
             line._onchange_fiscal_operation_id()
-            line._onchange_fiscal_operation_line_id()
+
+        order.order_line._map_fiscal_operation_line_taxes()
+
+        for line in order.order_line:
             line._onchange_fiscal_taxes()
 
         return super(L10nBrWebsiteSale, self).confirm_order(**post)